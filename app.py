@@ -1,11 +1,23 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, session, Response, stream_with_context, make_response
 import music_api_handler # 我们的核心逻辑模块
+import download_jobs # 后台下载任务
+import library_index # 本地曲库索引
+import stream_proxy # 播放代理（边播边缓存）
+import playlist_export # 歌单 ZIP 流式导出
+import cover_store # 本地封面缓存
+import playlist_import # 歌单批量导入
+import session_store # 服务端会话
+import history_buffer # 播放历史后台批量写入
+import prefetch # 下一首后台预取
+import atexit
 import logging
+import json
 from datetime import datetime
 import database # 导入我们的数据库模块
 from functools import wraps # 导入 wraps
 import time # 新增导入
+from urllib.parse import quote
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24) # 用于 flash messages 和 session
@@ -16,6 +28,23 @@ MAX_HISTORY_ITEMS = 10
 MAX_RECENT_SEARCHES = 8
 # 旧文件最大保留天数
 MAX_FILE_AGE_DAYS = 7 # 新增常量
+# 后台下载线程数和排队上限
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_MAX_PENDING_JOBS = 64
+# SSE 进度推送的检查间隔（秒）和单个连接的最长持续时间（秒）
+DOWNLOAD_EVENTS_INTERVAL = 0.5
+DOWNLOAD_EVENTS_MAX_SECONDS = 300
+# 本地封面文件名包含内容哈希，可长期缓存（秒）
+COVER_CACHE_MAX_AGE = 365 * 24 * 3600
+# /cover 跳转结果的缓存时间（秒）
+COVER_REDIRECT_MAX_AGE = 24 * 3600
+# 歌单导出时等待单首歌曲下载完成的最长时间（秒）
+EXPORT_SONG_TIMEOUT = 300
+# 播放页发送后在后台预取下一首的详情和歌词（默认关闭）；PREFETCH_NEXT_AUDIO 同时预取音频开头
+PREFETCH_NEXT_TRACK = False
+PREFETCH_NEXT_AUDIO = False
+# 服务端会话存储: 'sqlite'（应用目录下的 sessions.db）或 'file'（应用目录下的 sessions/ 目录）
+SESSION_STORE = 'sqlite'
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,11 +60,67 @@ TEMP_PATH = os.path.join(APP_STATIC_FOLDER, music_api_handler.TEMP_DIR_NAME)
 os.makedirs(DOWNLOAD_PATH, exist_ok=True)
 os.makedirs(TEMP_PATH, exist_ok=True)
 
+# 本地曲库索引（SQLite），下载前先查询，命中时不访问上游
+LIBRARY_INDEX_PATH = os.path.join(app.root_path, library_index.LIBRARY_INDEX_FILENAME)
+library = library_index.LibraryIndex(LIBRARY_INDEX_PATH, APP_STATIC_FOLDER)
+
+# 服务端会话：Cookie 中只保存会话 ID，播放历史、最近搜索等数据保存在服务端，按键延迟加载
+if SESSION_STORE == 'file':
+    SESSION_STORE_PATH = os.path.join(app.root_path, session_store.SESSION_STORE_DIR_NAME)
+else:
+    SESSION_STORE_PATH = os.path.join(app.root_path, session_store.SESSION_STORE_FILENAME)
+app.session_interface = session_store.ServerSideSessionInterface(session_store.create_store(SESSION_STORE, SESSION_STORE_PATH))
+
+# 登录用户的播放历史保存在数据库中，由后台线程批量写入；进程退出前写入剩余记录
+history_writer = history_buffer.HistoryWriter(database.add_play_history_entries)
+atexit.register(history_writer.close)
+
+# 下一首预取（PREFETCH_NEXT_TRACK 开启时创建）
+def _prefetch_audio_head(song_details, cancelled):
+    if library.lookup_title(song_details.get('title'), song_details.get('singer')) is not None:
+        return # 曲库中已有，播放时直接读取本地文件
+    stream_proxy.prefetch_head(song_details, APP_STATIC_FOLDER, prefetch.PREFETCH_AUDIO_BYTES, cancelled)
+
+next_track_prefetcher = None
+if PREFETCH_NEXT_TRACK:
+    next_track_prefetcher = prefetch.Prefetcher(
+        music_api_handler.get_song_details,
+        warm_audio=_prefetch_audio_head if PREFETCH_NEXT_AUDIO else None
+    )
+
+# 后台下载任务管理器
+download_job_manager = download_jobs.DownloadJobManager(
+    APP_STATIC_FOLDER,
+    max_workers=DOWNLOAD_WORKERS,
+    max_pending=DOWNLOAD_MAX_PENDING_JOBS,
+    library=library
+)
+
+# 本地封面缓存：页面缩略图和 ID3 封面都使用这里的文件，每个封面只从上游下载一次
+COVERS_PATH = os.path.join(APP_STATIC_FOLDER, cover_store.COVER_STORE_DIR_NAME)
+covers = cover_store.CoverStore(COVERS_PATH, app.secret_key)
+music_api_handler.configure_cover_source(covers.load_for_embedding)
+
+# 播放代理：本地没有文件时由服务器拉取上游音频并写入断点文件，多个播放连接共享同一次传输
+stream_proxy_manager = stream_proxy.StreamProxy(APP_STATIC_FOLDER)
+
 # --- 上下文处理器，注入全局变量到模板 ---
 @app.context_processor
 def inject_current_year():
     return {'current_year': datetime.now().year}
 
+@app.context_processor
+def inject_cover_src():
+    def cover_src(cover_url, size='thumb'):
+        """封面图片地址：已缓存时直接返回带内容哈希的本地地址，否则经 /cover 获取后跳转。"""
+        if not cover_url:
+            return url_for('static', filename='images/default_cover.png')
+        filename = covers.variant_filename(cover_url, size)
+        if filename:
+            return url_for('cover_file', filename=filename)
+        return url_for('cover_image', url=cover_url, size=size, sig=covers.sign(cover_url))
+    return {'cover_src': cover_src}
+
 # --- 文件清理函数 ---
 def cleanup_old_files(folder_path, max_age_days):
     """清理指定文件夹中超过指定天数的旧文件"""
@@ -72,6 +157,39 @@ with app.app_context():
     # 应用启动时清理旧文件
     cleanup_old_files(DOWNLOAD_PATH, MAX_FILE_AGE_DAYS)
     cleanup_old_files(TEMP_PATH, MAX_FILE_AGE_DAYS)
+    # 整理上次运行遗留的未完成下载，保留可续传的部分
+    music_api_handler.recover_partial_downloads(APP_STATIC_FOLDER)
+
+# --- Request-scoped database access ---
+@app.before_request
+def begin_db_request_scope():
+    # 每个请求最多占用一个数据库连接（首次查询时借出），在 teardown 中归还
+    database.begin_request_scope()
+
+@app.teardown_request
+def end_db_request_scope(exc):
+    stats = database.end_request_scope()
+    if stats and stats['queries']:
+        app.logger.debug(f"{request.method} {request.path}: {stats['queries']} 次数据库查询，"
+                         f"耗时 {stats['query_ms']:.1f}ms，借出连接 {stats['checkouts']} 次")
+
+def _prefetch_owner(current_session=None):
+    # 按会话 ID 区分用户（同一出口 IP 后的多个用户互不影响）；从未保存过的新会话没有 ID，不参与预取
+    return getattr(current_session if current_session is not None else session, 'sid', None)
+
+@app.before_request
+def cancel_next_track_prefetch():
+    # 用户打开新页面（包括另一首歌的播放页）时取消其尚未完成的预取；播放页加载的音频、歌词等子请求不受影响。
+    # 打开的正是预取的那首歌时保留预取，播放页和音频流会直接使用它的结果
+    if next_track_prefetcher is None or request.headers.get('Sec-Fetch-Dest') != 'document':
+        return
+    owner = _prefetch_owner()
+    if not owner:
+        return
+    keep = None
+    if request.endpoint == 'song_player' and request.view_args:
+        keep = (request.view_args['query'], request.view_args['song_api_index'])
+    next_track_prefetcher.cancel(owner, keep=keep)
 
 # --- User Authentication Helper ---
 def login_required(f):
@@ -142,28 +260,36 @@ def song_player(query, song_api_index):
     playlist_songs = []
     search_results = []
     
+    user_playlists = []
     if source == 'playlist' and playlist_id:
-        # 从歌单播放
         try:
             playlist_id = int(playlist_id)
-            if 'user_id' in session:  # 用户已登录
-                playlist = database.get_playlist_by_id(playlist_id, session.get('user_id'))
-            
-            if playlist:
-                playlist_songs = database.get_songs_in_playlist(playlist_id)
-                app.logger.info(f"从歌单播放，获取到 {len(playlist_songs)} 首歌曲")
-            else:
-                # 如果未找到歌单或无权访问，回退到搜索结果
-                app.logger.warning(f"歌单 ID {playlist_id} 未找到或无权访问，回退到搜索结果")
-                source = 'search'
         except (ValueError, TypeError) as e:
             app.logger.error(f"处理歌单 ID 时出错: {e}")
-            source = 'search'
+            playlist_id = None
+    else:
+        playlist_id = None
+
+    if 'user_id' in session:  # 用户已登录
+        # 当前歌单、歌单歌曲和用户的歌单列表一次查询取回
+        player_context = database.get_player_context(session['user_id'], playlist_id)
+        playlist = player_context['playlist']
+        user_playlists = player_context['user_playlists']
+        if playlist:
+            playlist_songs = player_context['songs']
+            app.logger.info(f"从歌单播放，获取到 {len(playlist_songs)} 首歌曲")
+
+    if source == 'playlist' and not playlist:
+        # 如果未找到歌单或无权访问，回退到搜索结果
+        app.logger.warning(f"歌单 ID {playlist_id} 未找到或无权访问，回退到搜索结果")
+        source = 'search'
     
-    # 如果来源是搜索或无法获取歌单，则获取搜索结果
-    if source == 'search' or not playlist_songs:
+    # 来源是搜索（或无法获取歌单）时才获取搜索结果；歌单为空时不再额外搜索
+    if source == 'search':
         try:
-            search_results = music_api_handler.search_music(query) or []
+            # 查询上游期间不占用数据库连接
+            with database.released_request_connection():
+                search_results = music_api_handler.search_music(query) or []
             app.logger.info(f"从搜索结果播放，获取到 {len(search_results)} 首歌曲")
         except Exception as e:
             app.logger.warning(f"获取搜索结果列表失败: {e}")
@@ -258,8 +384,16 @@ def song_player(query, song_api_index):
         except Exception as e:
             app.logger.error(f"确定上一首/下一首歌曲时出错: {e}")
 
-    # 添加到播放历史记录
-    if song_details and 'url' in song_details:
+    # 添加到播放历史记录：登录用户写入数据库（后台批量），未登录用户保存在 session 中
+    if song_details and 'url' in song_details and 'user_id' in session:
+        history_writer.record(session['user_id'], {
+            'song_api_index': str(song_api_index),
+            'song_query': query,
+            'title': song_details.get('title', '未知歌曲'),
+            'singer': song_details.get('singer', '未知歌手'),
+            'cover': song_details.get('cover', ''),
+        })
+    elif song_details and 'url' in song_details:
         # 初始化session中的历史记录（如果不存在）
         if 'play_history' not in session:
             session['play_history'] = []
@@ -288,35 +422,22 @@ def song_player(query, song_api_index):
         session['play_history'] = play_history
         session.modified = True
 
-    user_playlists = []
-    if 'user_id' in session:
-        user_playlists = database.get_playlists_by_user_id(session['user_id'])
-
-    parsed_lyrics = []
-    if song_details.get('lyric'):
-        lines = song_details['lyric'].strip().split('\n')
-        for line in lines:
-            parsed_line = music_api_handler.parse_lrc_line(line)
-            if parsed_line:
-                parsed_lyrics.append({'time_ms': parsed_line[0], 'text': parsed_line[1]})
-            # else:
-                # If you want to include lines without timestamps, handle them here.
-                # For example, add them with a time_ms of 0 or a special flag.
-                # parsed_lyrics.append({'time_ms': 0, 'text': line}) # Example
+    # 歌词不再内联到页面中，播放页通过 /lyrics 接口按需加载（LyricIndex 随详情缓存）
+    lyric_index = music_api_handler.get_lyric_index(song_details)
 
     # 如果API返回的歌曲URL是相对路径或需要特殊处理，在这里调整
     # song_details['url'] = make_url_absolute_if_needed(song_details['url'])
 
     app.logger.info(f"歌曲详情: {song_details.get('title')}, 播放链接: {song_details.get('url')}")
-    if parsed_lyrics:
-        app.logger.info(f"解析到 {len(parsed_lyrics)} 行带时间戳的歌词。")
+    if len(lyric_index):
+        app.logger.info(f"解析到 {len(lyric_index)} 行带时间戳的歌词。")
     else:
         app.logger.info("未解析到带时间戳的歌词，将显示原始歌词文本。")
         
-    return render_template(
+    response = make_response(render_template(
         'song_player.html',
         song_details=song_details,
-        parsed_lyrics=parsed_lyrics,
+        has_lyrics=bool(song_details.get('lyric')),
         original_query=query, 
         song_api_index=song_api_index, 
         search_results=search_results, 
@@ -327,58 +448,260 @@ def song_player(query, song_api_index):
         playlist=playlist,
         playlist_songs=playlist_songs if source == 'playlist' else None,
         playlist_id=playlist_id if source == 'playlist' else None
-    )
+    ))
+    if next_track_prefetcher is not None and next_song_nav:
+        # 响应发送完成后再开始预取，不与当前页面争抢上游；此时会话已保存，新会话也已分配 ID
+        current_session = session._get_current_object()
+
+        def schedule_prefetch():
+            owner = _prefetch_owner(current_session)
+            if owner:
+                next_track_prefetcher.schedule(owner, next_song_nav['query'], next_song_nav['song_api_index'])
+        response.call_on_close(schedule_prefetch)
+    return response
+
+@app.route('/lyrics/<path:query>/<song_api_index>')
+def song_lyrics(query, song_api_index):
+    """
+    以 JSON 返回已排序的歌词时间戳和文本: {times: [ms...], texts: [...], offset_ms, plain}。
+    没有带时间戳的歌词时 plain 为原始歌词文本。
+    """
+    song_details = music_api_handler.get_song_details(query, song_api_index)
+    if not song_details:
+        return jsonify({'error': '无法获取歌曲详情'}), 404
+    response = jsonify(music_api_handler.get_lyric_index(song_details).to_dict())
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
 
 @app.route('/download/<path:query>/<song_api_index>')
 def download_song(query, song_api_index):
+    """提交后台下载任务；文件已就绪时直接发送，否则立即返回，不占用请求线程等待下载。"""
     app.logger.info(f"请求下载歌曲: query={query}, api_index={song_api_index}")
-    song_details = music_api_handler.get_song_details(query, song_api_index)
-
-    if not song_details:
-        flash('无法获取歌曲详情以下载。', 'error')
+    try:
+        job = download_job_manager.submit(query, song_api_index)
+    except download_jobs.JobQueueFull:
+        flash('下载队列繁忙，请稍后再试。', 'warning')
         return redirect(request.referrer or url_for('index'))
 
-    # APP_STATIC_FOLDER 是我们之前定义的 static 文件夹的绝对路径
-    relative_audio_path, success, message = music_api_handler.download_song_assets_for_web(
-        song_details,
-        APP_STATIC_FOLDER
-    )
+    if job.state == download_jobs.JOB_DONE:
+        return _send_downloaded_file(job.relative_path)
+    if job.state == download_jobs.JOB_FAILED:
+        flash(f"下载歌曲失败: {job.message}", 'error')
+    else:
+        flash('歌曲正在后台下载，完成后可再次点击下载。', 'info')
+    return redirect(request.referrer or url_for('song_player', query=query, song_api_index=song_api_index))
+
+def _send_downloaded_file(relative_audio_path):
+    # relative_audio_path 类似 'downloads/filename.mp3'
+    # send_from_directory 需要目录和文件名分开
+    directory = os.path.join(APP_STATIC_FOLDER, os.path.dirname(relative_audio_path))
+    filename = os.path.basename(relative_audio_path)
+    app.logger.info(f"尝试发送文件: 目录='{directory}', 文件名='{filename}'")
+    return send_from_directory(directory, filename, as_attachment=True)
+
+def _download_job_payload(job):
+    payload = job.to_dict()
+    payload['status_url'] = url_for('download_job_status', job_id=job.id)
+    payload['events_url'] = url_for('download_job_events', job_id=job.id)
+    payload['file_url'] = url_for('download_job_file', job_id=job.id) if job.state == download_jobs.JOB_DONE else None
+    return payload
+
+@app.route('/download/<path:query>/<song_api_index>/job', methods=['POST'])
+def create_download_job(query, song_api_index):
+    """提交下载任务，返回任务ID和进度查询地址 (202)。"""
+    try:
+        job = download_job_manager.submit(query, song_api_index)
+    except download_jobs.JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(_download_job_payload(job)), 202
+
+@app.route('/download/jobs/<job_id>')
+def download_job_status(job_id):
+    job = download_job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': '下载任务不存在或已过期'}), 404
+    return jsonify(_download_job_payload(job))
+
+@app.route('/download/jobs/<job_id>/events')
+def download_job_events(job_id):
+    """以 Server-Sent Events 推送任务进度，任务结束后关闭连接。"""
+    job = download_job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': '下载任务不存在或已过期'}), 404
+
+    status_url = url_for('download_job_status', job_id=job.id)
+    file_url = url_for('download_job_file', job_id=job.id)
+
+    def generate():
+        last_version = None
+        deadline = time.monotonic() + DOWNLOAD_EVENTS_MAX_SECONDS
+        while time.monotonic() < deadline:
+            if job.version != last_version:
+                last_version = job.version
+                payload = job.to_dict()
+                payload['status_url'] = status_url
+                payload['file_url'] = file_url if job.state == download_jobs.JOB_DONE else None
+                yield f"event: progress\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                if job.state in download_jobs.FINISHED_STATES:
+                    return
+            time.sleep(DOWNLOAD_EVENTS_INTERVAL)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/download/jobs/<job_id>/file')
+def download_job_file(job_id):
+    job = download_job_manager.get(job_id)
+    if not job:
+        flash('下载任务不存在或已过期，请重新下载。', 'error')
+        return redirect(request.referrer or url_for('index'))
+    if job.state != download_jobs.JOB_DONE:
+        return jsonify(_download_job_payload(job)), 409
+    try:
+        return _send_downloaded_file(job.relative_path)
+    except Exception as e:
+        app.logger.error(f"发送文件时出错: {e}")
+        flash(f"下载 '{os.path.basename(job.relative_path)}' 失败: 无法从服务器发送文件。", 'error')
+        return redirect(request.referrer or url_for('index'))
 
-    if success:
-        if relative_audio_path and "文件已存在" not in message:
-            flash(f"歌曲 '{song_details.get('title', '未知歌曲')}' 下载处理完成: {message}", 'success')
-        elif relative_audio_path and "文件已存在" in message:
-            flash(f"歌曲 '{song_details.get('title', '未知歌曲')}' 已存在，可直接下载。", 'info')
-        else: # Should not happen if success is True and relative_audio_path is None
-            flash(f"歌曲 '{song_details.get('title', '未知歌曲')}' 处理完成，但未获取到文件路径。", 'warning')
-            return redirect(request.referrer or url_for('index'))
-        
-        # relative_audio_path 类似 'downloads/filename.mp3'
-        # send_from_directory 需要目录和文件名分开
-        directory = os.path.join(APP_STATIC_FOLDER, os.path.dirname(relative_audio_path))
-        filename = os.path.basename(relative_audio_path)
-        app.logger.info(f"尝试发送文件: 目录='{directory}', 文件名='{filename}'")
+@app.route('/stream/<path:query>/<song_api_index>')
+def stream_song(query, song_api_index):
+    """
+    播放器使用的音频流，支持 Range 请求（拖动进度条）。
+    优先返回曲库中的本地文件；否则代理上游音频，同时写入下载目录，传输完成后自动入库。
+    """
+    library_hit = library.lookup_song(query, song_api_index)
+    if library_hit is None:
+        song_details = music_api_handler.get_song_details(query, song_api_index)
+        if not song_details or not song_details.get('url'):
+            return jsonify({'error': '无法获取歌曲播放链接'}), 404
+        library_hit = library.lookup_title(song_details.get('title'), song_details.get('singer'))
+        if library_hit is not None:
+            library.link_song(query, song_api_index, song_details.get('title'), song_details.get('singer'),
+                              library_hit['content_hash'])
+    if library_hit is not None:
+        directory = os.path.join(APP_STATIC_FOLDER, os.path.dirname(library_hit['relative_path']))
+        return send_from_directory(directory, os.path.basename(library_hit['relative_path']), conditional=True)
+
+    def finalize_download():
+        # 断点文件已完整，下载任务只需写标签、移动到 downloads 并登记到曲库
         try:
-            return send_from_directory(directory, filename, as_attachment=True)
-        except Exception as e:
-            app.logger.error(f"发送文件时出错: {e}")
-            flash(f"下载 '{filename}' 失败: 无法从服务器发送文件。", 'error')
-            return redirect(request.referrer or url_for('index'))
-            
+            download_job_manager.submit(query, song_api_index)
+        except download_jobs.JobQueueFull:
+            app.logger.info(f"下载队列已满，播放缓存将在下次下载时使用: {query} #{song_api_index}")
+
+    tee = stream_proxy_manager.get_tee(song_details, on_complete=finalize_download)
+    if tee is not None and tee.ready.wait(stream_proxy.STREAM_WAIT_TIMEOUT):
+        response = _stream_from_tee(tee, request.range)
+        if response is not None:
+            return response
+    return _proxy_upstream_audio(song_details['url'], request.headers.get('Range'))
+
+def _stream_from_tee(tee, byte_range):
+    """从正在写入的断点文件提供音频；传输失败或无法满足该 Range 时返回 None。"""
+    if tee.error is not None:
+        return None
+    total = tee.total_length
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache'}
+    if byte_range is None:
+        status, start, stop = 200, 0, None
+        if total is not None:
+            headers['Content-Length'] = str(total)
     else:
-        flash(f"下载歌曲 '{song_details.get('title', '未知歌曲')}' 失败: {message}", 'error')
-        return redirect(request.referrer or url_for('index'))
+        if total is None:
+            return None # 长度未知时无法计算 Content-Range
+        range_for_length = byte_range.range_for_length(total)
+        if range_for_length is None:
+            return Response(status=416, headers={'Content-Range': f"bytes */{total}"})
+        start, stop = range_for_length
+        if not tee.finished and start > tee.bytes_written + stream_proxy.STREAM_DIRECT_RANGE_THRESHOLD:
+            return None # 远超已缓冲的位置，直接向上游请求该区间更快
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{total}"
+        headers['Content-Length'] = str(stop - start)
+    return Response(tee.iter_range(start, stop), status=status, headers=headers,
+                    mimetype=tee.content_type, direct_passthrough=True)
+
+def _proxy_upstream_audio(audio_url, range_header):
+    """直接转发上游音频（透传 Range），不写入本地。"""
+    upstream = stream_proxy.open_upstream(audio_url, range_header)
+    if upstream is None:
+        return jsonify({'error': '无法获取音频流'}), 502
+    headers = {name: upstream.headers[name]
+               for name in ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges')
+               if name in upstream.headers}
+    return Response(stream_proxy.iter_upstream(upstream), status=upstream.status_code,
+                    headers=headers, direct_passthrough=True)
+
+@app.route('/cover')
+def cover_image():
+    """获取（必要时下载并缓存）封面，跳转到带内容哈希的本地地址。只接受 cover_src 签过名的 URL。"""
+    cover_url = request.args.get('url', '')
+    if not covers.verify(cover_url, request.args.get('sig', '')):
+        return redirect(url_for('static', filename='images/default_cover.png'))
+    size = request.args.get('size', 'thumb')
+    if size not in cover_store.COVER_VARIANTS:
+        size = 'thumb'
+    filename = None
+    if cover_url.startswith(('http://', 'https://')) and covers.ensure(cover_url):
+        filename = covers.variant_filename(cover_url, size)
+    if not filename:
+        return redirect(url_for('static', filename='images/default_cover.png'))
+    response = redirect(url_for('cover_file', filename=filename))
+    response.headers['Cache-Control'] = f'public, max-age={COVER_REDIRECT_MAX_AGE}'
+    return response
+
+@app.route('/covers/<filename>')
+def cover_file(filename):
+    response = send_from_directory(COVERS_PATH, filename, max_age=COVER_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={COVER_CACHE_MAX_AGE}, immutable'
+    return response
+
+def _history_item(song, played_at):
+    """数据库中的播放记录转换为 history.html 使用的格式（与 session 中的记录一致）。"""
+    return {
+        'id': song['song_api_index'],
+        'title': song['title'],
+        'singer': song['singer'],
+        'cover': song['cover'],
+        'query': song['song_query'],
+        'played_at': played_at.strftime('%Y-%m-%d %H:%M:%S'),
+    }
 
 @app.route('/history')
 def play_history():
-    """显示用户的播放历史"""
-    history = session.get('play_history', [])
-    return render_template('history.html', history=history)
+    """显示用户的播放历史：登录用户从数据库分页读取，未登录用户读取 session"""
+    if 'user_id' not in session:
+        history = session.get('play_history', [])
+        return render_template('history.html', history=history)
+
+    user_id = session['user_id']
+    after = None
+    if request.args.get('after'):
+        after = database.decode_song_cursor(request.args['after'])
+        if after is None:
+            return redirect(url_for('play_history'))
+    entries, next_cursor = database.get_play_history_page(user_id, after=after)
+    history = [_history_item(entry, entry['played_at']) for entry in entries]
+    if after is None:
+        # 第一页合并尚未写入数据库的记录。正在写入的一批在事务提交后、移出缓冲区前仍会出现在 pending() 中，
+        # 可能已经包含在上面的查询结果里，按 (歌曲, 播放时间) 去重
+        stored = {(entry['song_query'], str(entry['song_api_index']), entry['played_at']) for entry in entries}
+        history = [_history_item(song, played_at) for song, played_at in history_writer.pending(user_id)
+                   if (song['song_query'], str(song['song_api_index']), played_at) not in stored] + history
+    return render_template('history.html', history=history, next_cursor=next_cursor, is_first_page=after is None)
 
 @app.route('/clear_history')
 def clear_history():
     """清空播放历史"""
-    if 'play_history' in session:
+    if 'user_id' in session:
+        history_writer.discard(session['user_id'])
+        if database.clear_play_history(session['user_id']) is None:
+            flash('清空播放历史失败，请稍后再试。', 'error')
+            return redirect(url_for('play_history'))
+        session.pop('play_history', None)
+        flash('播放历史已清空', 'success')
+    elif 'play_history' in session:
         session.pop('play_history')
         flash('播放历史已清空', 'success')
     return redirect(url_for('play_history'))
@@ -406,6 +729,7 @@ def login():
             flash(f'欢迎回来，{user["username"]}！', 'success')
         
         if user: # 确保用户对象存在
+            session.regenerate() # 登录后更换会话 ID
             session['user_id'] = user['id']
             session['username'] = user['username']
             app.logger.info(f"User {user['username']} (ID: {user['id']}) logged in.")
@@ -460,10 +784,123 @@ def playlist_detail(playlist_id):
         flash('未找到该歌单或无权访问。', 'error')
         return redirect(url_for('my_playlists'))
     
-    # 获取歌单中的歌曲 (后续实现)
-    songs_in_playlist = database.get_songs_in_playlist(playlist_id)
+    # 只渲染第一页，其余歌曲由页面滚动时通过 playlist_songs_page 增量加载
+    search = request.args.get('q', '').strip()
+    songs_in_playlist, next_cursor = database.get_playlist_songs_page(playlist_id, search=search or None)
+    total_songs = database.count_songs_in_playlist(playlist_id)
     
-    return render_template('playlist_detail.html', playlist=playlist, songs=songs_in_playlist)
+    return render_template('playlist_detail.html', playlist=playlist, songs=songs_in_playlist,
+                           total_songs=total_songs, next_cursor=next_cursor, search=search)
+
+@app.route('/playlist/<int:playlist_id>/songs')
+@login_required
+def playlist_songs_page(playlist_id):
+    """
+    歌单歌曲的下一页（键集分页）。参数: after=上一页游标, q=歌名/歌手过滤, start=已显示的行数（用于序号）。
+    Returns: JSON {html: 表格行, next: 下一页游标或 null, count: 本页行数}
+    """
+    user_id = session['user_id']
+    playlist = database.get_playlist_by_id(playlist_id, user_id)
+    if not playlist:
+        return jsonify({'error': '未找到该歌单或无权访问。'}), 404
+    after = None
+    if request.args.get('after'):
+        after = database.decode_song_cursor(request.args['after'])
+        if after is None:
+            return jsonify({'error': '无效的分页参数。'}), 400
+    search = request.args.get('q', '').strip()
+    start = request.args.get('start', 0, type=int)
+    songs, next_cursor = database.get_playlist_songs_page(playlist_id, after=after, search=search or None)
+    html = render_template('_playlist_song_rows.html', playlist=playlist, songs=songs, start=start)
+    return jsonify({'html': html, 'next': next_cursor, 'count': len(songs)})
+
+@app.route('/playlist/<int:playlist_id>/export.zip')
+@login_required
+def export_playlist_zip(playlist_id):
+    """将整个歌单打包为 ZIP 流式下载；已下载的文件直接复用，其余歌曲通过下载任务获取。"""
+    user_id = session['user_id']
+    playlist = database.get_playlist_by_id(playlist_id, user_id)
+    if not playlist:
+        flash('未找到该歌单或无权访问。', 'error')
+        return redirect(url_for('my_playlists'))
+    songs = database.get_songs_in_playlist(playlist_id, columns=database.PLAYLIST_SONG_NAV_COLUMNS)
+    if not songs:
+        flash('歌单中还没有歌曲，无法导出。', 'warning')
+        return redirect(url_for('playlist_detail', playlist_id=playlist_id))
+
+    app.logger.info(f"导出歌单 {playlist_id} ({len(songs)} 首)")
+    archive_name = f"{music_api_handler._sanitize_filename(playlist['name'])}.zip"
+    headers = {
+        'Content-Disposition': f"attachment; filename=\"playlist-{playlist_id}.zip\"; filename*=UTF-8''{quote(archive_name)}",
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(playlist_export.iter_zip_stream(songs, _resolve_export_song),
+                    mimetype='application/zip', headers=headers, direct_passthrough=True)
+
+def _resolve_export_song(song):
+    """返回歌单歌曲的本地文件路径，必要时通过下载任务获取。Returns: (absolute_path, error_message)"""
+    try:
+        job = download_job_manager.submit(song['song_query'], song['song_api_index'])
+    except download_jobs.JobQueueFull:
+        return None, '下载队列已满'
+    if not job.wait(EXPORT_SONG_TIMEOUT):
+        return None, '下载超时'
+    if job.state != download_jobs.JOB_DONE:
+        return None, job.message or '下载失败'
+    return os.path.join(APP_STATIC_FOLDER, job.relative_path), None
+
+@app.route('/playlist/<int:playlist_id>/import', methods=['POST'])
+@login_required
+def import_playlist_songs(playlist_id):
+    """
+    批量导入 M3U / CSV / JSON 列表到歌单（上传文件字段 file，或文本字段 content；format 可选）。
+    解析出条目后提交后台导入任务并立即返回 (202)，前端轮询 status_url 获取进度和结果。
+    """
+    user_id = session['user_id']
+    playlist = database.get_playlist_by_id(playlist_id, user_id)
+    if not playlist:
+        return jsonify({'error': '未找到该歌单或无权访问。'}), 404
+
+    upload = request.files.get('file')
+    filename = None
+    if upload and upload.filename:
+        filename = upload.filename
+        content = upload.read().decode('utf-8-sig', errors='replace')
+    else:
+        content = request.form.get('content', '')
+    if not content.strip():
+        return jsonify({'error': '导入内容为空。'}), 400
+
+    fmt = (request.form.get('format') or '').lower() or playlist_import.detect_format(filename, content)
+    try:
+        entries = playlist_import.parse_import(content, fmt)
+    except playlist_import.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    if not entries:
+        return jsonify({'error': '没有解析到任何歌曲。'}), 400
+
+    try:
+        job = download_job_manager.submit_import(playlist_id, user_id, entries, database.add_songs_to_playlist, fmt=fmt)
+    except download_jobs.JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    app.logger.info(f"用户 {user_id} 向歌单 {playlist_id} 导入 {len(entries)} 条 ({fmt})，任务 {job.id}")
+    payload = job.to_dict()
+    payload['status_url'] = url_for('import_job_status', job_id=job.id)
+    return jsonify(payload), 202
+
+@app.route('/playlist/import/jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    """
+    导入任务进度: {state, rows_done, rows_total, progress, ...}；完成后包含 summary 和 rows。
+    """
+    job = download_job_manager.get_import(job_id)
+    if not job or job.user_id != session['user_id']:
+        return jsonify({'error': '导入任务不存在或已过期'}), 404
+    payload = job.to_dict()
+    payload['status_url'] = url_for('import_job_status', job_id=job.id)
+    return jsonify(payload)
 
 @app.route('/playlist/delete/<int:playlist_id>', methods=['POST'])
 @login_required
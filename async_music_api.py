@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import weakref
+
+import aiohttp
+
+import music_api_handler as api
+
+# music_api_handler 的 asyncio 版本。
+# 返回值约定与同步函数保持一致（失败返回 None / False），并共用同一套
+# 响应解析函数和搜索/详情缓存，因此同步路由和异步任务之间的缓存是互通的。
+# 歌单批量导入（playlist_import.resolve_entries）使用它并发解析条目。
+
+# 并发解析多首歌曲时的默认并发上限
+DEFAULT_GATHER_LIMIT = 8
+
+# 每个事件循环一个 ClientSession（aiohttp 的会话不能跨事件循环使用）
+_sessions = weakref.WeakKeyDictionary()
+# 每个事件循环中进行中的上游请求: loop -> {key: Task}
+_inflight = weakref.WeakKeyDictionary()
+
+class _RetryableStatus(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+# --- Shared HTTP Client ---
+def _build_session():
+    connector = aiohttp.TCPConnector(
+        limit=api.HTTP_POOL_CONNECTIONS * api.HTTP_POOL_MAXSIZE,
+        limit_per_host=api.HTTP_POOL_MAXSIZE,
+        keepalive_timeout=60,
+    )
+    headers = {k: v for k, v in api.DEFAULT_HEADERS.items() if k != 'Connection'}
+    return aiohttp.ClientSession(connector=connector, headers=headers)
+
+async def get_http_session():
+    """
+    返回当前事件循环共享的 aiohttp 会话（按主机的 keep-alive 连接池）。
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _build_session()
+        _sessions[loop] = session
+    return session
+
+async def close_http_session():
+    """
+    关闭当前事件循环的 aiohttp 会话。应在 asyncio.run() 结束前调用。
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+async def _get_with_retry(url, timeout, **kwargs):
+    """
+    发起 GET 请求，连接错误和 HTTP_RETRY_STATUS_FORCELIST 中的状态码按同步客户端相同的策略退避重试。
+    Returns: aiohttp.ClientResponse（调用方负责释放）。
+    """
+    session = await get_http_session()
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    attempt = 0
+    while True:
+        try:
+            response = await session.get(url, timeout=client_timeout, **kwargs)
+            if response.status in api.HTTP_RETRY_STATUS_FORCELIST and attempt < api.HTTP_RETRY_TOTAL:
+                response.release()
+                raise _RetryableStatus(response.status)
+            return response
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError, _RetryableStatus) as e:
+            if attempt >= api.HTTP_RETRY_TOTAL:
+                raise
+            delay = api.HTTP_RETRY_BACKOFF_FACTOR * (2 ** attempt)
+            logging.warning(f"请求失败 ({e})，{delay:.1f}s 后重试: {url}")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+# --- Concurrency Helpers ---
+async def gather_limited(aws, limit=DEFAULT_GATHER_LIMIT, return_exceptions=False):
+    """
+    与 asyncio.gather 相同，但同时运行的协程数量不超过 limit。
+    Returns: 与输入顺序一致的结果列表。
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(_run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+async def _coalesced(key, coro_fn, *args):
+    """
+    同一事件循环中相同 key 的并发请求只执行一次，其余调用者等待同一个 Task。
+    """
+    loop = asyncio.get_running_loop()
+    tasks = _inflight.setdefault(loop, {})
+    task = tasks.get(key)
+    if task is None:
+        task = loop.create_task(coro_fn(*args))
+        tasks[key] = task
+        task.add_done_callback(lambda _t: tasks.pop(key, None))
+    try:
+        # shield: 单个等待者被取消或超时不影响其它等待者
+        return await asyncio.wait_for(asyncio.shield(task), api.SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logging.error(f"等待并发的相同上游请求超时: {key!r}")
+        return None
+
+# --- API Interaction Functions ---
+async def request_api(params):
+    """
+    发送API请求并处理基本错误。
+    Returns: response JSON or None if error.
+    """
+    try:
+        response = await _get_with_retry(api.API_URL, api.API_TIMEOUT, params=params)
+        async with response:
+            response.raise_for_status()
+            return json.loads(await response.text())
+    except aiohttp.ClientResponseError as e:
+        logging.error(f"HTTP错误: {e.status} - {e}")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus) as e:
+        logging.error(f"请求错误: {e!r}")
+        return None
+    except json.JSONDecodeError as e:
+        logging.error(f"解析API响应失败: 返回的不是有效的JSON. Error: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"处理API请求时发生未知错误: {e}")
+        return None
+
+async def search_music(query):
+    """
+    根据关键词搜索歌曲列表（与同步版本共用缓存）。
+    Returns: list of songs or None.
+    """
+    cache_key = api._normalize_query(query)
+    cached_songs = api._get_cached_search(cache_key)
+    if cached_songs is not None:
+        return cached_songs
+
+    songs = await _coalesced(('search', cache_key), _fetch_and_store_search, cache_key, query)
+    return [dict(song) for song in songs] if songs else songs
+
+async def _fetch_and_store_search(cache_key, query):
+    # 只由合并后的那一个 Task 写入缓存
+    return api._store_search_results(cache_key, await _search_music_uncached(query))
+
+async def _search_music_uncached(query):
+    return api._parse_search_response(await request_api(api._search_params(query)))
+
+async def get_song_details(query, song_number):
+    """
+    根据关键词和歌曲序号获取歌曲详细信息（与同步版本共用缓存）。
+    Returns: song details dict or None.
+    """
+    cache_key = api._details_cache_key(query, song_number)
+    cached_details, entry = api._get_cached_song_details(cache_key)
+    if cached_details is not None:
+        return cached_details
+
+    details = await _coalesced(('details',) + cache_key, _fetch_and_store_song_details,
+                               cache_key, entry, query, song_number)
+    return dict(details) if details else details
+
+async def _fetch_and_store_song_details(cache_key, entry, query, song_number):
+    # 只由合并后的那一个 Task 合并缓存、解析歌词
+    return api._store_song_details(cache_key, entry, await _get_song_details_uncached(query, song_number))
+
+async def _get_song_details_uncached(query, song_number):
+    return api._parse_song_details_response(await request_api(api._song_details_params(query, song_number)))
+
+async def resolve_songs(items, limit=DEFAULT_GATHER_LIMIT):
+    """
+    并发获取多首歌曲的详情。
+    Args:
+        items: 可迭代的 (query, song_number) 元组。
+        limit: 最大并发数。
+    Returns: 与 items 顺序一致的详情列表，失败项为 None。
+    """
+    return await gather_limited((get_song_details(q, n) for q, n in items), limit=limit)
+
+# --- File Downloads ---
+async def fetch_bytes(url, is_cover=True):
+    """
+    下载较小的资源（如封面）到内存。
+    Returns: bytes or None.
+    """
+    timeout = api.COVER_TIMEOUT if is_cover else api.AUDIO_TIMEOUT
+    try:
+        response = await _get_with_retry(url, timeout)
+        async with response:
+            response.raise_for_status()
+            return await response.read()
+    except aiohttp.ClientResponseError as e:
+        logging.error(f"下载资源HTTP错误 ({url}): {e.status} - {e}")
+    except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus) as e:
+        logging.error(f"下载资源失败 ({url}): {e!r}")
+    return None
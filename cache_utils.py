@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+
+# 缓存未命中时 get() 的默认返回值（区分"缓存了 None"与"未命中"）
+MISSING = object()
+
+class TTLCache:
+    """
+    线程安全的进程内缓存：按条目设置过期时间（TTL），超过容量时淘汰最久未使用的条目（LRU）。
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=300, name='cache'):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        """
+        返回未过期的缓存值并将其标记为最近使用；未命中或已过期返回 default。
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        """
+        写入缓存条目，ttl_seconds 为空时使用缓存默认 TTL。
+        """
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        删除指定条目；key 为空时清空整个缓存。返回被删除的条目数量。
+        """
+        with self._lock:
+            if key is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+            return 1 if self._data.pop(key, None) is not None else 0
+
+    def configure(self, max_entries=None, ttl_seconds=None):
+        """
+        调整容量和默认 TTL；缩小容量时立即淘汰多余条目。
+        """
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        返回命中/未命中计数、命中率和当前条目数。
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SingleFlightTimeout(TimeoutError):
+    """等待同键请求结果超时。"""
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一个 key 同时只有一个调用者（leader）真正执行，
+    其余调用者等待并共享它的返回值或异常。
+    """
+
+    def __init__(self, wait_timeout=30, name='single_flight'):
+        self.wait_timeout = wait_timeout
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行 fn(*args, **kwargs)，或等待正在进行的同 key 调用完成。
+        等待超过 wait_timeout 秒时抛出 SingleFlightTimeout。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            if not call.done.wait(self.wait_timeout):
+                raise SingleFlightTimeout(f"{self.name}: 等待 {key!r} 的结果超时 ({self.wait_timeout}s)")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        """
+        返回实际执行次数、被合并的调用次数和当前进行中的 key 数量。
+        """
+        with self._lock:
+            return {
+                'name': self.name,
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+                'wait_timeout': self.wait_timeout,
+            }
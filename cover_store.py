@@ -0,0 +1,262 @@
+import hashlib
+import hmac
+import io
+import json
+import logging
+import mimetypes
+import os
+import threading
+
+import music_api_handler as api
+from cache_utils import TTLCache, SingleFlight, SingleFlightTimeout, MISSING
+
+try:
+    from PIL import Image
+except ImportError: # Pillow 可选：未安装时各尺寸都使用原图
+    Image = None
+
+# 本地封面缓存：按封面 URL 的哈希索引，每个封面只从上游下载一次，
+# 生成若干缩放尺寸后以内容哈希命名保存（static/covers/<sha256 前缀>.<ext>），
+# 文件名随内容变化，因此可以使用长期缓存头。写入 ID3 时也直接读取本地文件。
+
+COVER_STORE_DIR_NAME = 'covers'
+COVER_MANIFEST_DIR_NAME = 'index'
+# 尺寸名 -> 最长边像素；None 表示原图
+COVER_VARIANTS = {
+    'thumb': 120,
+    'medium': 300,
+    'large': 600,
+    'original': None,
+}
+COVER_EMBED_VARIANT = 'large'      # 写入 APIC 使用的尺寸
+COVER_JPEG_QUALITY = 85
+COVER_FAILURE_TTL_SECONDS = 300    # 下载失败的封面在这段时间内不再重试
+COVER_MANIFEST_CACHE_SIZE = 4096
+COVER_STORE_MAX_BYTES = 512 * 1024 * 1024  # 封面目录总大小上限，超过时淘汰最早缓存的封面
+# 允许缓存的图片类型 -> 扩展名；其它类型（如 SVG）不保存，避免在本站域名下提供可执行内容
+COVER_MIME_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/pjpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+logger = logging.getLogger(__name__)
+
+def cover_key(cover_url):
+    return hashlib.sha1(cover_url.encode('utf-8')).hexdigest()[:20]
+
+class CoverStore:
+    """
+    封面缓存。manifest 记录每个尺寸对应的文件名: {'variants': {name: filename}, 'mime': ...}。
+    Args:
+        secret: 用于签名封面 URL 的密钥；/cover 只接受由 sign() 签过名的 URL。
+    """
+
+    def __init__(self, root_dir, secret, max_bytes=COVER_STORE_MAX_BYTES):
+        self.root_dir = root_dir
+        self._secret = secret if isinstance(secret, bytes) else str(secret).encode('utf-8')
+        self.max_bytes = max_bytes
+        self.manifest_dir = os.path.join(root_dir, COVER_MANIFEST_DIR_NAME)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self._manifests = TTLCache(max_entries=COVER_MANIFEST_CACHE_SIZE, ttl_seconds=7 * 24 * 3600, name='cover_manifest')
+        self._failures = TTLCache(max_entries=COVER_MANIFEST_CACHE_SIZE, ttl_seconds=COVER_FAILURE_TTL_SECONDS, name='cover_failures')
+        self._flight = SingleFlight(wait_timeout=api.COVER_TIMEOUT * 2, name='cover_fetch')
+        self.fetched = 0
+        self.evicted = 0
+        self._size_lock = threading.Lock()
+        self._total_bytes = None # 首次写入时统计
+
+    def sign(self, cover_url):
+        """封面 URL 的签名，由 cover_src 附加在 /cover 链接上。"""
+        return hmac.new(self._secret, cover_url.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+    def verify(self, cover_url, signature):
+        return bool(cover_url and signature) and hmac.compare_digest(self.sign(cover_url), signature)
+
+    def _manifest_path(self, key):
+        return os.path.join(self.manifest_dir, f"{key}.json")
+
+    def get(self, cover_url):
+        """
+        返回已缓存封面的 manifest，不访问上游；未缓存时返回 None。
+        """
+        key = cover_key(cover_url)
+        manifest = self._manifests.get(key)
+        if manifest is not MISSING:
+            return manifest
+        try:
+            with open(self._manifest_path(key), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not all(os.path.exists(os.path.join(self.root_dir, name)) for name in manifest['variants'].values()):
+            return None # 文件被清理过，重新获取
+        self._manifests.set(key, manifest)
+        return manifest
+
+    def ensure(self, cover_url):
+        """
+        返回封面的 manifest，必要时下载并生成各尺寸（相同 URL 的并发请求只下载一次）。
+        Returns: manifest dict or None if download failed.
+        """
+        if not cover_url:
+            return None
+        manifest = self.get(cover_url)
+        if manifest is not None:
+            return manifest
+        key = cover_key(cover_url)
+        if self._failures.get(key) is not MISSING:
+            return None
+        try:
+            return self._flight.do(key, self._fetch_and_store, key, cover_url)
+        except SingleFlightTimeout as e:
+            logger.warning(str(e))
+            return None
+
+    def _fetch_and_store(self, key, cover_url):
+        manifest = self.get(cover_url) # 等待期间可能已由其它进程写入
+        if manifest is not None:
+            return manifest
+        cover_data, mime_type = api.fetch_cover_bytes(cover_url)
+        if cover_data and mime_type not in COVER_MIME_EXTENSIONS:
+            logger.warning(f"不支持的封面类型 {mime_type}: {cover_url}")
+            cover_data = None
+        if not cover_data:
+            self._failures.set(key, True)
+            return None
+        self.fetched += 1
+
+        variants = {}
+        for name, max_side in COVER_VARIANTS.items():
+            data, ext = self._render_variant(cover_data, mime_type, max_side)
+            variants[name] = self._write_content(data, ext)
+        manifest = {'url': cover_url, 'mime': mime_type, 'variants': variants}
+        tmp_path = self._manifest_path(key) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self._manifest_path(key))
+        self._manifests.set(key, manifest)
+        logger.info(f"封面已缓存: {cover_url} -> {variants}")
+        self._enforce_limit(keep=key)
+        return manifest
+
+    def _render_variant(self, cover_data, mime_type, max_side):
+        original_ext = COVER_MIME_EXTENSIONS.get(mime_type, '.jpg')
+        if max_side is None or Image is None:
+            return cover_data, original_ext
+        try:
+            with Image.open(io.BytesIO(cover_data)) as image:
+                if max(image.size) <= max_side:
+                    return cover_data, original_ext
+                image = image.convert('RGB')
+                image.thumbnail((max_side, max_side))
+                out = io.BytesIO()
+                image.save(out, format='JPEG', quality=COVER_JPEG_QUALITY, optimize=True)
+                return out.getvalue(), '.jpg'
+        except Exception as e:
+            logger.warning(f"封面缩放失败，使用原图: {e}")
+            return cover_data, original_ext
+
+    def _write_content(self, data, ext):
+        filename = f"{hashlib.sha256(data).hexdigest()[:24]}{ext}"
+        path = os.path.join(self.root_dir, filename)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._size_lock:
+                if self._total_bytes is not None:
+                    self._total_bytes += len(data)
+        return filename
+
+    def _scan_size(self):
+        total = 0
+        with os.scandir(self.root_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    total += entry.stat().st_size
+        return total
+
+    def _enforce_limit(self, keep=None):
+        """
+        目录超过 max_bytes 时按 manifest 修改时间从旧到新淘汰封面；仍被其它 manifest 引用的文件保留。
+        """
+        with self._size_lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            if self._total_bytes <= self.max_bytes:
+                return
+            manifests = []
+            with os.scandir(self.manifest_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        try:
+                            with open(entry.path, 'r', encoding='utf-8') as f:
+                                files = set(json.load(f)['variants'].values())
+                            manifests.append((entry.stat().st_mtime, entry.name[:-5], entry.path, files))
+                        except (OSError, ValueError, KeyError):
+                            continue
+            manifests.sort()
+            referenced = {}
+            for _, _, _, files in manifests:
+                for name in files:
+                    referenced[name] = referenced.get(name, 0) + 1
+            for _, key, path, files in manifests:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._manifests.invalidate(key)
+                self.evicted += 1
+                for name in files:
+                    referenced[name] -= 1
+                    if referenced[name] > 0:
+                        continue
+                    file_path = os.path.join(self.root_dir, name)
+                    try:
+                        size = os.path.getsize(file_path)
+                        os.remove(file_path)
+                        self._total_bytes -= size
+                    except OSError:
+                        pass
+            logger.info(f"封面缓存超过上限，已淘汰 {self.evicted} 个封面（当前 {self._total_bytes} bytes）")
+
+    def variant_filename(self, cover_url, variant):
+        """
+        已缓存封面指定尺寸的文件名（相对 root_dir）；未缓存返回 None。
+        """
+        manifest = self.get(cover_url) if cover_url else None
+        if manifest is None:
+            return None
+        variants = manifest['variants']
+        return variants.get(variant) or variants.get('original')
+
+    def load_for_embedding(self, cover_url):
+        """
+        供 ID3 APIC 使用的封面数据，签名与 music_api_handler.fetch_cover_bytes 相同。
+        Returns: (cover_data, mime_type) or (None, None).
+        """
+        manifest = self.ensure(cover_url)
+        if manifest is None:
+            return None, None
+        filename = manifest['variants'].get(COVER_EMBED_VARIANT) or manifest['variants']['original']
+        try:
+            with open(os.path.join(self.root_dir, filename), 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning(f"读取本地封面失败 ({filename}): {e}")
+            return api.fetch_cover_bytes(cover_url)
+        mime_type = mimetypes.guess_type(filename)[0] or manifest.get('mime') or 'image/jpeg'
+        return data, mime_type
+
+    def stats(self):
+        return {'fetched': self.fetched, 'evicted': self.evicted, 'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes, 'manifests': self._manifests.stats(), 'single_flight': self._flight.stats()}
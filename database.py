@@ -1,6 +1,14 @@
-import mysql.connector
+import hashlib
 import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import db_backends
+from cache_utils import TTLCache, MISSING
+from db_pool import ConnectionPool, PoolTimeout
 
 DATABASE_NAME = 'musicapp.db'
 
@@ -8,6 +16,11 @@ DATABASE_NAME = 'musicapp.db'
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_PATH = os.path.join(BASE_DIR, DATABASE_NAME)
 
+# --- Storage Backend ---
+# 'mysql': 使用下面的 MYSQL_CONFIG 连接 MySQL 服务器
+# 'sqlite': 使用 DATABASE_PATH 处的嵌入式 SQLite 数据库（WAL），适合单机部署和本地开发
+DATABASE_BACKEND = 'mysql'
+
 # --- MySQL Configuration ---
 MYSQL_CONFIG = {
     'host': 'localhost',
@@ -20,315 +33,819 @@ MYSQL_CONFIG = {
 # Configure logging for this module
 logger = logging.getLogger(__name__)
 
+# --- Connection Pool ---
+# 常驻连接数、繁忙时额外允许的连接数、等待空闲连接的超时（秒）
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+POOL_TIMEOUT = 10
+# 连接存活超过此时间后重建（应小于 MySQL 的 wait_timeout）；SQLite 后端不需要
+POOL_RECYCLE_SECONDS = 3600
+# 空闲超过此时间的连接在借出前 ping 一次；SQLite 后端不需要
+POOL_PRE_PING_SECONDS = 30
+
+# 批量写入时每次 executemany 的行数
+BULK_INSERT_BATCH_SIZE = 500
+
+# 歌单歌曲列表使用的列（不取 playlist_id 等页面用不到的列）；播放页导航只需要前几列
+PLAYLIST_SONG_LIST_COLUMNS = ('id', 'song_api_index', 'song_query', 'title', 'singer', 'cover', 'added_at')
+PLAYLIST_SONG_NAV_COLUMNS = ('id', 'song_api_index', 'song_query', 'title', 'singer')
+PLAYLIST_PAGE_SIZE = 50
+
+# 播放历史页每页条数
+PLAY_HISTORY_PAGE_SIZE = 30
+
+# 歌曲目录（songs 表）的去重键：规范化后的 (关键词, API 序号) 的 SHA-256 前 16 字节
+SONG_KEY_BYTES = 16
+# 迁移到歌曲目录后保留的旧 playlist_songs 表（确认无误后可手动删除）
+LEGACY_PLAYLIST_SONGS_TABLE = 'playlist_songs_legacy'
+
+# 用户歌单列表缓存：歌单只通过本模块的 create_playlist / delete_playlist_by_id 变化，写入时立即失效；
+# TTL 只是兜底（例如多进程部署或直接修改数据库）
+PLAYLIST_CACHE_TTL_SECONDS = 600
+PLAYLIST_CACHE_MAX_USERS = 1024
+
+# 对外的歌单歌曲列名 -> playlist_songs ps JOIN songs s 中的表达式
+_PLAYLIST_SONG_COLUMN_SQL = {
+    'id': 'ps.id',
+    'playlist_id': 'ps.playlist_id',
+    'song_id': 'ps.song_id',
+    'added_at': 'ps.added_at',
+    'song_api_index': 's.song_api_index',
+    'song_query': 's.song_query',
+    'title': 's.title',
+    'singer': 's.singer',
+    'cover': 's.cover',
+}
+
+# 查询函数捕获的异常：各驱动的异常，以及等待空闲连接超时
+DB_ERRORS = db_backends.DRIVER_ERRORS + (PoolTimeout,)
+
+_backend = None
+_pool = None
+_pool_lock = threading.Lock()
+
+_playlists_cache = TTLCache(max_entries=PLAYLIST_CACHE_MAX_USERS, ttl_seconds=PLAYLIST_CACHE_TTL_SECONDS, name='user_playlists')
+# 歌单缓存的版本号：每次失效时递增。查询前记下版本号，写回缓存时版本号已变化说明查询期间歌单被修改过，
+# 查到的可能是旧数据，不写入缓存
+_playlists_generation = 0
+_playlists_generation_lock = threading.Lock()
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _pool_lock:
+            if _backend is None:
+                _backend = db_backends.create_backend(DATABASE_BACKEND, mysql_config=MYSQL_CONFIG, sqlite_path=DATABASE_PATH)
+                logger.info(f"Database backend: {_backend.name}")
+    return _backend
+
+def configure_backend(name, mysql_config=None, sqlite_path=None, sqlite_pragmas=None):
+    """
+    切换存储后端（'mysql' / 'sqlite'），应在 init_db() 之前调用。
+    关闭旧后端的连接池并清空歌单缓存。
+    """
+    global _backend, _pool, DATABASE_BACKEND
+    backend = db_backends.create_backend(name, mysql_config=mysql_config or MYSQL_CONFIG,
+                                         sqlite_path=sqlite_path or DATABASE_PATH, sqlite_pragmas=sqlite_pragmas)
+    with _pool_lock:
+        old_pool = _pool
+        DATABASE_BACKEND = name
+        _backend = backend
+        _pool = None
+    if old_pool is not None:
+        old_pool.close()
+    invalidate_playlists_cache()
+    logger.info(f"Database backend: {backend.name}")
+
 def get_db_connection():
-    """Establishes a connection to the MySQL database."""
+    """Establishes a new (unpooled) connection using the configured backend."""
+    # In a real app, you might want to handle connection errors more gracefully
+    return _get_backend().connect() # Re-raises the driver exception if connection fails
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        backend = _get_backend()
+        with _pool_lock:
+            if _pool is None:
+                options = {'recycle_seconds': POOL_RECYCLE_SECONDS, 'pre_ping_seconds': POOL_PRE_PING_SECONDS}
+                options.update(backend.pool_options)
+                _pool = ConnectionPool(
+                    backend.connect,
+                    size=POOL_SIZE,
+                    max_overflow=POOL_MAX_OVERFLOW,
+                    timeout=POOL_TIMEOUT,
+                    ping=backend.ping,
+                    reset=backend.reset,
+                    name=backend.name,
+                    **options
+                )
+    return _pool
+
+def configure_pool(size=None, max_overflow=None, timeout=None, recycle_seconds=None, pre_ping_seconds=None):
+    """调整连接池参数，可在运行时调用。"""
+    _get_pool().configure(size=size, max_overflow=max_overflow, timeout=timeout,
+                          recycle_seconds=recycle_seconds, pre_ping_seconds=pre_ping_seconds)
+
+def get_pool_stats():
+    """返回连接池状态：总连接数、空闲/借出数量、创建/回收次数、健康检查失败和等待超时次数。"""
+    return _get_pool().stats()
+
+def close_pool():
+    """关闭连接池中的空闲连接（应用退出时调用）。"""
+    if _pool is not None:
+        _pool.close()
+
+# --- Request Scope ---
+# 请求作用域：begin_request_scope() 之后，同一线程中的所有查询共用一个连接（首次查询时借出），
+# end_request_scope() 时归还。作用域内同时统计查询次数和耗时。
+_scope_state = threading.local()
+
+class _RequestScope:
+    __slots__ = ('pooled', 'queries', 'query_seconds', 'checkouts')
+
+    def __init__(self):
+        self.pooled = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.checkouts = 0
+
+class _CountingCursor:
+    """
+    记录 execute/executemany 次数和耗时的游标包装，其余属性直接转发。
+    """
+    __slots__ = ('_cursor', '_scope')
+
+    def __init__(self, cursor, scope):
+        self._cursor = cursor
+        self._scope = scope
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._scope.queries += 1
+            self._scope.query_seconds += time.perf_counter() - started
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(self._cursor.executemany, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+def begin_request_scope():
+    """开始请求作用域（在 before_request 中调用）。"""
+    _scope_state.current = _RequestScope()
+
+def end_request_scope():
+    """
+    结束请求作用域并归还连接（在 teardown_request 中调用）。
+    Returns: {'queries', 'query_ms', 'checkouts'} or None if no scope is active.
+    """
+    scope = getattr(_scope_state, 'current', None)
+    if scope is None:
+        return None
+    _scope_state.current = None
+    if scope.pooled is not None:
+        _get_pool().checkin(scope.pooled)
+        scope.pooled = None
+    return {'queries': scope.queries, 'query_ms': scope.query_seconds * 1000, 'checkouts': scope.checkouts}
+
+@contextmanager
+def released_request_connection():
+    """
+    在请求作用域内暂时归还作用域持有的连接（调用上游接口等慢操作前使用），避免长时间占用连接池。
+    块内的查询按作用域外的方式单独借还连接；退出后作用域的下一次查询重新借出连接。
+    """
+    scope = getattr(_scope_state, 'current', None)
+    if scope is None:
+        yield
+        return
+    if scope.pooled is not None:
+        _get_pool().checkin(scope.pooled)
+        scope.pooled = None
+    _scope_state.current = None
+    try:
+        yield
+    finally:
+        _scope_state.current = scope
+
+def _checkout():
+    return _get_pool().checkout()
+
+@contextmanager
+def _pooled_connection():
+    """
+    借出连接：请求作用域内复用作用域的连接，否则从连接池借出并在退出时归还。
+    Yields: (connection, scope or None)
+    """
+    backend = _get_backend()
+    scope = getattr(_scope_state, 'current', None)
+    if scope is not None:
+        if scope.pooled is None:
+            scope.pooled = _checkout()
+            scope.checkouts += 1
+        try:
+            yield scope.pooled.conn, scope
+        except DB_ERRORS as err:
+            if backend.is_connection_error(err):
+                # 连接层面的错误，丢弃作用域的连接，后续查询重新借出
+                _get_pool().checkin(scope.pooled, discard=True)
+                scope.pooled = None
+            raise
+        return
+
+    pooled = _checkout()
+    discard = False
     try:
-        conn = mysql.connector.connect(**MYSQL_CONFIG)
-        # logger.debug("MySQL connection established.")
-        return conn
-    except mysql.connector.Error as err:
-        logger.error(f"Error connecting to MySQL: {err}")
-        # In a real app, you might want to raise this or handle it more gracefully
-        raise  # Re-raise the exception if connection fails
+        yield pooled.conn, None
+    except DB_ERRORS as err:
+        discard = backend.is_connection_error(err) # 连接层面的错误，不再放回连接池
+        raise
+    finally:
+        _get_pool().checkin(pooled, discard=discard)
+
+@contextmanager
+def db_cursor(dictionary=False):
+    """
+    从连接池借出连接并返回游标，退出时关闭游标并归还连接（请求作用域内则保留连接到请求结束）。
+    游标使用 %s 占位符；建立连接失败或等待空闲连接超时时抛出 DB_ERRORS 中的异常，调用方按原有方式捕获。
+    """
+    with _pooled_connection() as (conn, scope):
+        cursor = _get_backend().cursor(conn, dictionary=dictionary)
+        try:
+            yield _CountingCursor(cursor, scope) if scope is not None else cursor
+        finally:
+            cursor.close()
+
+@contextmanager
+def db_transaction(dictionary=False):
+    """
+    与 db_cursor 相同，但多条语句在一个事务中执行：正常退出时提交，发生异常时回滚。
+    """
+    backend = _get_backend()
+    with _pooled_connection() as (conn, scope):
+        backend.begin(conn)
+        cursor = backend.cursor(conn, dictionary=dictionary)
+        try:
+            yield _CountingCursor(cursor, scope) if scope is not None else cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
 
 def init_db():
     """Initializes the database and creates tables if they don't exist."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(80) UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """)
-        logger.info("Table 'users' checked/created.")
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS playlists (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            name VARCHAR(100) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """)
-        logger.info("Table 'playlists' checked/created.")
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS playlist_songs (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            playlist_id INT NOT NULL,
-            song_api_index VARCHAR(255) NOT NULL, -- Can be non-integer from some APIs
-            song_query TEXT NOT NULL,
-            title VARCHAR(255) NOT NULL,
-            singer VARCHAR(255),
-            cover TEXT, -- URL, can be long
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (playlist_id) REFERENCES playlists(id) ON DELETE CASCADE,
-            UNIQUE KEY unique_song_in_playlist (playlist_id, song_api_index, song_query(255)) 
-            -- Added (255) for song_query in unique key for TEXT type indexing limit
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """)
-        # Note on UNIQUE KEY for song_query: MySQL has limitations on indexing full TEXT columns.
-        # A prefix length (e.g., 255) is often used for TEXT/BLOB columns in unique keys.
-        # If song_query can be very long and identical up to 255 chars but different afterwards,
-        # this could theoretically allow "duplicates" if only differentiated by the part beyond 255 chars.
-        # For most practical purposes with song titles/queries, this should be fine.
-        logger.info("Table 'playlist_songs' checked/created.")
-
-        conn.commit()
+        with db_cursor() as cursor:
+            # 各后端的表结构等价，见 db_backends.MYSQL_TABLES / SQLITE_TABLES
+            _get_backend().init_schema(cursor)
         logger.info("Database tables initialized/verified successfully.")
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         logger.error(f"Error initializing database: {err}")
-        if conn:
-            conn.rollback() # Rollback any changes if an error occurs
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-            # logger.debug("MySQL connection closed after init_db.")
+        return
+    _migrate_playlist_songs_to_catalog()
+
+def _migrate_playlist_songs_to_catalog():
+    """
+    旧表结构的 playlist_songs 每行都保存歌曲元数据（song_query/title/singer/cover）。
+    迁移为 songs 目录 + song_id 引用：写入目录后在临时表中重建 playlist_songs（保留原 id 和 added_at），
+    再原子地交换表名，旧表以 LEGACY_PLAYLIST_SONGS_TABLE 保留。
+    """
+    backend = _get_backend()
+    try:
+        with db_cursor() as cursor:
+            if not backend.column_exists(cursor, 'playlist_songs', 'song_query'):
+                return
+        logger.info("Migrating playlist_songs to the song catalog...")
+        # SQLite 中整个迁移是一个事务；MySQL 的 DDL 会隐式提交，交换表名之前旧表保持不变
+        with db_transaction() as cursor:
+            cursor.execute("""
+                SELECT id, playlist_id, song_api_index, song_query, title, singer, cover, added_at
+                FROM playlist_songs ORDER BY id DESC
+            """) # 同一首歌出现多次时，目录采用最近一次添加时的元数据
+            rows = cursor.fetchall()
+            song_ids = _ensure_catalog_songs(cursor, [
+                {'song_api_index': row[2], 'song_query': row[3], 'title': row[4], 'singer': row[5], 'cover': row[6]}
+                for row in rows
+            ])
+            backend.create_playlist_songs_table(cursor, 'playlist_songs_new')
+            # 只差大小写或空白的旧行会映射到同一个 song_id，同一歌单内只保留最近添加的一行
+            new_rows, skipped_ids, seen = [], [], set()
+            for row in rows:
+                song_id = song_ids[song_key(row[3], row[2])]
+                if (row[1], song_id) in seen:
+                    skipped_ids.append(row[0])
+                    continue
+                seen.add((row[1], song_id))
+                new_rows.append((row[0], row[1], song_id, row[7]))
+            if skipped_ids:
+                logger.warning(f"{len(skipped_ids)} legacy playlist songs duplicate a newer row of the same playlist "
+                               f"(queries differing only in case or whitespace) and are not migrated; they remain in "
+                               f"'{LEGACY_PLAYLIST_SONGS_TABLE}'. Legacy ids: {sorted(skipped_ids)}")
+            for start in range(0, len(new_rows), BULK_INSERT_BATCH_SIZE):
+                cursor.executemany(f"""
+                    {backend.insert_ignore} INTO playlist_songs_new (id, playlist_id, song_id, added_at)
+                    VALUES (%s, %s, %s, %s)
+                """, new_rows[start:start + BULK_INSERT_BATCH_SIZE])
+            backend.swap_tables(cursor, 'playlist_songs', 'playlist_songs_new', LEGACY_PLAYLIST_SONGS_TABLE)
+        logger.info(f"Migrated {len(new_rows)} of {len(rows)} playlist songs ({len(song_ids)} distinct, "
+                    f"{len(skipped_ids)} duplicates skipped) to the song catalog; "
+                    f"old table kept as '{LEGACY_PLAYLIST_SONGS_TABLE}'.")
+    except DB_ERRORS as err:
+        logger.error(f"Error migrating playlist_songs to the song catalog: {err}")
 
 # --- User Functions ---
 def get_user_by_username(username):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True) # dictionary=True to get rows as dicts
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-        return user
-    except mysql.connector.Error as err:
+        with db_cursor(dictionary=True) as cursor: # dictionary=True to get rows as dicts
+            cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+            return cursor.fetchone()
+    except DB_ERRORS as err:
         logger.error(f"Error fetching user by username '{username}': {err}")
         return None
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 def get_user_by_id(user_id):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        return user
-    except mysql.connector.Error as err:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+            return cursor.fetchone()
+    except DB_ERRORS as err:
         logger.error(f"Error fetching user by ID '{user_id}': {err}")
         return None
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 def create_user(username):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO users (username) VALUES (%s)", (username,))
-        conn.commit()
-        user_id = cursor.lastrowid # Get the ID of the newly inserted user
+        with db_cursor() as cursor:
+            cursor.execute("INSERT INTO users (username) VALUES (%s)", (username,))
+            user_id = cursor.lastrowid # Get the ID of the newly inserted user
         if user_id:
             logger.info(f"User '{username}' created with ID {user_id}.")
             return {'id': user_id, 'username': username} # Return a dict similar to fetchone()
         else: # Should not happen if insert was successful without error
             logger.error(f"User '{username}' creation reported success but no lastrowid.")
             return None
-    except mysql.connector.Error as err:
-        if err.errno == 1062: # Error number for duplicate entry
+    except DB_ERRORS as err:
+        if _get_backend().is_duplicate_error(err): # Duplicate entry
             logger.warning(f"Attempted to create duplicate user '{username}'.")
             return get_user_by_username(username) # Return existing user
         logger.error(f"Error creating user '{username}': {err}")
         return None
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 # --- Playlist Functions ---
 def create_playlist(user_id, name):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO playlists (user_id, name) VALUES (%s, %s)", (user_id, name))
-        conn.commit()
-        playlist_id = cursor.lastrowid
+        with db_cursor() as cursor:
+            cursor.execute("INSERT INTO playlists (user_id, name) VALUES (%s, %s)", (user_id, name))
+            playlist_id = cursor.lastrowid
+        invalidate_playlists_cache(user_id)
         logger.info(f"Playlist '{name}' created for user_id {user_id} with playlist_id {playlist_id}.")
         return playlist_id
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         logger.error(f"Error creating playlist '{name}' for user_id {user_id}: {err}")
         return None
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+
+def _get_cached_playlists(user_id):
+    """
+    Returns: 缓存中该用户歌单列表的副本，未命中返回 None。
+    """
+    playlists = _playlists_cache.get(user_id)
+    if playlists is MISSING:
+        return None
+    return [dict(playlist) for playlist in playlists]
+
+def _playlists_cache_generation():
+    with _playlists_generation_lock:
+        return _playlists_generation
+
+def _store_playlists(user_id, playlists, generation):
+    """
+    写入歌单缓存；generation 为查询前 _playlists_cache_generation() 的返回值，之后发生过失效时不写入。
+    """
+    with _playlists_generation_lock:
+        if generation == _playlists_generation:
+            _playlists_cache.set(user_id, [dict(playlist) for playlist in playlists])
 
 def get_playlists_by_user_id(user_id):
-    conn = None
+    """
+    返回用户的全部歌单（最新创建的在前）。结果按用户缓存，命中时不访问数据库。
+    """
+    cached = _get_cached_playlists(user_id)
+    if cached is not None:
+        return cached
+    generation = _playlists_cache_generation()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM playlists WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
-        playlists = cursor.fetchall()
-        return playlists
-    except mysql.connector.Error as err:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT * FROM playlists WHERE user_id = %s ORDER BY created_at DESC, id DESC", (user_id,))
+            playlists = cursor.fetchall()
+    except DB_ERRORS as err:
         logger.error(f"Error fetching playlists for user_id {user_id}: {err}")
         return []
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+    _store_playlists(user_id, playlists, generation)
+    return playlists
+
+def get_playlists_cache_stats():
+    """
+    返回用户歌单缓存的命中/未命中统计。
+    """
+    return _playlists_cache.stats()
+
+def configure_playlists_cache(max_entries=None, ttl_seconds=None):
+    _playlists_cache.configure(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+def invalidate_playlists_cache(user_id=None):
+    """
+    使某个用户（user_id 为空时为所有用户）的歌单缓存失效。
+    """
+    global _playlists_generation
+    with _playlists_generation_lock:
+        _playlists_generation += 1
+        return _playlists_cache.invalidate(user_id)
 
 def get_playlist_by_id(playlist_id, user_id=None):
-    conn = None
+    if user_id:
+        # 指定用户时可以直接从该用户的歌单缓存中查找
+        cached = _get_cached_playlists(user_id)
+        if cached is not None:
+            return next((playlist for playlist in cached if playlist['id'] == playlist_id), None)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        if user_id:
-            cursor.execute("SELECT * FROM playlists WHERE id = %s AND user_id = %s", (playlist_id, user_id))
-        else:
-            cursor.execute("SELECT * FROM playlists WHERE id = %s", (playlist_id,))
-        playlist = cursor.fetchone()
-        return playlist
-    except mysql.connector.Error as err:
+        with db_cursor(dictionary=True) as cursor:
+            if user_id:
+                cursor.execute("SELECT * FROM playlists WHERE id = %s AND user_id = %s", (playlist_id, user_id))
+            else:
+                cursor.execute("SELECT * FROM playlists WHERE id = %s", (playlist_id,))
+            return cursor.fetchone()
+    except DB_ERRORS as err:
         logger.error(f"Error fetching playlist ID {playlist_id}: {err}")
         return None
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 def delete_playlist_by_id(playlist_id, user_id):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # First, verify ownership
-        cursor.execute("SELECT user_id FROM playlists WHERE id = %s", (playlist_id,))
-        playlist = cursor.fetchone()
-        if not playlist or playlist[0] != user_id:
-            logger.warning(f"User {user_id} attempted to delete playlist {playlist_id} without ownership.")
-            return False
-        
-        # CASCADE delete should handle playlist_songs, but good to be aware
-        cursor.execute("DELETE FROM playlists WHERE id = %s AND user_id = %s", (playlist_id, user_id))
-        conn.commit()
-        if cursor.rowcount > 0:
+        with db_transaction() as cursor:
+            # First, verify ownership
+            cursor.execute("SELECT user_id FROM playlists WHERE id = %s", (playlist_id,))
+            playlist = cursor.fetchone()
+            if not playlist or playlist[0] != user_id:
+                logger.warning(f"User {user_id} attempted to delete playlist {playlist_id} without ownership.")
+                return False
+
+            # CASCADE delete should handle playlist_songs, but good to be aware
+            cursor.execute("DELETE FROM playlists WHERE id = %s AND user_id = %s", (playlist_id, user_id))
+            deleted = cursor.rowcount > 0
+        invalidate_playlists_cache(user_id)
+        if deleted:
             logger.info(f"Playlist ID {playlist_id} deleted by user_id {user_id}.")
             return True
         logger.warning(f"Playlist ID {playlist_id} not found or not owned by user_id {user_id} during delete.")
         return False
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         logger.error(f"Error deleting playlist ID {playlist_id} by user_id {user_id}: {err}")
-        if conn:
-            conn.rollback()
         return False
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 # --- Playlist Song Functions ---
+def song_key(song_query, song_api_index):
+    """
+    歌曲目录的去重键（SONG_KEY_BYTES 字节）。关键词的规范化与搜索缓存一致：合并空白、忽略大小写。
+    """
+    query = ' '.join(str(song_query or '').split()).casefold()
+    index = str(song_api_index).strip().casefold()
+    return hashlib.sha256(f"{query}\x00{index}".encode('utf-8')).digest()[:SONG_KEY_BYTES]
+
+def _ensure_catalog_songs(cursor, songs):
+    """
+    把歌曲写入 songs 目录（已存在的保留原有元数据），需在事务中调用，cursor 返回元组行。
+    Returns: {song_key: song_id}
+    """
+    song_ids = {}
+    rows = []
+    for song in songs:
+        key = song_key(song['song_query'], song['song_api_index'])
+        if key not in song_ids:
+            song_ids[key] = None
+            rows.append((key, str(song['song_api_index']), song['song_query'],
+                         song['title'], song.get('singer'), song.get('cover')))
+    keys = list(song_ids)
+    for start in range(0, len(rows), BULK_INSERT_BATCH_SIZE):
+        cursor.executemany(f"""
+            {_get_backend().insert_ignore} INTO songs (song_key, song_api_index, song_query, title, singer, cover)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, rows[start:start + BULK_INSERT_BATCH_SIZE])
+        batch = keys[start:start + BULK_INSERT_BATCH_SIZE]
+        cursor.execute(f"SELECT id, song_key FROM songs WHERE song_key IN ({', '.join(['%s'] * len(batch))})", batch)
+        for song_id, key in cursor.fetchall():
+            song_ids[bytes(key)] = song_id # MySQL 驱动返回 bytearray
+    return song_ids
+
+def _playlist_song_columns(columns):
+    return ', '.join(f"{_PLAYLIST_SONG_COLUMN_SQL[column]} AS {column}" for column in columns)
+
 def add_song_to_playlist(playlist_id, song_api_index, song_query, title, singer, cover):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Check if song already exists (optional, as UNIQUE constraint handles it)
-        # cursor.execute(
-        #     "SELECT id FROM playlist_songs WHERE playlist_id = %s AND song_api_index = %s AND song_query = %s",
-        #     (playlist_id, song_api_index, song_query)
-        # )
-        # existing_song = cursor.fetchone()
-        # if existing_song:
-        #     logger.info(f"Song '{title}' (API Index: {song_api_index}) already in playlist ID {playlist_id}.")
-        #     return True, f"歌曲 '{title}' 已存在于歌单中。"
-
-        cursor.execute("""
-            INSERT INTO playlist_songs (playlist_id, song_api_index, song_query, title, singer, cover)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (playlist_id, song_api_index, song_query, title, singer, cover))
-        conn.commit()
+        with db_transaction() as cursor:
+            # Check if song already exists (optional, as UNIQUE constraint handles it)
+            # cursor.execute(
+            #     "SELECT id FROM playlist_songs WHERE playlist_id = %s AND song_api_index = %s AND song_query = %s",
+            #     (playlist_id, song_api_index, song_query)
+            # )
+            # existing_song = cursor.fetchone()
+            # if existing_song:
+            #     logger.info(f"Song '{title}' (API Index: {song_api_index}) already in playlist ID {playlist_id}.")
+            #     return True, f"歌曲 '{title}' 已存在于歌单中。"
+
+            song_ids = _ensure_catalog_songs(cursor, [{'song_api_index': song_api_index, 'song_query': song_query,
+                                                       'title': title, 'singer': singer, 'cover': cover}])
+            cursor.execute("INSERT INTO playlist_songs (playlist_id, song_id) VALUES (%s, %s)",
+                           (playlist_id, song_ids[song_key(song_query, song_api_index)]))
         logger.info(f"Song '{title}' (API Index: {song_api_index}) added to playlist ID {playlist_id}.")
         return True, f"歌曲 '{title}' 已成功添加到歌单。"
-    except mysql.connector.Error as err:
-        if err.errno == 1062: # Duplicate entry
+    except DB_ERRORS as err:
+        if _get_backend().is_duplicate_error(err): # Duplicate entry
             logger.warning(f"Song '{title}' (Query: {song_query}, API Index: {song_api_index}) already exists in playlist ID {playlist_id} due to UNIQUE constraint.")
             # Fetch the existing song details if needed, or just inform
             return True, f"歌曲 '{title}' 已存在于歌单中。"
         logger.error(f"Error adding song to playlist ID {playlist_id}: {err}")
-        if conn:
-            conn.rollback()
         return False, f"添加歌曲 '{title}' 到歌单时发生数据库错误。"
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+
+def add_songs_to_playlist(playlist_id, songs):
+    """
+    批量向歌单添加歌曲：在一个事务中先写入 songs 目录，再按 BULK_INSERT_BATCH_SIZE 分批 executemany，
+    已存在的歌曲（unique_song_in_playlist）由 INSERT IGNORE（SQLite 为 INSERT OR IGNORE）跳过。
+    Args:
+        songs: [{'song_api_index', 'song_query', 'title', 'singer', 'cover'}, ...]
+    Returns: 与 songs 顺序一致的列表，True 表示新增、False 表示已存在；数据库错误时返回 None。
+    """
+    outcomes = [False] * len(songs)
+    seen = set()
+    try:
+        with db_transaction() as cursor:
+            song_ids = _ensure_catalog_songs(cursor, songs)
+            for start in range(0, len(songs), BULK_INSERT_BATCH_SIZE):
+                batch_ids = [song_ids[song_key(song['song_query'], song['song_api_index'])]
+                             for song in songs[start:start + BULK_INSERT_BATCH_SIZE]]
+                lookup = sorted(set(batch_ids) - seen)
+                if lookup:
+                    placeholders = ', '.join(['%s'] * len(lookup))
+                    cursor.execute(f"""
+                        SELECT song_id FROM playlist_songs
+                        WHERE playlist_id = %s AND song_id IN ({placeholders})
+                    """, (playlist_id, *lookup))
+                    seen.update(row[0] for row in cursor.fetchall())
+
+                rows = []
+                for offset, song_id in enumerate(batch_ids):
+                    if song_id in seen: # 歌单中已有，或同一批导入中重复出现
+                        continue
+                    seen.add(song_id)
+                    outcomes[start + offset] = True
+                    rows.append((playlist_id, song_id))
+                if rows:
+                    cursor.executemany(f"""
+                        {_get_backend().insert_ignore} INTO playlist_songs (playlist_id, song_id)
+                        VALUES (%s, %s)
+                    """, rows)
+                    if cursor.rowcount != len(rows):
+                        logger.warning(f"Bulk insert into playlist ID {playlist_id}: expected {len(rows)} new rows, inserted {cursor.rowcount}.")
+        logger.info(f"Bulk added {sum(outcomes)} of {len(songs)} songs to playlist ID {playlist_id}.")
+        return outcomes
+    except DB_ERRORS as err:
+        logger.error(f"Error bulk adding {len(songs)} songs to playlist ID {playlist_id}: {err}")
+        return None
 
 def remove_song_from_playlist(playlist_song_id, user_id):
     """Removes a song from a playlist. playlist_song_id is the ID from playlist_songs table."""
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Verify ownership: check if the playlist_song_id belongs to a playlist owned by user_id
-        # This is a bit more complex as it involves a join or subquery.
-        cursor.execute("""
-            SELECT ps.id 
-            FROM playlist_songs ps
-            JOIN playlists p ON ps.playlist_id = p.id
-            WHERE ps.id = %s AND p.user_id = %s
-        """, (playlist_song_id, user_id))
-        song_to_delete = cursor.fetchone()
-
-        if not song_to_delete:
-            logger.warning(f"User {user_id} attempted to remove song (playlist_song_id: {playlist_song_id}) not found or not owned.")
-            return False
-
-        cursor.execute("DELETE FROM playlist_songs WHERE id = %s", (playlist_song_id,))
-        conn.commit()
-        if cursor.rowcount > 0:
+        with db_transaction() as cursor:
+            # Verify ownership: check if the playlist_song_id belongs to a playlist owned by user_id
+            # This is a bit more complex as it involves a join or subquery.
+            cursor.execute("""
+                SELECT ps.id 
+                FROM playlist_songs ps
+                JOIN playlists p ON ps.playlist_id = p.id
+                WHERE ps.id = %s AND p.user_id = %s
+            """, (playlist_song_id, user_id))
+            song_to_delete = cursor.fetchone()
+
+            if not song_to_delete:
+                logger.warning(f"User {user_id} attempted to remove song (playlist_song_id: {playlist_song_id}) not found or not owned.")
+                return False
+
+            cursor.execute("DELETE FROM playlist_songs WHERE id = %s", (playlist_song_id,))
+            removed = cursor.rowcount > 0
+        if removed:
             logger.info(f"Song (playlist_song_id: {playlist_song_id}) removed from playlist by user {user_id}.")
             return True
         # This case should ideally be caught by the check above
         logger.warning(f"Song (playlist_song_id: {playlist_song_id}) not found during delete for user {user_id}, though ownership check passed (should not happen).")
         return False
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         logger.error(f"Error removing song (playlist_song_id: {playlist_song_id}) from playlist by user {user_id}: {err}")
-        if conn:
-            conn.rollback()
         return False
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
-def get_songs_in_playlist(playlist_id):
-    conn = None
+def get_songs_in_playlist(playlist_id, columns=PLAYLIST_SONG_LIST_COLUMNS):
+    """
+    返回歌单中的全部歌曲（最新添加的在前）。columns 为需要的列（见 _PLAYLIST_SONG_COLUMN_SQL），默认不含 playlist_id 等冗余列。
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT * FROM playlist_songs 
-            WHERE playlist_id = %s 
-            ORDER BY added_at DESC 
-        """, (playlist_id,)) # Changed to DESC so newest songs appear first
-        songs = cursor.fetchall()
-        return songs
-    except mysql.connector.Error as err:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(f"""
+                SELECT {_playlist_song_columns(columns)}
+                FROM playlist_songs ps JOIN songs s ON s.id = ps.song_id
+                WHERE ps.playlist_id = %s 
+                ORDER BY ps.added_at DESC, ps.id DESC
+            """, (playlist_id,)) # Changed to DESC so newest songs appear first
+            return cursor.fetchall()
+    except DB_ERRORS as err:
         logger.error(f"Error fetching songs for playlist ID {playlist_id}: {err}")
         return []
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+
+def encode_song_cursor(song, time_column='added_at'):
+    """
+    由一页中的最后一行生成下一页的游标字符串: <time_column 的 YYYYmmddHHMMSS>-<id>。
+    """
+    return f"{song[time_column].strftime('%Y%m%d%H%M%S')}-{song['id']}"
+
+def decode_song_cursor(cursor_str):
+    """
+    Returns: (datetime, id) or None if the cursor is malformed.
+    """
+    try:
+        stamp, song_id = cursor_str.split('-', 1)
+        return datetime.strptime(stamp, '%Y%m%d%H%M%S'), int(song_id)
+    except (AttributeError, ValueError):
+        return None
+
+def _escape_like(text):
+    # 使用 '!' 作为 LIKE 的转义字符：反斜杠在 MySQL 和 SQLite 的字符串字面量中含义不同
+    return text.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+def get_playlist_songs_page(playlist_id, limit=PLAYLIST_PAGE_SIZE, after=None, search=None):
+    """
+    按 (added_at, id) 倒序分页获取歌单歌曲（键集分页，使用 idx_playlist_added 索引，不需要排序和 OFFSET）。
+    Args:
+        after: 上一页返回的游标 (added_at, id)，None 表示第一页。
+        search: 可选的关键词，匹配歌名或歌手（不区分大小写）。
+    Returns: (songs, next_cursor)；没有下一页时 next_cursor 为 None。数据库错误时返回 ([], None)。
+    """
+    conditions = ["ps.playlist_id = %s"]
+    params = [playlist_id]
+    if after is not None:
+        after_added_at, after_id = after
+        conditions.append("(ps.added_at < %s OR (ps.added_at = %s AND ps.id < %s))")
+        params += [after_added_at, after_added_at, after_id]
+    if search:
+        pattern = f"%{_escape_like(search.strip())}%"
+        conditions.append("(s.title LIKE %s ESCAPE '!' OR s.singer LIKE %s ESCAPE '!')")
+        params += [pattern, pattern]
+    params.append(limit + 1) # 多取一行判断是否还有下一页
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(f"""
+                SELECT {_playlist_song_columns(PLAYLIST_SONG_LIST_COLUMNS)}
+                FROM playlist_songs ps JOIN songs s ON s.id = ps.song_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY ps.added_at DESC, ps.id DESC
+                LIMIT %s
+            """, params)
+            songs = cursor.fetchall()
+    except DB_ERRORS as err:
+        logger.error(f"Error fetching song page for playlist ID {playlist_id}: {err}")
+        return [], None
+    if len(songs) > limit:
+        songs = songs[:limit]
+        return songs, encode_song_cursor(songs[-1])
+    return songs, None
+
+def count_songs_in_playlist(playlist_id):
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM playlist_songs WHERE playlist_id = %s", (playlist_id,))
+            return cursor.fetchone()[0]
+    except DB_ERRORS as err:
+        logger.error(f"Error counting songs for playlist ID {playlist_id}: {err}")
+        return 0
+
+def get_player_context(user_id, playlist_id=None):
+    """
+    播放页需要的数据一次查询取回：当前歌单（需属于该用户）、歌单中的歌曲（最新添加的在前）和用户的全部歌单。
+    三部分通过 UNION ALL 合并为一个结果集，以 section 列区分。
+    用户歌单列表已缓存时只查询歌单歌曲（未指定歌单时不访问数据库）。
+    Returns: {'playlist': dict or None, 'songs': [...], 'user_playlists': [...]}；数据库错误时各部分为空。
+    """
+    context = {'playlist': None, 'songs': [], 'user_playlists': []}
+    cached = _get_cached_playlists(user_id)
+    if cached is not None:
+        context['user_playlists'] = cached
+        context['playlist'] = next((playlist for playlist in cached if playlist['id'] == playlist_id), None)
+        if context['playlist'] is not None:
+            context['songs'] = get_songs_in_playlist(playlist_id, columns=PLAYLIST_SONG_NAV_COLUMNS)
+        return context
+    generation = _playlists_cache_generation()
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute("""
+                SELECT 0 AS section, p.id, p.user_id, p.name, NULL AS song_api_index, NULL AS song_query,
+                       NULL AS title, NULL AS singer, p.created_at AS sort_at
+                FROM playlists p WHERE p.id = %s AND p.user_id = %s
+                UNION ALL
+                SELECT 1, ps.id, NULL, NULL, s.song_api_index, s.song_query, s.title, s.singer, ps.added_at
+                FROM playlist_songs ps JOIN playlists p ON p.id = ps.playlist_id JOIN songs s ON s.id = ps.song_id
+                WHERE ps.playlist_id = %s AND p.user_id = %s
+                UNION ALL
+                SELECT 2, p.id, p.user_id, p.name, NULL, NULL, NULL, NULL, p.created_at
+                FROM playlists p WHERE p.user_id = %s
+                ORDER BY section, sort_at DESC, id DESC
+            """, (playlist_id, user_id, playlist_id, user_id, user_id))
+            rows = cursor.fetchall()
+    except DB_ERRORS as err:
+        logger.error(f"Error fetching player context for user_id {user_id}, playlist ID {playlist_id}: {err}")
+        return context
+    for row in rows:
+        section = row.pop('section')
+        sort_at = row.pop('sort_at')
+        if section == 0:
+            context['playlist'] = {'id': row['id'], 'user_id': row['user_id'], 'name': row['name'], 'created_at': sort_at}
+        elif section == 1:
+            context['songs'].append({column: row[column] for column in PLAYLIST_SONG_NAV_COLUMNS})
+        else:
+            context['user_playlists'].append({'id': row['id'], 'user_id': row['user_id'], 'name': row['name'], 'created_at': sort_at})
+    _store_playlists(user_id, context['user_playlists'], generation)
+    return context
+
+# --- Play History Functions ---
+def add_play_history_entries(entries):
+    """
+    批量写入播放记录（由 history_buffer.HistoryWriter 在后台调用），歌曲先写入 songs 目录。
+    Args:
+        entries: [(user_id, song, played_at), ...]，song 为 {'song_api_index', 'song_query', 'title', 'singer', 'cover'}。
+    Returns: 写入的行数；数据库错误时返回 None。
+    """
+    if not entries:
+        return 0
+    try:
+        with db_transaction() as cursor:
+            song_ids = _ensure_catalog_songs(cursor, [song for _, song, _ in entries])
+            rows = [(user_id, song_ids[song_key(song['song_query'], song['song_api_index'])], played_at)
+                    for user_id, song, played_at in entries]
+            for start in range(0, len(rows), BULK_INSERT_BATCH_SIZE):
+                cursor.executemany("INSERT INTO play_history (user_id, song_id, played_at) VALUES (%s, %s, %s)",
+                                   rows[start:start + BULK_INSERT_BATCH_SIZE])
+        logger.info(f"Wrote {len(rows)} play history entries.")
+        return len(rows)
+    except DB_ERRORS as err:
+        logger.error(f"Error writing {len(entries)} play history entries: {err}")
+        return None
+
+def get_play_history_page(user_id, limit=PLAY_HISTORY_PAGE_SIZE, after=None):
+    """
+    按 (played_at, id) 倒序分页获取用户的播放记录（键集分页，使用 idx_history_user_played 索引）。
+    Args:
+        after: 上一页返回的游标 (played_at, id)，None 表示第一页。
+    Returns: (entries, next_cursor)；没有下一页时 next_cursor 为 None。数据库错误时返回 ([], None)。
+    """
+    conditions = ["h.user_id = %s"]
+    params = [user_id]
+    if after is not None:
+        after_played_at, after_id = after
+        conditions.append("(h.played_at < %s OR (h.played_at = %s AND h.id < %s))")
+        params += [after_played_at, after_played_at, after_id]
+    params.append(limit + 1)
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(f"""
+                SELECT h.id, s.song_api_index, s.song_query, s.title, s.singer, s.cover, h.played_at
+                FROM play_history h JOIN songs s ON s.id = h.song_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY h.played_at DESC, h.id DESC
+                LIMIT %s
+            """, params)
+            entries = cursor.fetchall()
+    except DB_ERRORS as err:
+        logger.error(f"Error fetching play history for user_id {user_id}: {err}")
+        return [], None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        return entries, encode_song_cursor(entries[-1], time_column='played_at')
+    return entries, None
+
+def clear_play_history(user_id):
+    """
+    Returns: 删除的行数；数据库错误时返回 None。
+    """
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("DELETE FROM play_history WHERE user_id = %s", (user_id,))
+            removed = cursor.rowcount
+        logger.info(f"Cleared {removed} play history entries for user_id {user_id}.")
+        return removed
+    except DB_ERRORS as err:
+        logger.error(f"Error clearing play history for user_id {user_id}: {err}")
+        return None
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
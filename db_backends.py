@@ -0,0 +1,377 @@
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+try:
+    import mysql.connector
+except ImportError: # 只使用 SQLite 时可以不安装 mysql-connector-python
+    mysql = None
+
+# database.py 的存储后端。查询函数统一使用 %s 占位符和 MySQL 风格的 SQL，
+# 后端负责建立连接、游标、事务、建表以及少量方言差异（如 INSERT IGNORE）。
+
+logger = logging.getLogger(__name__)
+
+# 所有驱动的异常类型，database.py 中的查询函数统一捕获
+DRIVER_ERRORS = (sqlite3.Error,) + ((mysql.connector.Error,) if mysql is not None else ())
+
+# --- MySQL ---
+# 歌曲目录：每首歌 (关键词, API 序号) 只保存一行元数据，song_key 为两者规范化后的 16 字节哈希
+MYSQL_SONGS_DDL = """
+    CREATE TABLE IF NOT EXISTS songs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        song_key BINARY(16) NOT NULL,
+        song_api_index VARCHAR(255) NOT NULL, -- Can be non-integer from some APIs
+        song_query TEXT NOT NULL,
+        title VARCHAR(255) NOT NULL,
+        singer VARCHAR(255),
+        cover TEXT, -- URL, can be long
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_song_key (song_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+# {table}: 迁移时先以临时表名创建
+MYSQL_PLAYLIST_SONGS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        playlist_id INT NOT NULL,
+        song_id INT NOT NULL,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (playlist_id) REFERENCES playlists(id) ON DELETE CASCADE,
+        FOREIGN KEY (song_id) REFERENCES songs(id),
+        UNIQUE KEY unique_song_in_playlist (playlist_id, song_id),
+        KEY idx_playlist_added (playlist_id, added_at, id), -- 歌单内按添加时间分页
+        KEY idx_song (song_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+MYSQL_TABLES = [
+    ('users', """
+    CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        username VARCHAR(80) UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """),
+    ('playlists', """
+    CREATE TABLE IF NOT EXISTS playlists (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """),
+    ('songs', MYSQL_SONGS_DDL),
+    ('playlist_songs', MYSQL_PLAYLIST_SONGS_DDL.format(table='playlist_songs')),
+    # 登录用户的播放记录，每次播放一行
+    ('play_history', """
+    CREATE TABLE IF NOT EXISTS play_history (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        song_id INT NOT NULL,
+        played_at DATETIME NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (song_id) REFERENCES songs(id),
+        KEY idx_history_user_played (user_id, played_at, id) -- 按播放时间分页
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """),
+]
+# 旧版本创建的表上需要补建的索引: (表, 索引名, 列)
+MYSQL_INDEXES = [
+    ('playlist_songs', 'idx_playlist_added', '(playlist_id, added_at, id)'),
+]
+
+class MySQLBackend:
+    """
+    MySQL 后端（mysql-connector-python）。连接使用 autocommit，避免空闲连接持有旧的事务快照；
+    需要多条语句原子执行时由 begin() 显式开启事务。
+    """
+
+    name = 'mysql'
+    insert_ignore = 'INSERT IGNORE'
+    # 连接池参数：连接存活超过 recycle_seconds 后重建（应小于服务端 wait_timeout）
+    pool_options = {'recycle_seconds': 3600, 'pre_ping_seconds': 30}
+
+    def __init__(self, config):
+        if mysql is None:
+            raise RuntimeError("使用 MySQL 后端需要安装 mysql-connector-python")
+        self.config = dict(config)
+
+    def connect(self):
+        try:
+            conn = mysql.connector.connect(**self.config)
+        except mysql.connector.Error as err:
+            logger.error(f"Error connecting to MySQL: {err}")
+            raise
+        conn.autocommit = True
+        return conn
+
+    def ping(self, conn):
+        conn.ping(reconnect=False)
+
+    def reset(self, conn):
+        if conn.unread_result:
+            conn.consume_results()
+        if conn.in_transaction:
+            conn.rollback()
+
+    def cursor(self, conn, dictionary=False):
+        return conn.cursor(dictionary=dictionary)
+
+    def begin(self, conn):
+        conn.start_transaction()
+
+    def is_duplicate_error(self, err):
+        return getattr(err, 'errno', None) == 1062 # Error number for duplicate entry
+
+    def is_connection_error(self, err):
+        return isinstance(err, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError))
+
+    def column_exists(self, cursor, table, column):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            LIMIT 1
+        """, (table, column))
+        return cursor.fetchone() is not None
+
+    def create_playlist_songs_table(self, cursor, table):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}") # 上次中断的迁移留下的临时表
+        cursor.execute(MYSQL_PLAYLIST_SONGS_DDL.format(table=table))
+
+    def swap_tables(self, cursor, table, new_table, legacy_table):
+        # RENAME TABLE 一次交换两个表名，是原子操作
+        cursor.execute(f"RENAME TABLE {table} TO {legacy_table}, {new_table} TO {table}")
+
+    def init_schema(self, cursor):
+        for table, ddl in MYSQL_TABLES:
+            cursor.execute(ddl)
+            logger.info(f"Table '{table}' checked/created.")
+        for table, index_name, columns in MYSQL_INDEXES:
+            cursor.execute("""
+                SELECT 1 FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+                LIMIT 1
+            """, (table, index_name))
+            if cursor.fetchone():
+                continue
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX {index_name} {columns}")
+            logger.info(f"Index '{index_name}' added to table '{table}'.")
+
+# --- SQLite ---
+# 与 MySQL 表结构等价：utf8mb4 的排序规则不区分大小写，对应列使用 COLLATE NOCASE；
+# 歌曲目录以 song_key（16 字节 BLOB）去重。
+SQLITE_SONGS_DDL = """
+    CREATE TABLE IF NOT EXISTS songs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        song_key BLOB NOT NULL UNIQUE,
+        song_api_index TEXT NOT NULL,
+        song_query TEXT NOT NULL,
+        title TEXT NOT NULL,
+        singer TEXT,
+        cover TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+SQLITE_PLAYLIST_SONGS_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        playlist_id INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+        song_id INTEGER NOT NULL REFERENCES songs(id),
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT unique_song_in_playlist UNIQUE (playlist_id, song_id)
+    )
+    """
+SQLITE_TABLES = [
+    ('users', """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL COLLATE NOCASE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """),
+    ('playlists', """
+    CREATE TABLE IF NOT EXISTS playlists (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """),
+    ('songs', SQLITE_SONGS_DDL),
+    ('playlist_songs', SQLITE_PLAYLIST_SONGS_DDL.format(table='playlist_songs')),
+    ('play_history', """
+    CREATE TABLE IF NOT EXISTS play_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        song_id INTEGER NOT NULL REFERENCES songs(id),
+        played_at TIMESTAMP NOT NULL
+    )
+    """),
+]
+# 旧表结构的 playlist_songs 没有 song_id 列，该索引在迁移后创建
+SQLITE_PLAYLIST_SONGS_SONG_INDEX = "CREATE INDEX IF NOT EXISTS idx_playlist_songs_song ON playlist_songs (song_id)"
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_playlists_user ON playlists (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_playlist_added ON playlist_songs (playlist_id, added_at, id)",
+    SQLITE_PLAYLIST_SONGS_SONG_INDEX,
+    "CREATE INDEX IF NOT EXISTS idx_history_user_played ON play_history (user_id, played_at, id)",
+]
+# 每个连接建立时执行；journal_mode=WAL 会持久化到数据库文件
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',       # 读写互不阻塞
+    'synchronous': 'NORMAL',     # WAL 下断电最多丢失最后的事务，不会损坏数据库
+    'foreign_keys': 'ON',        # ON DELETE CASCADE 需要
+    'busy_timeout': 5000,        # 写锁被占用时等待的毫秒数
+    'cache_size': -16000,        # 每个连接约 16MB 页缓存
+    'temp_store': 'MEMORY',
+    'mmap_size': 64 * 1024 * 1024,
+}
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S' # 与 CURRENT_TIMESTAMP 的格式一致（UTC）
+
+_PLACEHOLDER_REGEX = re.compile(r'%s')
+
+def _to_sqlite_param(value):
+    if isinstance(value, datetime):
+        return value.strftime(SQLITE_TIMESTAMP_FORMAT)
+    return value
+
+def _from_sqlite_value(column, value):
+    # SQLite 没有日期类型：*_at 列中的文本时间戳转换为 datetime，与 MySQL 驱动的返回值一致
+    if isinstance(value, str) and column.endswith('_at'):
+        try:
+            return datetime.strptime(value[:19], SQLITE_TIMESTAMP_FORMAT)
+        except ValueError:
+            return value
+    return value
+
+class _SQLiteCursor:
+    """
+    提供 database.py 用到的 mysql-connector 游标接口：%s 占位符、dictionary 行、rowcount、lastrowid。
+    """
+
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _sql(operation):
+        return _PLACEHOLDER_REGEX.sub('?', operation)
+
+    def execute(self, operation, params=()):
+        self._cursor.execute(self._sql(operation), [_to_sqlite_param(p) for p in params])
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(self._sql(operation), ([_to_sqlite_param(p) for p in params] for params in seq_params))
+
+    def _convert(self, row):
+        columns = [d[0] for d in self._cursor.description]
+        values = [_from_sqlite_value(column, value) for column, value in zip(columns, row)]
+        return dict(zip(columns, values)) if self._dictionary else tuple(values)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._convert(row) if row is not None else None
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteBackend:
+    """
+    嵌入式 SQLite 后端（WAL）。适合单机部署和本地开发，不需要单独的数据库服务。
+    """
+
+    name = 'sqlite'
+    insert_ignore = 'INSERT OR IGNORE'
+    # 本地文件连接不会被服务端断开，不需要 ping 和定期重建
+    pool_options = {'recycle_seconds': 0, 'pre_ping_seconds': 0}
+
+    def __init__(self, path, pragmas=None):
+        self.path = path
+        self.pragmas = dict(SQLITE_PRAGMAS, **(pragmas or {}))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def connect(self):
+        # isolation_level=None: 与 MySQL 后端一样默认 autocommit，事务由 begin() 显式开启；
+        # 连接由连接池保证同一时刻只被一个线程使用
+        conn = sqlite3.connect(self.path, timeout=self.pragmas['busy_timeout'] / 1000,
+                               isolation_level=None, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    ping = None
+
+    def reset(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+    def cursor(self, conn, dictionary=False):
+        return _SQLiteCursor(conn, dictionary=dictionary)
+
+    def begin(self, conn):
+        conn.execute("BEGIN IMMEDIATE") # 立即获取写锁，避免读事务升级为写事务时死锁
+
+    def is_duplicate_error(self, err):
+        return isinstance(err, sqlite3.IntegrityError) and 'UNIQUE' in str(err)
+
+    def is_connection_error(self, err):
+        return isinstance(err, (sqlite3.InterfaceError, sqlite3.ProgrammingError))
+
+    def column_exists(self, cursor, table, column):
+        cursor.execute(f"SELECT name FROM pragma_table_info('{table}')")
+        return any(row[0] == column for row in cursor.fetchall())
+
+    def create_playlist_songs_table(self, cursor, table):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(SQLITE_PLAYLIST_SONGS_DDL.format(table=table))
+
+    def swap_tables(self, cursor, table, new_table, legacy_table):
+        # 索引名在整个数据库中唯一：先删除旧表上的索引，换名后为新表重建
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL", (table,))
+        for (index_name,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX {index_name}")
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy_table}")
+        cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+        self._create_indexes(cursor)
+
+    def _create_indexes(self, cursor):
+        for ddl in SQLITE_INDEXES:
+            cursor.execute(ddl)
+
+    def init_schema(self, cursor):
+        for table, ddl in SQLITE_TABLES:
+            cursor.execute(ddl)
+            logger.info(f"Table '{table}' checked/created.")
+        if self.column_exists(cursor, 'playlist_songs', 'song_id'):
+            self._create_indexes(cursor)
+        else:
+            for ddl in SQLITE_INDEXES:
+                if ddl != SQLITE_PLAYLIST_SONGS_SONG_INDEX:
+                    cursor.execute(ddl)
+
+def create_backend(name, mysql_config=None, sqlite_path=None, sqlite_pragmas=None):
+    """
+    Args:
+        name: 'mysql' 或 'sqlite'。
+    Raises: ValueError（未知后端）或 RuntimeError（缺少驱动）。
+    """
+    if name == 'mysql':
+        return MySQLBackend(mysql_config or {})
+    if name == 'sqlite':
+        return SQLiteBackend(sqlite_path, pragmas=sqlite_pragmas)
+    raise ValueError(f"未知的数据库后端: {name}")
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 通用数据库连接池：与具体驱动无关，由调用方提供建立连接、健康检查和归还前重置的函数。
+# 常驻 size 个连接，繁忙时最多额外创建 max_overflow 个临时连接，归还时超出 size 的部分直接关闭。
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeout(Exception):
+    """连接池已满，等待空闲连接超时。"""
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+class ConnectionPool:
+    """
+    线程安全的连接池。
+    Args:
+        connect: 无参函数，返回新连接。
+        size: 常驻连接数。
+        max_overflow: 超出 size 后最多再创建的连接数。
+        timeout: 连接全部被占用时等待的秒数，超时抛出 PoolTimeout。
+        recycle_seconds: 连接存活超过这个时间后在借出时重建（避免服务端 wait_timeout 断开）。
+        pre_ping_seconds: 空闲超过这个时间的连接在借出前调用 ping 检查；0 表示每次都检查。
+        ping: ping(conn)，连接不可用时抛出异常。
+        reset: reset(conn)，归还前调用（例如回滚未结束的事务）；抛出异常时丢弃该连接。
+    """
+
+    def __init__(self, connect, size=5, max_overflow=10, timeout=10, recycle_seconds=3600,
+                 pre_ping_seconds=30, ping=None, reset=None, name='db_pool'):
+        self._connect = connect
+        self._ping = ping
+        self._reset = reset
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle_seconds = recycle_seconds
+        self.pre_ping_seconds = pre_ping_seconds
+        self.name = name
+        self._idle = deque()
+        self._total = 0 # 已创建且未关闭的连接数（空闲 + 借出）
+        self._cond = threading.Condition()
+        self.created = 0
+        self.recycled = 0
+        self.ping_failures = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.checkouts = 0
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, pooled):
+        self._close(pooled)
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def _is_healthy(self, pooled):
+        now = time.monotonic()
+        if self.recycle_seconds and now - pooled.created_at > self.recycle_seconds:
+            self.recycled += 1
+            return False
+        if self._ping is not None and now - pooled.last_used >= self.pre_ping_seconds:
+            try:
+                self._ping(pooled.conn)
+            except Exception as e:
+                self.ping_failures += 1
+                logger.warning(f"{self.name}: 连接健康检查失败，已丢弃: {e}")
+                return False
+        return True
+
+    def checkout(self):
+        """
+        借出一个可用连接。Raises: PoolTimeout, 或建立连接时驱动抛出的异常。
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                pooled = None
+                while True:
+                    if self._idle:
+                        pooled = self._idle.pop() # 后进先出：优先复用最近用过的连接
+                        break
+                    if self._total < self.size + self.max_overflow:
+                        self._total += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"{self.name}: 等待空闲连接超时 ({self.timeout}s)")
+                    self.waits += 1
+                    self._cond.wait(remaining)
+
+            if pooled is None:
+                try:
+                    pooled = _PooledConnection(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                self.created += 1
+            elif not self._is_healthy(pooled):
+                self._discard(pooled)
+                continue
+            self.checkouts += 1
+            return pooled
+
+    def checkin(self, pooled, discard=False):
+        """
+        归还连接。discard 为 True、重置失败或空闲连接已满时关闭该连接。
+        """
+        if not discard and self._reset is not None:
+            try:
+                self._reset(pooled.conn)
+            except Exception as e:
+                logger.warning(f"{self.name}: 重置连接失败，已丢弃: {e}")
+                discard = True
+        with self._cond:
+            if not discard and len(self._idle) < self.size:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+                self._cond.notify()
+                return
+            self._total -= 1
+            self._cond.notify()
+        self._close(pooled)
+
+    @contextmanager
+    def connection(self):
+        """
+        with pool.connection() as conn: ... 退出时自动归还连接。
+        """
+        pooled = self.checkout()
+        try:
+            yield pooled.conn
+        finally:
+            self.checkin(pooled)
+
+    def configure(self, size=None, max_overflow=None, timeout=None, recycle_seconds=None, pre_ping_seconds=None):
+        with self._cond:
+            if size is not None:
+                self.size = size
+            if max_overflow is not None:
+                self.max_overflow = max_overflow
+            if timeout is not None:
+                self.timeout = timeout
+            if recycle_seconds is not None:
+                self.recycle_seconds = recycle_seconds
+            if pre_ping_seconds is not None:
+                self.pre_ping_seconds = pre_ping_seconds
+            surplus = []
+            while len(self._idle) > self.size:
+                surplus.append(self._idle.popleft())
+                self._total -= 1
+            self._cond.notify_all()
+        for pooled in surplus:
+            self._close(pooled)
+
+    def close(self):
+        """
+        关闭所有空闲连接（借出中的连接归还时会按正常流程处理）。
+        """
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            total = self._total
+        return {
+            'name': self.name,
+            'size': self.size,
+            'max_overflow': self.max_overflow,
+            'total': total,
+            'idle': idle,
+            'checked_out': total - idle,
+            'checkouts': self.checkouts,
+            'created': self.created,
+            'recycled': self.recycled,
+            'ping_failures': self.ping_failures,
+            'waits': self.waits,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,298 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import music_api_handler
+import playlist_import
+
+# 后台下载任务：/download 路由只负责提交任务并立即返回，
+# 真正的下载、封面获取和 ID3 写入在有界线程池中执行，前端通过轮询或 SSE 获取进度。
+# 歌单批量导入也作为后台任务运行（单独的线程池），前端轮询已解析的条目数。
+
+JOB_QUEUED = 'queued'
+JOB_DOWNLOADING = 'downloading'
+JOB_TAGGING = 'tagging'
+JOB_RESOLVING = 'resolving' # 导入任务：正在解析条目
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+ACTIVE_STATES = (JOB_QUEUED, JOB_DOWNLOADING, JOB_TAGGING, JOB_RESOLVING)
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+DEFAULT_MAX_WORKERS = 4       # 同时执行的下载任务数
+DEFAULT_MAX_PENDING = 64      # 排队 + 执行中的任务上限，超过则拒绝新任务
+DEFAULT_JOB_TTL_SECONDS = 3600  # 已结束任务的保留时间
+DEFAULT_IMPORT_WORKERS = 2    # 同时执行的导入任务数
+DEFAULT_MAX_PENDING_IMPORTS = 8  # 排队 + 执行中的导入任务上限
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFull(Exception):
+    """下载或导入队列已满。"""
+
+class _Job:
+    """
+    后台任务的公共部分：状态、时间戳、版本号和结束通知。
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.state = JOB_QUEUED
+        self.message = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0 # 每次状态/进度变化递增，供 SSE 判断是否需要推送
+        self._finished = threading.Event()
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.updated_at = time.time()
+        self.version += 1
+        if self.state in FINISHED_STATES:
+            self._finished.set()
+
+    def wait(self, timeout=None):
+        """
+        等待任务结束（完成或失败）。Returns: 任务在超时前结束时为 True。
+        """
+        return self._finished.wait(timeout)
+
+class DownloadJob(_Job):
+    """
+    单个下载任务的状态。字段由工作线程更新，读取时通过 to_dict() 获取快照。
+    """
+
+    def __init__(self, query, song_api_index):
+        super().__init__()
+        self.query = query
+        self.song_api_index = str(song_api_index)
+        self.title = None
+        self.singer = None
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.relative_path = None
+
+    @property
+    def key(self):
+        return (self.query, self.song_api_index)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'query': self.query,
+            'song_api_index': self.song_api_index,
+            'state': self.state,
+            'title': self.title,
+            'singer': self.singer,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'progress': (self.bytes_done / self.bytes_total) if self.bytes_total else None,
+            'relative_path': self.relative_path,
+            'message': self.message,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'version': self.version,
+        }
+
+class ImportJob(_Job):
+    """
+    歌单批量导入任务。rows_done / rows_total 为解析进度，完成后 summary 和 rows 保存导入结果
+    （见 playlist_import.import_into_playlist）。
+    """
+
+    def __init__(self, playlist_id, user_id, fmt, rows_total):
+        super().__init__()
+        self.playlist_id = playlist_id
+        self.user_id = user_id
+        self.format = fmt
+        self.rows_done = 0
+        self.rows_total = rows_total
+        self.summary = None
+        self.rows = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'playlist_id': self.playlist_id,
+            'format': self.format,
+            'state': self.state,
+            'rows_done': self.rows_done,
+            'rows_total': self.rows_total,
+            'progress': (self.rows_done / self.rows_total) if self.rows_total else None,
+            'summary': self.summary,
+            'rows': self.rows,
+            'message': self.message,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'version': self.version,
+        }
+
+class DownloadJobManager:
+    """
+    有界线程池 + 任务表。相同歌曲的进行中任务会被复用，而不是重复下载。
+    """
+
+    def __init__(self, app_static_folder, max_workers=DEFAULT_MAX_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, job_ttl_seconds=DEFAULT_JOB_TTL_SECONDS, library=None,
+                 import_workers=DEFAULT_IMPORT_WORKERS, max_pending_imports=DEFAULT_MAX_PENDING_IMPORTS):
+        self.app_static_folder = app_static_folder
+        self.library = library # 可选的 library_index.LibraryIndex，命中时不访问上游
+        self.max_pending = max_pending
+        self.max_pending_imports = max_pending_imports
+        self.job_ttl_seconds = job_ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download-job')
+        # 导入任务使用单独的线程池，长时间的导入不会占用下载线程
+        self._import_executor = ThreadPoolExecutor(max_workers=import_workers, thread_name_prefix='import-job')
+        self._import_jobs = {}
+        self._jobs = {}
+        self._active_by_key = {}
+        self._done_by_key = {} # 最近完成的任务，文件仍存在时直接复用
+        self._lock = threading.Lock()
+
+    def submit(self, query, song_api_index):
+        """
+        提交下载任务；同一首歌已有进行中的任务时直接返回该任务。
+        曲库索引中已有该歌曲时返回一个已完成的任务，不访问上游。
+        Raises: JobQueueFull 当排队和执行中的任务数达到 max_pending。
+        """
+        library_hit = self.library.lookup_song(query, song_api_index) if self.library is not None else None
+        with self._lock:
+            self._prune_locked()
+            key = (query, str(song_api_index))
+            existing = self._active_by_key.get(key)
+            if existing is not None:
+                return existing
+            finished = self._done_by_key.get(key)
+            if finished is not None and os.path.exists(os.path.join(self.app_static_folder, finished.relative_path)):
+                return finished
+            if library_hit is not None:
+                job = DownloadJob(query, song_api_index)
+                job.update(state=JOB_DONE, title=library_hit['title'], singer=library_hit['singer'],
+                           relative_path=library_hit['relative_path'], bytes_done=library_hit['size'],
+                           bytes_total=library_hit['size'], message='曲库中已存在')
+                self._jobs[job.id] = job
+                self._done_by_key[key] = job
+                logger.info(f"曲库索引命中: {query} #{song_api_index} -> {job.relative_path}")
+                return job
+            if len(self._active_by_key) >= self.max_pending:
+                raise JobQueueFull(f"下载队列已满 ({self.max_pending})")
+            job = DownloadJob(query, song_api_index)
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+        self._executor.submit(self._run, job)
+        logger.info(f"下载任务已提交: {job.id} ({query} #{song_api_index})")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit_import(self, playlist_id, user_id, entries, insert_songs, fmt=None):
+        """
+        提交歌单导入任务，entries 为 playlist_import.parse_import 的结果，
+        insert_songs 即 database.add_songs_to_playlist。
+        Raises: JobQueueFull 当排队和执行中的导入任务数达到 max_pending_imports。
+        """
+        with self._lock:
+            self._prune_locked()
+            active = sum(1 for job in self._import_jobs.values() if job.state in ACTIVE_STATES)
+            if active >= self.max_pending_imports:
+                raise JobQueueFull(f"导入队列已满 ({self.max_pending_imports})")
+            job = ImportJob(playlist_id, user_id, fmt, len(entries))
+            self._import_jobs[job.id] = job
+        self._import_executor.submit(self._run_import, job, entries, insert_songs)
+        logger.info(f"导入任务已提交: {job.id} (歌单 {playlist_id}, {len(entries)} 条)")
+        return job
+
+    def get_import(self, job_id):
+        with self._lock:
+            return self._import_jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return {'jobs': len(self._jobs), 'active': len(self._active_by_key), 'by_state': counts}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self._import_executor.shutdown(wait=wait)
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.job_ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.state in FINISHED_STATES and job.updated_at < cutoff]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._done_by_key.get(job.key) is job:
+                del self._done_by_key[job.key]
+        for job_id in [job_id for job_id, job in self._import_jobs.items()
+                       if job.state in FINISHED_STATES and job.updated_at < cutoff]:
+            del self._import_jobs[job_id]
+
+    def _finish(self, job, **fields):
+        job.update(**fields)
+        with self._lock:
+            if self._active_by_key.get(job.key) is job:
+                del self._active_by_key[job.key]
+            if job.state == JOB_DONE:
+                self._done_by_key[job.key] = job
+
+    def _run(self, job):
+        try:
+            song_details = music_api_handler.get_song_details(job.query, job.song_api_index)
+            if not song_details:
+                self._finish(job, state=JOB_FAILED, message='无法获取歌曲详情以下载。')
+                return
+            title, singer = song_details.get('title'), song_details.get('singer')
+            job.update(title=title, singer=singer)
+
+            if self.library is not None:
+                library_hit = self.library.lookup_title(title, singer)
+                if library_hit is not None:
+                    self.library.link_song(job.query, job.song_api_index, title, singer, library_hit['content_hash'])
+                    self._finish(job, state=JOB_DONE, relative_path=library_hit['relative_path'],
+                                 bytes_done=library_hit['size'], bytes_total=library_hit['size'], message='曲库中已存在')
+                    return
+
+            job.update(state=JOB_DOWNLOADING)
+
+            def on_progress(stage, bytes_done, bytes_total):
+                job.update(state=stage, bytes_done=bytes_done, bytes_total=bytes_total)
+
+            relative_path, success, message, content_info = music_api_handler.download_song_assets_for_web(
+                song_details,
+                self.app_static_folder,
+                progress_callback=on_progress,
+                return_content_info=True
+            )
+            if success and relative_path:
+                if self.library is not None:
+                    # 下载时已顺带计算了哈希，曲库登记无需再读取一遍文件
+                    relative_path = self.library.record_download(job.query, job.song_api_index, title, singer,
+                                                                 relative_path, content_info=content_info)
+                self._finish(job, state=JOB_DONE, relative_path=relative_path, message=message)
+                logger.info(f"下载任务完成: {job.id} -> {relative_path}")
+            else:
+                self._finish(job, state=JOB_FAILED, message=message or '下载失败')
+                logger.warning(f"下载任务失败: {job.id}: {message}")
+        except Exception as e:
+            logger.error(f"下载任务 {job.id} 发生未知错误: {e}")
+            self._finish(job, state=JOB_FAILED, message=f"下载时发生未知错误: {e}")
+
+    def _run_import(self, job, entries, insert_songs):
+        job.update(state=JOB_RESOLVING)
+        try:
+            summary, rows = playlist_import.import_into_playlist(
+                job.playlist_id, entries, insert_songs,
+                progress_callback=lambda rows_done, rows_total: job.update(rows_done=rows_done)
+            )
+            job.update(state=JOB_DONE, summary=summary, rows=rows, rows_done=len(entries))
+        except Exception as e:
+            logger.error(f"导入任务 {job.id} 发生未知错误: {e}")
+            job.update(state=JOB_FAILED, message=f"导入时发生未知错误: {e}")
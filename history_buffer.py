@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# 播放历史的后台批量写入（write-behind）：播放页只把记录放入进程内缓冲区，
+# 缓冲区达到 HISTORY_FLUSH_SIZE 条、或距上次写入超过 HISTORY_FLUSH_INTERVAL 秒时，
+# 由后台线程在一个事务中批量写入数据库；进程退出时调用 close() 写入剩余记录。
+
+HISTORY_FLUSH_SIZE = 100          # 缓冲区达到这个条数时立即写入
+HISTORY_FLUSH_INTERVAL = 5.0      # 最长写入间隔（秒）；写入失败后也按这个间隔重试
+HISTORY_MAX_BUFFER = 10000        # 缓冲区上限（数据库长时间不可用时丢弃最早的记录）
+HISTORY_DEDUPE_SECONDS = 30       # 同一用户在这段时间内重复播放同一首歌（例如刷新页面）只记录一次
+
+logger = logging.getLogger(__name__)
+
+class HistoryWriter:
+    """
+    线程安全的播放记录写入缓冲。
+    Args:
+        write_entries: write_entries([(user_id, song, played_at), ...]) -> 写入行数 or None if error，
+                       即 database.add_play_history_entries。
+    """
+
+    def __init__(self, write_entries, flush_size=HISTORY_FLUSH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 max_buffer=HISTORY_MAX_BUFFER, dedupe_seconds=HISTORY_DEDUPE_SECONDS, name='play_history'):
+        self._write_entries = write_entries
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dedupe_seconds = dedupe_seconds
+        self.name = name
+        self._buffer = deque() # (user_id, song, played_at)，按播放顺序
+        self._inflight = []    # 正在写入的一批，写入完成前仍对 pending() 可见
+        self._last_played = {} # user_id -> (歌曲键, monotonic 时间)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock() # 同一时刻只有一次写入
+        self._closed = False
+        self._failing = False
+        self.recorded = 0
+        self.deduped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=f"{name}-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, user_id, song, played_at=None):
+        """
+        记录一次播放，不访问数据库。
+        Args:
+            song: {'song_api_index', 'song_query', 'title', 'singer', 'cover'}
+        Returns: 是否加入缓冲区（重复播放或已关闭时为 False）。
+        """
+        key = (song['song_query'], str(song['song_api_index']))
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                return False
+            last = self._last_played.get(user_id)
+            if last and last[0] == key and now - last[1] < self.dedupe_seconds:
+                self.deduped += 1
+                return False
+            self._last_played[user_id] = (key, now)
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+                logger.warning(f"{self.name}: 缓冲区已满 ({self.max_buffer})，丢弃最早的一条播放记录")
+            self._buffer.append((user_id, song, played_at or datetime.now().replace(microsecond=0)))
+            self.recorded += 1
+            if len(self._buffer) >= self.flush_size and not self._failing:
+                self._cond.notify()
+        return True
+
+    def pending(self, user_id):
+        """
+        尚未写入数据库的记录（最新的在前），供播放历史页与数据库中的记录合并显示。
+        包含正在写入的一批，其中的记录可能已经提交，调用方需按 (歌曲, 播放时间) 与数据库结果去重。
+        Returns: [(song, played_at), ...]
+        """
+        with self._cond:
+            entries = self._inflight + list(self._buffer)
+        return [(song, played_at) for uid, song, played_at in reversed(entries) if uid == user_id]
+
+    def discard(self, user_id):
+        """
+        丢弃用户尚未写入的记录（清空播放历史时调用；会等待正在进行的写入完成）。
+        """
+        with self._flush_lock, self._cond:
+            kept = [entry for entry in self._buffer if entry[0] != user_id]
+            removed = len(self._buffer) - len(kept)
+            self._buffer = deque(kept)
+            self._last_played.pop(user_id, None)
+        return removed
+
+    def flush(self):
+        """
+        立即写入缓冲区中的全部记录。写入失败时放回缓冲区等待重试。Returns: 写入的行数。
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._inflight = batch
+                self._prune_last_played()
+            if not batch:
+                return 0
+            try:
+                written = self._write_entries(batch)
+            except Exception as e:
+                logger.error(f"{self.name}: 写入播放记录时发生错误: {e}")
+                written = None
+            with self._cond:
+                self._inflight = []
+                self._failing = written is None
+                if written is None:
+                    self.failures += 1
+                    self._buffer.extendleft(reversed(batch))
+                    while len(self._buffer) > self.max_buffer:
+                        self._buffer.popleft()
+                        self.dropped += 1
+                    return 0
+                self.flushes += 1
+                self.flushed += written
+            return written
+
+    def _prune_last_played(self):
+        now = time.monotonic()
+        for user_id, (_, played) in list(self._last_played.items()):
+            if now - played >= self.dedupe_seconds:
+                del self._last_played[user_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and (len(self._buffer) < self.flush_size or self._failing):
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self, timeout=10):
+        """
+        停止后台线程并写入剩余记录（应用退出时调用）。
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        written = self.flush()
+        if self._buffer:
+            logger.warning(f"{self.name}: 退出时仍有 {len(self._buffer)} 条播放记录未能写入")
+        elif written:
+            logger.info(f"{self.name}: 退出前写入 {written} 条播放记录")
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+        return {
+            'name': self.name,
+            'buffered': buffered,
+            'recorded': self.recorded,
+            'deduped': self.deduped,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import music_api_handler
+
+# 本地曲库索引：记录 (关键词, API 序号) 与 (标题, 歌手) 到已下载文件的映射，
+# 以及文件的内容哈希、大小、格式和标签状态。下载前先查索引，命中时无需访问上游；
+# 内容完全相同的文件只保留一份。
+
+LIBRARY_INDEX_FILENAME = 'library_index.db'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+def _normalize_text(value):
+    return music_api_handler._normalize_query(value or '')
+
+def hash_file(file_path):
+    """
+    计算文件的 SHA-256，并顺便检查是否带有 ID3v2 标签头。
+    Returns: (hex_digest, size, has_id3)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    has_id3 = False
+    with open(file_path, 'rb') as f:
+        first = True
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            if first:
+                has_id3 = chunk[:3] == b'ID3'
+                first = False
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size, has_id3
+
+class LibraryIndex:
+    """
+    基于 SQLite 的持久化曲库索引（线程安全）。
+    """
+
+    def __init__(self, db_path, app_static_folder):
+        self.db_path = db_path
+        self.app_static_folder = app_static_folder
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+        self.hits = 0
+        self.misses = 0
+
+    def _init_schema(self):
+        with self._lock, self._conn:
+            self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                content_hash TEXT PRIMARY KEY,
+                relative_path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                tagged INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query_key TEXT NOT NULL,
+                song_api_index TEXT NOT NULL,
+                title TEXT,
+                singer TEXT,
+                title_key TEXT NOT NULL,
+                singer_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL REFERENCES files(content_hash),
+                updated_at REAL NOT NULL,
+                UNIQUE (query_key, song_api_index)
+            );
+            CREATE INDEX IF NOT EXISTS idx_tracks_title_singer ON tracks (title_key, singer_key);
+            """)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _absolute_path(self, relative_path):
+        return os.path.join(self.app_static_folder, relative_path)
+
+    def _file_row_or_prune(self, row):
+        """
+        校验索引记录对应的文件仍然存在；文件已被清理时删除该记录。
+        """
+        if row is None:
+            return None
+        if os.path.exists(self._absolute_path(row['relative_path'])):
+            return dict(row)
+        logger.info(f"曲库文件已不存在，移除索引: {row['relative_path']}")
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tracks WHERE content_hash = ?", (row['content_hash'],))
+            self._conn.execute("DELETE FROM files WHERE content_hash = ?", (row['content_hash'],))
+        return None
+
+    def _count(self, row):
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def lookup_song(self, query, song_api_index):
+        """
+        按 (关键词, API 序号) 查找已下载的文件。
+        Returns: dict(relative_path, content_hash, size, format, tagged, title, singer) or None.
+        """
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT f.*, t.title, t.singer FROM tracks t
+                JOIN files f ON f.content_hash = t.content_hash
+                WHERE t.query_key = ? AND t.song_api_index = ?
+            """, (_normalize_text(query), str(song_api_index))).fetchone()
+        return self._count(self._file_row_or_prune(row))
+
+    def lookup_title(self, title, singer):
+        """
+        按 (标题, 歌手) 查找已下载的文件。
+        Returns: dict or None.
+        """
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT f.*, t.title, t.singer FROM tracks t
+                JOIN files f ON f.content_hash = t.content_hash
+                WHERE t.title_key = ? AND t.singer_key = ?
+                ORDER BY t.updated_at DESC LIMIT 1
+            """, (_normalize_text(title), _normalize_text(singer))).fetchone()
+        return self._count(self._file_row_or_prune(row))
+
+    def link_song(self, query, song_api_index, title, singer, content_hash):
+        """
+        将 (关键词, API 序号) 指向已索引的文件。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO tracks (query_key, song_api_index, title, singer, title_key, singer_key, content_hash, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (query_key, song_api_index) DO UPDATE SET
+                    title = excluded.title, singer = excluded.singer,
+                    title_key = excluded.title_key, singer_key = excluded.singer_key,
+                    content_hash = excluded.content_hash, updated_at = excluded.updated_at
+            """, (_normalize_text(query), str(song_api_index), title, singer,
+                  _normalize_text(title), _normalize_text(singer), content_hash, time.time()))
+
+    def record_download(self, query, song_api_index, title, singer, relative_path, content_info=None):
+        """
+        登记一个新下载的文件。若已有内容完全相同的文件，删除新文件并复用已有文件。
+        Args:
+            content_info: 可选的 (content_hash, size, tagged)，调用方已在写入时计算过哈希时传入。
+        Returns: 规范的相对路径（去重后可能与传入的不同）。
+        """
+        absolute_path = self._absolute_path(relative_path)
+        if content_info is None:
+            content_info = hash_file(absolute_path)
+        content_hash, size, tagged = content_info
+        file_format = os.path.splitext(relative_path)[1].lstrip('.').lower()
+
+        with self._lock:
+            existing = self._conn.execute(
+                "SELECT relative_path FROM files WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        canonical_path = relative_path
+        if existing and existing['relative_path'] != relative_path:
+            if os.path.exists(self._absolute_path(existing['relative_path'])):
+                logger.info(f"内容相同的文件已存在，复用 {existing['relative_path']}，删除重复文件 {relative_path}")
+                try:
+                    os.remove(absolute_path)
+                except OSError as e:
+                    logger.warning(f"删除重复文件失败 ({absolute_path}): {e}")
+                canonical_path = existing['relative_path']
+            else:
+                # 原文件已被清理：丢弃旧的文件记录，下面以新路径重新登记（tracks 仍按哈希关联）
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM files WHERE content_hash = ?", (content_hash,))
+
+        with self._lock, self._conn:
+            # 同一路径被新内容覆盖时（例如重新下载），旧记录指向新内容
+            self._conn.execute("""
+                UPDATE tracks SET content_hash = ? WHERE content_hash IN (
+                    SELECT content_hash FROM files WHERE relative_path = ? AND content_hash != ?)
+            """, (content_hash, canonical_path, content_hash))
+            self._conn.execute("DELETE FROM files WHERE relative_path = ? AND content_hash != ?",
+                               (canonical_path, content_hash))
+            self._conn.execute("""
+                INSERT OR IGNORE INTO files (content_hash, relative_path, size, format, tagged, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (content_hash, canonical_path, size, file_format, int(bool(tagged)), time.time()))
+        self.link_song(query, song_api_index, title, singer, content_hash)
+        return canonical_path
+
+    def stats(self):
+        with self._lock:
+            files, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+            tracks = self._conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+        return {'files': files, 'tracks': tracks, 'total_size': total_size, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,102 @@
+import re
+from array import array
+from bisect import bisect_right
+
+# LRC 歌词索引：每首歌只解析一次，时间戳和文本分别存放在按时间排序的数组中，
+# 播放页、歌词接口和 ID3 SYLT 帧都使用同一个 LyricIndex。
+
+# 行首的时间标签，一行可以有多个: [00:12.00][01:30.00]歌词
+TIME_TAG_REGEX = re.compile(r'\[(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?\]')
+# 其它标签: [ar:歌手] [ti:标题] [offset:+500] 等
+META_TAG_REGEX = re.compile(r'\[([a-zA-Z#]+):([^\]]*)\]')
+
+def _tag_to_ms(minutes, seconds, fraction):
+    ms = 0
+    if fraction:
+        # 1/2/3 位小数分别表示 1/10、1/100、1/1000 秒
+        ms = int(fraction) * (10 ** (3 - len(fraction)))
+    return (int(minutes) * 60 + int(seconds)) * 1000 + ms
+
+class LyricIndex:
+    """
+    不可变的歌词索引。times（毫秒，升序）与 texts 一一对应；
+    offset_ms 已应用到 times 上（LRC 中正的 offset 表示歌词提前显示）。
+    """
+
+    __slots__ = ('times', 'texts', 'offset_ms', 'plain_text')
+
+    def __init__(self, times=(), texts=(), offset_ms=0, plain_text=''):
+        self.times = array('q', times)
+        self.texts = tuple(texts)
+        self.offset_ms = offset_ms
+        self.plain_text = plain_text
+
+    @classmethod
+    def parse(cls, lrc_text):
+        """
+        解析 LRC 文本。没有时间标签的行被忽略（原文保存在 plain_text 中）。
+        """
+        if not lrc_text or not isinstance(lrc_text, str):
+            return cls()
+        offset_ms = 0
+        entries = [] # (timestamp_ms, 行序号, text)
+        for line_no, raw_line in enumerate(lrc_text.splitlines()):
+            line = raw_line.strip()
+            stamps = []
+            pos = 0
+            while line.startswith('[', pos):
+                match = TIME_TAG_REGEX.match(line, pos)
+                if match:
+                    stamps.append(_tag_to_ms(*match.groups()))
+                    pos = match.end()
+                    continue
+                meta = META_TAG_REGEX.match(line, pos)
+                if meta and meta.group(1).lower() == 'offset':
+                    try:
+                        offset_ms = int(meta.group(2).strip())
+                    except ValueError:
+                        pass
+                break
+            if stamps:
+                text = line[pos:].strip()
+                entries.extend((stamp, line_no, text) for stamp in stamps)
+        entries.sort()
+        return cls(
+            times=(max(0, stamp - offset_ms) for stamp, _, _ in entries),
+            texts=(text for _, _, text in entries),
+            offset_ms=offset_ms,
+            plain_text=lrc_text.strip(),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def line_at(self, ms):
+        """
+        返回播放到 ms 毫秒时应高亮的行号；第一行之前返回 -1。O(log n)。
+        """
+        return bisect_right(self.times, ms) - 1
+
+    def text_at(self, ms):
+        index = self.line_at(ms)
+        return self.texts[index] if index >= 0 else None
+
+    def lines(self):
+        """
+        Returns: [{'time_ms': ..., 'text': ...}, ...]，按时间排序。
+        """
+        return [{'time_ms': t, 'text': text} for t, text in zip(self.times, self.texts)]
+
+    def to_sylt(self):
+        """
+        Returns: ID3 SYLT 帧使用的 [(text, time_ms), ...]。
+        """
+        return list(zip(self.texts, self.times))
+
+    def to_dict(self):
+        return {
+            'times': self.times.tolist(),
+            'texts': list(self.texts),
+            'offset_ms': self.offset_ms,
+            'plain': self.plain_text if not self.times else None,
+        }
@@ -1,13 +1,21 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import hashlib
 import os
 import re
-from urllib.parse import urlparse
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TPE1, TIT2, TALB, USLT, SYLT, ID3NoHeaderError
-import mimetypes
+import threading
+import time
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qsl
+from mutagen.id3 import ID3, APIC, TPE1, TIT2, TALB, USLT, SYLT
 import logging
 import shutil # For file operations
+import io
+from cache_utils import TTLCache, SingleFlight, SingleFlightTimeout, MISSING
+from lyrics import LyricIndex
 
 # API 请求地址
 API_URL = "https://www.hhlqilongzhu.cn/api/joox/juhe_music.php"
@@ -17,9 +25,83 @@ API_URL = "https://www.hhlqilongzhu.cn/api/joox/juhe_music.php"
 # 但在这个模块中，我们暂时定义一个相对路径，由调用方 (app.py) 处理成绝对路径
 DOWNLOAD_DIR_NAME = "downloads" # 将在此目录下按 歌手/专辑/歌曲名 存放
 TEMP_DIR_NAME = "temp" # 临时文件存放
+# 可以从 URL 中识别的音频扩展名（也是查找已下载文件时尝试的扩展名）
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.aac', '.flac', '.wav', '.ogg')
 
-# Regex to parse [mm:ss.xx] or [mm:ss] timestamps
-TIMESTAMP_REGEX = re.compile(r'\[(\d{2}):(\d{2})\.?(\d{2,3})?\]') # Allow 2 or 3 digits for ms
+# --- 上游 HTTP 连接池配置 ---
+# 所有上游请求（搜索、详情、封面、音频）共享同一个 requests.Session，
+# 以便复用 keep-alive 连接，避免每次请求都重新进行 TCP+TLS 握手。
+HTTP_POOL_CONNECTIONS = 10   # 缓存的主机连接池数量（每个 host 一个池）
+HTTP_POOL_MAXSIZE = 32       # 每个主机连接池中保留的最大连接数
+HTTP_POOL_BLOCK = False      # 连接池耗尽时是否阻塞等待（False 则临时新建连接）
+HTTP_RETRY_TOTAL = 3         # 失败重试次数（连接错误、读错误、以下状态码）
+HTTP_RETRY_BACKOFF_FACTOR = 0.5  # 重试退避因子: 0.5s, 1s, 2s ...
+HTTP_RETRY_STATUS_FORCELIST = (429, 500, 502, 503, 504)
+API_TIMEOUT = 15             # API 请求超时（秒）
+COVER_TIMEOUT = 15           # 封面下载超时（秒）
+COVER_MAX_BYTES = 10 * 1024 * 1024  # 封面响应体上限，超过视为下载失败
+AUDIO_TIMEOUT = 60           # 音频下载超时（秒）
+
+# Use a specific user-agent, some servers might block default requests user-agent
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Connection': 'keep-alive',
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# --- 搜索结果缓存配置 ---
+# 播放页每次切歌都会以相同关键词重新搜索以构建上一首/下一首导航，
+# 因此在 search_music 前加一层按规范化关键词索引的 TTL + LRU 缓存。
+SEARCH_CACHE_TTL_SECONDS = 600
+SEARCH_CACHE_MAX_ENTRIES = 512
+
+_search_cache = TTLCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl_seconds=SEARCH_CACHE_TTL_SECONDS, name='search')
+
+# --- 歌曲详情缓存配置 ---
+# 详情中的标题/歌手/封面/歌词基本不变，可以长时间缓存；
+# 播放链接 url 会被上游设置过期，单独记录其有效期。
+DETAILS_CACHE_TTL_SECONDS = 24 * 60 * 60  # 稳定字段的缓存时长
+DETAILS_CACHE_MAX_ENTRIES = 2048
+PLAY_URL_TTL_SECONDS = 300                # 无法从 url 中解析出过期时间时使用的有效期
+PLAY_URL_EXPIRY_MARGIN_SECONDS = 30       # 提前视为过期的安全余量
+# 播放链接中可能携带的绝对过期时间参数（Unix 时间戳，秒）
+PLAY_URL_EXPIRY_PARAMS = ('expires', 'expire', 'expiry', 'exp', 'e', 'deadline', 'x-oss-expires')
+
+_details_cache = TTLCache(max_entries=DETAILS_CACHE_MAX_ENTRIES, ttl_seconds=DETAILS_CACHE_TTL_SECONDS, name='song_details')
+
+# --- 并发请求合并 (single-flight) ---
+# 热门歌曲被分享时，大量并发请求会同时以相同参数访问 API_URL；
+# 同一时刻相同的 (搜索/详情) 请求只向上游发送一次，其余调用者等待其结果。
+SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS = 30
+
+_upstream_flight = SingleFlight(wait_timeout=SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS, name='upstream')
+
+# --- 下载流水线 ---
+# 音频传输期间并行执行封面下载和 ID3 帧准备的线程数
+ASSET_PREP_WORKERS = 8
+
+# 下载流程获取封面数据的函数: loader(cover_url) -> (cover_data, mime_type)，默认直接下载
+_cover_loader = None
+
+# 写入/复制音频时使用的缓冲区大小
+AUDIO_WRITE_BUFFER_SIZE = 256 * 1024
+# 等待 ID3 标签生成时最多在内存中缓存的音频字节数，超过后才阻塞等待标签
+AUDIO_TAG_WAIT_BUFFER_BYTES = 8 * 1024 * 1024
+
+_asset_executor = ThreadPoolExecutor(max_workers=ASSET_PREP_WORKERS, thread_name_prefix='asset-prep')
+
+# --- 断点续传 ---
+PARTIAL_PREFIX = 'partial_'
+PARTIAL_SUFFIX = '.part'
+PARTIAL_SIDECAR_SUFFIX = '.json'
+PARTIAL_SIDECAR_UPDATE_BYTES = 1024 * 1024   # 每写入这么多字节刷新一次描述文件
+PARTIAL_MAX_AGE_SECONDS = 24 * 60 * 60       # 超过此时间的断点文件不再续传
+PARTIAL_LOCK_WAIT_SECONDS = 10 * 60          # 断点文件正被其它线程写入时，下载任务最多等待这么久
+
+_partial_locks = {}
+_partial_locks_guard = threading.Lock()
 
 # 设置基本的日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -50,30 +132,79 @@ def _clean_api_title_source(title_str):
         return cleaned_title
     return title_str
 
-def parse_lrc_line(line):
+# --- Shared HTTP Client ---
+def _build_http_session():
     """
-    Parses a single LRC format lyric line to extract timestamp and text.
-    Returns a tuple (timestamp_in_ms, text) or None if parsing fails.
-    Timestamp is converted to milliseconds.
+    创建带连接池和重试策略的 requests.Session。
     """
-    match = TIMESTAMP_REGEX.match(line)
-    if match:
-        minutes = int(match.group(1))
-        seconds = int(match.group(2))
-        ms_str = match.group(3)
+    retry = Retry(
+        total=HTTP_RETRY_TOTAL,
+        connect=HTTP_RETRY_TOTAL,
+        read=HTTP_RETRY_TOTAL,
+        status=HTTP_RETRY_TOTAL,
+        backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUS_FORCELIST,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False, # 最终状态码交由 raise_for_status() 处理
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=HTTP_POOL_BLOCK,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-        milliseconds = 0
-        if ms_str:
-            if len(ms_str) == 2:
-                milliseconds = int(ms_str) * 10
-            elif len(ms_str) == 3:
-                milliseconds = int(ms_str)
-        
-        timestamp_ms = (minutes * 60 + seconds) * 1000 + milliseconds
-        text_start_index = line.rfind(']') + 1
-        text = line[text_start_index:].strip()
-        return (timestamp_ms, text)
-    return None
+def get_http_session():
+    """
+    返回模块共享的 HTTP 客户端（首次调用时创建，线程安全）。
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = _build_http_session()
+    return _http_session
+
+def configure_http_client(pool_connections=None, pool_maxsize=None, pool_block=None,
+                          retry_total=None, backoff_factor=None, status_forcelist=None):
+    """
+    调整共享 HTTP 客户端的连接池与重试配置。
+    未传入的参数保持当前值；旧的 Session 会被关闭，下次请求时按新配置重建。
+    """
+    global HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_POOL_BLOCK
+    global HTTP_RETRY_TOTAL, HTTP_RETRY_BACKOFF_FACTOR, HTTP_RETRY_STATUS_FORCELIST
+    global _http_session
+    with _http_session_lock:
+        if pool_connections is not None:
+            HTTP_POOL_CONNECTIONS = pool_connections
+        if pool_maxsize is not None:
+            HTTP_POOL_MAXSIZE = pool_maxsize
+        if pool_block is not None:
+            HTTP_POOL_BLOCK = pool_block
+        if retry_total is not None:
+            HTTP_RETRY_TOTAL = retry_total
+        if backoff_factor is not None:
+            HTTP_RETRY_BACKOFF_FACTOR = backoff_factor
+        if status_forcelist is not None:
+            HTTP_RETRY_STATUS_FORCELIST = tuple(status_forcelist)
+        old_session, _http_session = _http_session, None
+    if old_session is not None:
+        old_session.close()
+
+def close_http_client():
+    """
+    关闭共享 HTTP 客户端并释放连接池中的所有连接。
+    """
+    global _http_session
+    with _http_session_lock:
+        old_session, _http_session = _http_session, None
+    if old_session is not None:
+        old_session.close()
 
 # --- API Interaction Functions ---
 def request_api(params):
@@ -82,7 +213,7 @@ def request_api(params):
     Returns: response JSON or None if error.
     """
     try:
-        response = requests.get(API_URL, params=params, timeout=15)
+        response = get_http_session().get(API_URL, params=params, timeout=API_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.HTTPError as e:
@@ -99,14 +230,106 @@ def request_api(params):
         logging.error(f"处理API请求时发生未知错误: {e}")
         return None
 
+def _normalize_query(query):
+    """
+    规范化搜索关键词作为缓存键：去除首尾空白、合并连续空白、忽略大小写。
+    """
+    if not isinstance(query, str):
+        return query
+    return re.sub(r'\s+', ' ', query).strip().casefold()
+
+def _coalesced_upstream_call(key, fn, *args):
+    """
+    通过 single-flight 执行上游请求；等待其它调用者的结果超时时按请求失败处理。
+    """
+    try:
+        return _upstream_flight.do(key, fn, *args)
+    except SingleFlightTimeout as e:
+        logging.error(f"等待并发的相同上游请求超时: {e}")
+        return None
+
+def configure_single_flight(wait_timeout=None):
+    """
+    调整等待同键上游请求结果的超时时间（秒）。
+    """
+    if wait_timeout is not None:
+        _upstream_flight.wait_timeout = wait_timeout
+
+def get_single_flight_stats():
+    """
+    返回上游请求合并统计（实际执行次数 / 被合并次数）。
+    """
+    return _upstream_flight.stats()
+
+def configure_search_cache(ttl_seconds=None, max_entries=None):
+    """
+    调整搜索结果缓存的 TTL 和最大条目数。
+    """
+    _search_cache.configure(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+def invalidate_search_cache(query=None):
+    """
+    使指定关键词的搜索缓存失效；query 为空时清空整个搜索缓存。
+    Returns: 被移除的条目数。
+    """
+    if query is None:
+        return _search_cache.invalidate()
+    return _search_cache.invalidate(_normalize_query(query))
+
+def get_search_cache_stats():
+    """
+    返回搜索缓存的命中/未命中统计。
+    """
+    return _search_cache.stats()
+
 def search_music(query):
     """
-    根据关键词搜索歌曲列表。
+    根据关键词搜索歌曲列表（结果按规范化关键词缓存）。
     Returns: list of songs or None.
     """
-    params = {'msg': query, 'type': 'json'}
-    data = request_api(params)
+    cache_key = _normalize_query(query)
+    cached_songs = _get_cached_search(cache_key)
+    if cached_songs is not None:
+        logging.info(f"搜索缓存命中: {query}")
+        return cached_songs
+
+    # 缓存只由 single-flight 的执行者写入一次，等待者各自拿到共享结果的副本
+    songs = _coalesced_upstream_call(('search', cache_key), _fetch_and_store_search, cache_key, query)
+    return [dict(song) for song in songs] if songs else songs
+
+def _fetch_and_store_search(cache_key, query):
+    return _store_search_results(cache_key, _search_music_uncached(query))
+
+def _get_cached_search(cache_key):
+    cached_songs = _search_cache.get(cache_key)
+    if cached_songs is MISSING:
+        return None
+    return [dict(song) for song in cached_songs]
+
+def _store_search_results(cache_key, songs):
+    """
+    写入搜索缓存，并返回调用方可自由修改的副本。
+    """
+    if songs:
+        _search_cache.set(cache_key, [dict(song) for song in songs])
+        return [dict(song) for song in songs]
+    return songs
 
+def _search_music_uncached(query):
+    """
+    直接向上游 API 发起搜索请求。
+    Returns: list of songs or None.
+    """
+    return _parse_search_response(request_api(_search_params(query)))
+
+def _search_params(query):
+    return {'msg': query, 'type': 'json'}
+
+def _parse_search_response(data):
+    """
+    将上游搜索接口的 JSON 响应解析为歌曲列表（同步和异步客户端共用）。
+    Returns: list of songs or None.
+    """
     if isinstance(data, list) and data:
         songs = []
         for item in data:
@@ -126,14 +349,162 @@ def search_music(query):
         # Further error details logged by request_api
         return None
 
+def _parse_play_url_expiry(url):
+    """
+    尝试从播放链接的查询参数中解析过期时间。
+    支持 Expires=<unix 时间戳> 一类的绝对时间，以及 X-Amz-Date + X-Amz-Expires 形式的相对时间。
+    Returns: 过期时间（Unix 时间戳，秒）或 None。
+    """
+    if not isinstance(url, str) or '?' not in url:
+        return None
+    try:
+        params = {k.lower(): v for k, v in parse_qsl(urlparse(url).query)}
+    except ValueError:
+        return None
+
+    amz_date, amz_expires = params.get('x-amz-date'), params.get('x-amz-expires')
+    if amz_date and amz_expires and amz_expires.isdigit():
+        try:
+            signed_at = calendar.timegm(time.strptime(amz_date, '%Y%m%dT%H%M%SZ'))
+            return signed_at + int(amz_expires)
+        except ValueError:
+            pass
+
+    now = time.time()
+    for name in PLAY_URL_EXPIRY_PARAMS:
+        value = params.get(name)
+        if value and value.isdigit():
+            expires_at = int(value)
+            if expires_at > 10 ** 12: # 毫秒时间戳
+                expires_at /= 1000
+            # 只接受看起来像"近期绝对时间"的值，避免把其它数字参数误判为过期时间
+            if now - 86400 < expires_at < now + 30 * 86400:
+                return expires_at
+    return None
+
+def _play_url_expires_at(url):
+    """
+    计算播放链接的有效期截止时间（已扣除安全余量）。
+    """
+    expires_at = _parse_play_url_expiry(url)
+    if expires_at is None:
+        expires_at = time.time() + PLAY_URL_TTL_SECONDS
+    return expires_at - PLAY_URL_EXPIRY_MARGIN_SECONDS
+
+def _details_cache_key(query, song_number):
+    return (_normalize_query(query), str(song_number))
+
+def configure_song_details_cache(ttl_seconds=None, max_entries=None, url_ttl_seconds=None):
+    """
+    调整歌曲详情缓存：稳定字段的 TTL、最大条目数，以及播放链接的默认有效期。
+    """
+    global PLAY_URL_TTL_SECONDS
+    _details_cache.configure(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if url_ttl_seconds is not None:
+        PLAY_URL_TTL_SECONDS = url_ttl_seconds
+
+def invalidate_song_details_cache(query=None, song_number=None):
+    """
+    使指定歌曲的详情缓存失效；query 为空时清空整个详情缓存。
+    Returns: 被移除的条目数。
+    """
+    if query is None:
+        return _details_cache.invalidate()
+    return _details_cache.invalidate(_details_cache_key(query, song_number))
+
+def get_song_details_cache_stats():
+    """
+    返回歌曲详情缓存的命中/未命中统计。
+    """
+    return _details_cache.stats()
+
 def get_song_details(query, song_number):
     """
     根据关键词和歌曲序号获取歌曲详细信息。
+    稳定字段长期缓存；播放链接过期后只刷新 url，其余字段沿用缓存。
+    Returns: song details dict or None.
+    """
+    cache_key = _details_cache_key(query, song_number)
+    cached_details, entry = _get_cached_song_details(cache_key)
+    if cached_details is not None:
+        logging.info(f"歌曲详情缓存命中: {query} #{song_number}")
+        return cached_details
+
+    # 合并缓存、解析歌词只由 single-flight 的执行者做一次，等待者各自拿到共享结果的副本
+    details = _coalesced_upstream_call(('details',) + cache_key, _fetch_and_store_song_details,
+                                       cache_key, entry, query, song_number)
+    return dict(details) if details else details
+
+def _fetch_and_store_song_details(cache_key, entry, query, song_number):
+    return _store_song_details(cache_key, entry, _get_song_details_uncached(query, song_number))
+
+def _get_cached_song_details(cache_key):
+    """
+    Returns: (details, entry)。播放链接仍有效时 details 为可直接返回的副本；
+             否则 details 为 None，entry 为可能存在的过期条目（用于只刷新 url）。
+    """
+    entry = _details_cache.get(cache_key)
+    if entry is MISSING:
+        return None, None
+    if entry['url_expires_at'] > time.time():
+        return dict(entry['details'], url=entry['url']), entry
+    return None, entry
+
+def _store_song_details(cache_key, entry, fresh_details):
+    """
+    合并上游返回的新详情与已缓存的稳定字段并写入缓存。
     Returns: song details dict or None.
     """
-    params = {'msg': query, 'n': song_number, 'type': 'json'}
-    data = request_api(params)
+    if fresh_details is None:
+        return None
+
+    now = time.time()
+    if entry is not None and entry['stable_expires_at'] > now:
+        # 仅播放链接过期：保留缓存的稳定字段及其原有的过期时间，只替换 url
+        logging.info(f"播放链接已过期，刷新 url: {cache_key}")
+        stable_details = entry['details']
+        stable_expires_at = entry['stable_expires_at']
+    else:
+        stable_details = {k: v for k, v in fresh_details.items() if k != 'url'}
+        # 歌词只在这里解析一次，随详情一起缓存
+        stable_details['lyric_index'] = LyricIndex.parse(stable_details.get('lyric'))
+        stable_expires_at = now + _details_cache.ttl_seconds
+
+    play_url = fresh_details.get('url')
+    if play_url:
+        # 条目的 TTL 就是稳定字段剩余的有效期，刷新 url 不会延长它；过期后整个条目重新获取
+        _details_cache.set(cache_key, {
+            'details': stable_details,
+            'url': play_url,
+            'url_expires_at': _play_url_expires_at(play_url),
+            'stable_expires_at': stable_expires_at,
+        }, ttl_seconds=stable_expires_at - now)
+    return dict(stable_details, url=play_url)
+
+def get_lyric_index(song_details):
+    """
+    返回歌曲详情对应的 LyricIndex（来自缓存的详情已带有解析结果，否则现场解析）。
+    """
+    lyric_index = song_details.get('lyric_index')
+    if isinstance(lyric_index, LyricIndex):
+        return lyric_index
+    return LyricIndex.parse(song_details.get('lyric'))
 
+def _get_song_details_uncached(query, song_number):
+    """
+    直接向上游 API 请求歌曲详情。
+    Returns: song details dict or None.
+    """
+    return _parse_song_details_response(request_api(_song_details_params(query, song_number)))
+
+def _song_details_params(query, song_number):
+    return {'msg': query, 'n': song_number, 'type': 'json'}
+
+def _parse_song_details_response(data):
+    """
+    将上游详情接口的 JSON 响应解析为歌曲详情（同步和异步客户端共用）。
+    Returns: song details dict or None.
+    """
     if isinstance(data, dict) and 'data' in data:
         details_data = data['data']
         if isinstance(details_data, list) and details_data:
@@ -153,134 +524,406 @@ def get_song_details(query, song_number):
         return None
 
 # --- File Handling and Metadata Embedding ---
-def download_file_to_path(url, file_path, is_cover=False):
+def fetch_cover_bytes(cover_url):
     """
-    下载文件到指定路径。
-    Returns: True if download successful, False otherwise.
+    下载封面图片到内存（不落盘）。Content-Type 不是 image/* 或响应体超过 COVER_MAX_BYTES 时视为失败。
+    Returns: (cover_data, mime_type) or (None, None) if download failed.
     """
     try:
-        # Use a specific user-agent, some servers might block default requests user-agent
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        timeout = 15 if is_cover else 60 # Shorter timeout for cover, longer for audio
-        response = requests.get(url, stream=True, timeout=timeout, headers=headers)
-        response.raise_for_status()
-        os.makedirs(os.path.dirname(file_path), exist_ok=True) # Ensure directory exists
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        logging.info(f"文件成功下载到: {file_path}")
-        return True
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"下载文件HTTP错误 ({file_path}): {e.response.status_code} - {e}")
-        return False
+        with get_http_session().get(cover_url, timeout=COVER_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            mime_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if not mime_type.startswith('image/'):
+                logging.warning(f"封面响应不是图片 ({mime_type or '无 Content-Type'}): {cover_url}")
+                return None, None
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > COVER_MAX_BYTES:
+                logging.warning(f"封面过大 ({content_length} bytes): {cover_url}")
+                return None, None
+            buf = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                buf += chunk
+                if len(buf) > COVER_MAX_BYTES:
+                    logging.warning(f"封面超过 {COVER_MAX_BYTES} bytes，已放弃: {cover_url}")
+                    return None, None
+            cover_data = bytes(buf)
+        logging.info(f"封面下载完成: {cover_url} ({len(cover_data)} bytes)")
+        return cover_data, mime_type
     except requests.exceptions.RequestException as e:
-        logging.error(f"下载文件失败 ({file_path}): {e}")
-        return False
-    except IOError as e:
-        logging.error(f"保存文件失败 ({file_path}): {e}")
-        return False
-    except Exception as e:
-        logging.error(f"下载或保存文件时发生未知错误 ({file_path}): {e}")
-        return False
+        logging.warning(f"封面文件下载失败 ({cover_url}): {e}")
+        return None, None
 
-def embed_metadata(audio_file_path, song_details, temp_cover_path=None):
+def configure_cover_source(loader=None):
     """
-    将元数据嵌入到MP3文件。
+    设置下载流程获取封面的方式（例如使用本地封面缓存）；loader 为空时恢复为直接下载。
     """
-    try:
+    global _cover_loader
+    _cover_loader = loader
+
+def load_cover_bytes(cover_url):
+    """
+    获取写入 APIC 的封面数据，优先使用 configure_cover_source 设置的来源。
+    Returns: (cover_data, mime_type) or (None, None).
+    """
+    if _cover_loader is not None:
         try:
-            audio = MP3(audio_file_path, ID3=ID3)
-        except ID3NoHeaderError:
-            audio = MP3(audio_file_path)
-            audio.add_tags()
-        
-        if audio.tags is None:
-            audio.tags = ID3()
-        elif not isinstance(audio.tags, ID3):
-            audio.tags = ID3()
-
-        title_for_id3 = _clean_api_title_source(song_details.get('title', 'Unknown Title'))
-        singer_for_id3 = song_details.get('singer', 'Unknown Artist')
-
-        audio.tags.delall('TIT2')
-        audio.tags.add(TIT2(encoding=3, text=title_for_id3))
-        logging.info(f"已嵌入标题: {title_for_id3}")
-
-        audio.tags.delall('TPE1')
-        audio.tags.add(TPE1(encoding=3, text=singer_for_id3))
-        logging.info(f"已嵌入艺术家: {singer_for_id3}")
-
-        lyric_text = song_details.get('lyric')
-        if lyric_text and isinstance(lyric_text, str):
-            logging.info("找到歌词数据，尝试嵌入 SYLT 帧...")
-            audio.tags.delall('SYLT')
-            sylt_frames_data = []
-            lines = lyric_text.strip().split('\n')
-            for line in lines:
-                parsed_line = parse_lrc_line(line)
-                if parsed_line:
-                    timestamp_ms, text = parsed_line
-                    sylt_frames_data.append((text, timestamp_ms))
-            
-            if sylt_frames_data:
-                try:
-                    audio.tags.add(SYLT(encoding=3, lang='und', format=2, type=1, desc='Lyrics', text=sylt_frames_data))
-                    logging.info(f"已添加 {len(sylt_frames_data)} 行同步歌词 (SYLT)。")
-                except Exception as e_sylt:
-                    logging.warning(f"嵌入 SYLT 失败: {e_sylt}. 尝试 USLT 作为备选。")
-                    audio.tags.delall('USLT') # Clean up before fallback
-                    audio.tags.add(USLT(encoding=3, lang='und', desc='Lyrics', text=lyric_text))
-                    logging.info("已将原始歌词作为非同步歌词 (USLT) 嵌入。")
-            else:
-                logging.info("未能从歌词数据中解析出有效的带时间戳的歌词行，尝试 USLT。")
-                audio.tags.delall('USLT')
-                audio.tags.add(USLT(encoding=3, lang='und', desc='Lyrics', text=lyric_text))
-                logging.info("已将原始歌词作为非同步歌词 (USLT) 嵌入。")
-        else:
-            logging.info("没有找到歌词数据或歌词为空，跳过歌词嵌入。")
+            return _cover_loader(cover_url)
+        except Exception as e:
+            logging.warning(f"从封面缓存获取封面失败，改为直接下载: {e}")
+    return fetch_cover_bytes(cover_url)
 
-        if temp_cover_path and os.path.exists(temp_cover_path):
-            logging.info("找到封面图片，尝试嵌入 APIC 帧...")
-            mime_type, _ = mimetypes.guess_type(temp_cover_path)
-            if mime_type is None:
-                 mime_type = 'image/jpeg' 
+def build_cover_frame(cover_data, mime_type='image/jpeg'):
+    """
+    构建封面 APIC 帧。
+    """
+    return APIC(encoding=0, mime=mime_type or 'image/jpeg', type=3, desc='Cover', data=cover_data)
+
+def build_id3_frames(song_details, cover_data=None, cover_mime=None):
+    """
+    根据歌曲信息构建 ID3 帧列表（TIT2/TPE1、SYLT 或 USLT 歌词，以及可选的 APIC 封面）。
+    不涉及文件 IO，可以在音频下载的同时提前准备。
+    """
+    frames = []
+    title_for_id3 = _clean_api_title_source(song_details.get('title', 'Unknown Title'))
+    singer_for_id3 = song_details.get('singer', 'Unknown Artist')
+    frames.append(TIT2(encoding=3, text=title_for_id3))
+    frames.append(TPE1(encoding=3, text=singer_for_id3))
+
+    lyric_text = song_details.get('lyric')
+    if lyric_text and isinstance(lyric_text, str):
+        sylt_frames_data = get_lyric_index(song_details).to_sylt()
+
+        if sylt_frames_data:
             try:
-                with open(temp_cover_path, 'rb') as f:
-                    cover_data = f.read()
-                audio.tags.delall('APIC') 
-                audio.tags.add(APIC(encoding=0, mime=mime_type, type=3, desc='Cover', data=cover_data))
-                logging.info(f"已添加封面图片 (APIC) 类型: {mime_type}。")
-            except Exception as e_apic:
-                logging.error(f"嵌入封面图片失败: {e_apic}")
+                frames.append(SYLT(encoding=3, lang='und', format=2, type=1, desc='Lyrics', text=sylt_frames_data))
+            except Exception as e_sylt:
+                logging.warning(f"构建 SYLT 失败: {e_sylt}. 尝试 USLT 作为备选。")
+                frames.append(USLT(encoding=3, lang='und', desc='Lyrics', text=lyric_text))
         else:
-            logging.info("没有找到封面图片或下载失败，跳过封面嵌入。")
+            logging.info("未能从歌词数据中解析出有效的带时间戳的歌词行，尝试 USLT。")
+            frames.append(USLT(encoding=3, lang='und', desc='Lyrics', text=lyric_text))
+    else:
+        logging.info("没有找到歌词数据或歌词为空，跳过歌词嵌入。")
 
-        audio.save(v1=0, v2_version=3)
-        logging.info(f"元数据嵌入完成。文件: {audio_file_path}")
-        return True
+    if cover_data:
+        frames.append(build_cover_frame(cover_data, cover_mime))
+    return frames
 
+def render_id3_tag(song_details, cover_data=None, cover_mime=None, frames=None):
+    """
+    在内存中生成完整的 ID3v2.3 标签（含默认填充）。
+    标签写在音频数据之前即可，不需要再用 mutagen 改写整个文件。
+    Returns: bytes，出错时返回 b''。
+    """
+    try:
+        if frames is None:
+            frames = build_id3_frames(song_details, cover_data, cover_mime)
+        elif cover_data and not any(frame.FrameID == 'APIC' for frame in frames):
+            frames = list(frames) + [build_cover_frame(cover_data, cover_mime)]
+        tags = ID3()
+        for frame in frames:
+            tags.add(frame)
+        buf = io.BytesIO()
+        tags.save(buf, v1=0, v2_version=3)
+        logging.info(f"已生成 ID3 标签 ({buf.tell()} 字节): {', '.join(frame.FrameID for frame in frames)}")
+        return buf.getvalue()
     except Exception as e:
-        logging.error(f"嵌入元数据时发生错误 ({audio_file_path}): {e}")
-        # import traceback # For detailed debugging in a dev environment
-        # traceback.print_exc()
-        return False
-    finally:
-        if temp_cover_path and os.path.exists(temp_cover_path):
-            try:
-                os.remove(temp_cover_path)
-                logging.info(f"已删除临时封面文件: {temp_cover_path}")
-            except OSError as e:
-                logging.error(f"删除临时封面文件失败: {e}")
+        logging.error(f"生成 ID3 标签失败: {e}")
+        return b''
+
+# --- Resumable Downloads ---
+def _partial_download_key(base_filename_safe):
+    return hashlib.sha1(base_filename_safe.encode('utf-8')).hexdigest()[:20]
+
+def _acquire_partial_lock(partial_key, timeout=None):
+    """
+    获取某个断点文件的独占锁；已被其它线程持有时返回 None（timeout 不为空时最多等待这么多秒）。
+    """
+    with _partial_locks_guard:
+        lock = _partial_locks.setdefault(partial_key, threading.Lock())
+    acquired = lock.acquire(timeout=timeout) if timeout else lock.acquire(blocking=False)
+    return lock if acquired else None
+
+def _read_partial_sidecar(sidecar_path):
+    try:
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _write_partial_sidecar(sidecar_path, sidecar):
+    tmp_path = sidecar_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sidecar, f, ensure_ascii=False)
+        os.replace(tmp_path, sidecar_path)
+    except OSError as e:
+        logging.warning(f"写入断点描述文件失败 ({sidecar_path}): {e}")
+
+def _remove_partial(part_path, sidecar_path):
+    for path in (part_path, sidecar_path):
+        if path and os.path.exists(path):
+            try: os.remove(path)
+            except OSError: pass
+
+def _keep_partial_for_resume(part_path, sidecar_path):
+    """
+    请求中断后保留断点文件，并把实际写入的字节数记录到描述文件中。
+    """
+    if not os.path.exists(part_path):
+        _remove_partial(None, sidecar_path)
+        return
+    sidecar = _read_partial_sidecar(sidecar_path)
+    if not sidecar:
+        _remove_partial(part_path, sidecar_path)
+        return
+    sidecar['bytes_written'] = os.path.getsize(part_path)
+    _write_partial_sidecar(sidecar_path, sidecar)
+    logging.info(f"已保留未完成的下载 ({sidecar['bytes_written']} 字节)，下次将尝试断点续传: {part_path}")
 
-def download_song_assets_for_web(song_details, app_static_folder):
+def _parse_content_range(value):
+    """
+    解析 "bytes start-end/total"。Returns: (start, total) ，total 未知时为 None；格式不对返回 (None, None)。
+    """
+    match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)', value or '')
+    if not match:
+        return None, None
+    total = match.group(2)
+    return int(match.group(1)), (int(total) if total != '*' else None)
+
+def _response_total_length(response, resume_from):
+    if response.status_code == 206:
+        return _parse_content_range(response.headers.get('Content-Range'))[1]
+    content_length = response.headers.get('Content-Length')
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+def _partial_paths(temp_processing_dir, partial_key):
+    part_path = os.path.join(temp_processing_dir, f"{PARTIAL_PREFIX}{partial_key}{PARTIAL_SUFFIX}")
+    return part_path, part_path + PARTIAL_SIDECAR_SUFFIX
+
+def partial_download_paths(song_details, app_static_folder):
+    """
+    返回某首歌断点文件的 (partial_key, part_path, sidecar_path)，
+    供下载流程以外的写入方（如播放代理）写入同一个断点文件。
+    """
+    title = song_details.get('title', '未知歌名')
+    singer = song_details.get('singer', '未知歌手')
+    partial_key = _partial_download_key(_sanitize_filename(f"{title} - {singer}"))
+    return (partial_key,) + _partial_paths(os.path.join(app_static_folder, TEMP_DIR_NAME), partial_key)
+
+def _new_partial_sidecar(audio_url, response, bytes_total, extension, bytes_written, header_length=0,
+                         skipped_length=0):
+    # total_length 为音频数据的总长度；header_length 为写在音频前面的 ID3 标签长度，
+    # skipped_length 为被丢弃的上游自带 ID3v2 标签长度（换成了我们生成的标签），
+    # bytes_written 为断点文件的实际大小（标签 + 已接收的音频 - 丢弃部分）
+    return {
+        'url': audio_url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'total_length': bytes_total,
+        'extension': extension,
+        'header_length': header_length,
+        'skipped_length': skipped_length,
+        'bytes_written': bytes_written,
+    }
+
+def _partial_file_offset(sidecar):
+    """断点文件位置 = 上游音频位置 + 此偏移（前置标签长度减去丢弃的上游标签长度）。"""
+    return (sidecar.get('header_length') or 0) - (sidecar.get('skipped_length') or 0)
+
+def _id3v2_length(header):
+    """
+    音频开头自带的 ID3v2 标签总长度（10 字节头 + syncsafe 大小，有 footer 时再加 10）；没有标签时返回 0。
+    """
+    if len(header) < 10 or bytes(header[:3]) != b'ID3':
+        return 0
+    size_bytes = header[6:10]
+    if any(b & 0x80 for b in size_bytes):
+        return 0
+    size = (size_bytes[0] << 21) | (size_bytes[1] << 14) | (size_bytes[2] << 7) | size_bytes[3]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _partial_audio_bytes(part_path, sidecar):
+    """
+    断点文件中已接收的上游音频字节数（不含前置标签，包含被丢弃的上游标签）；不可用时返回 0。
+    """
+    if not sidecar or not os.path.exists(part_path):
+        return 0
+    header_length = sidecar.get('header_length') or 0
+    size = os.path.getsize(part_path)
+    return size - _partial_file_offset(sidecar) if size > header_length else 0
+
+def _hash_file_into(digest, file_path):
+    buf = bytearray(AUDIO_WRITE_BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+
+def _write_tagged_copy(src_path, dest_path, tag_bytes, digest):
+    """
+    写入 tag_bytes 后把 src_path 的音频数据复制到 dest_path（复用同一个缓冲区），
+    src_path 开头自带的 ID3v2 标签不复制。
+    Returns: dest_path 的大小。
+    """
+    buf = bytearray(AUDIO_WRITE_BUFFER_SIZE)
+    view = memoryview(buf)
+    size = len(tag_bytes)
+    with open(src_path, 'rb', buffering=0) as src, open(dest_path, 'wb', buffering=0) as dest:
+        src.seek(_id3v2_length(src.read(10)))
+        dest.write(tag_bytes)
+        digest.update(tag_bytes)
+        while True:
+            n = src.readinto(buf)
+            if not n:
+                break
+            dest.write(view[:n])
+            digest.update(view[:n])
+            size += n
+    return size
+
+def _open_audio_stream(audio_url, part_path, sidecar_path):
+    """
+    打开音频下载流。存在可用的断点文件时发送 Range 请求续传；
+    服务器不支持或内容已变化时回退为从头下载。
+    Returns: (response, resume_from, sidecar)；resume_from 为已有的音频字节数（不含前置标签），
+             断点文件已完整时 response 为 None。
+    """
+    session = get_http_session()
+    sidecar = _read_partial_sidecar(sidecar_path)
+    resume_from = _partial_audio_bytes(part_path, sidecar)
+
+    if resume_from > 0 and sidecar.get('url') != audio_url:
+        # 播放链接已变化（例如重新解析后换了音源），断点文件的内容不一定对应当前链接
+        logging.info(f"断点文件对应的播放链接已变化，重新下载: {part_path}")
+        resume_from = 0
+
+    if resume_from > 0 and resume_from == sidecar.get('total_length'):
+        # 断点文件已完整（例如播放代理已经把整首歌写入），无需再访问上游
+        logging.info(f"断点文件已完整 ({resume_from} 字节)，跳过下载: {part_path}")
+        return None, resume_from, sidecar
+
+    if resume_from > 0:
+        headers = {'Range': f"bytes={resume_from}-"}
+        validator = sidecar.get('etag') or sidecar.get('last_modified')
+        if validator:
+            headers['If-Range'] = validator # 内容变化时服务器返回 200 完整内容
+        response = session.get(audio_url, stream=True, timeout=AUDIO_TIMEOUT, headers=headers)
+        if response.status_code == 206:
+            start, total = _parse_content_range(response.headers.get('Content-Range'))
+            same_length = total is not None and total == sidecar.get('total_length')
+            if start == resume_from and (validator or same_length):
+                logging.info(f"从 {resume_from} 字节处继续下载: {audio_url}")
+                return response, resume_from, sidecar
+            logging.info("断点信息与服务器返回的内容不一致，重新下载。")
+            response.close()
+        elif response.status_code == 200:
+            logging.info("服务器不支持断点续传或内容已变化，重新下载。")
+            return response, 0, {}
+        else:
+            # 416 等：断点文件无效
+            logging.info(f"断点续传请求返回 {response.status_code}，重新下载。")
+            response.close()
+
+    response = session.get(audio_url, stream=True, timeout=AUDIO_TIMEOUT)
+    response.raise_for_status()
+    return response, 0, {}
+
+def _url_audio_extension(audio_url):
+    """
+    URL 文件名带扩展名时返回由它决定的扩展名（不认识的按 .mp3 处理）；不带扩展名时返回 None。
+    """
+    path_basename = os.path.basename(urlparse(audio_url).path)
+    if '.' not in path_basename:
+        return None
+    ext_from_url = os.path.splitext(path_basename)[1].lower()
+    return ext_from_url if ext_from_url in AUDIO_EXTENSIONS else '.mp3'
+
+def _guess_audio_extension(audio_url, content_type):
+    """
+    根据 URL 和 Content-Type 推断音频扩展名，默认 .mp3。
+    """
+    audio_file_extension = _url_audio_extension(audio_url)
+    if audio_file_extension:
+        return audio_file_extension
+    audio_file_extension = '.mp3' # Default
+    content_type = content_type.lower()
+    if 'audio/mpeg' in content_type or 'mp3' in content_type:
+        audio_file_extension = '.mp3'
+    elif 'audio/aac' in content_type:
+        audio_file_extension = '.aac'
+    elif 'audio/mp4' in content_type or 'm4a' in content_type: 
+        audio_file_extension = '.m4a'
+    elif 'audio/flac' in content_type or 'x-flac' in content_type:
+        audio_file_extension = '.flac'
+    elif 'audio/wav' in content_type or 'x-wav' in content_type:
+        audio_file_extension = '.wav'
+    return audio_file_extension
+
+def _find_existing_download(audio_url, download_target_dir, base_filename_safe):
+    """
+    不访问网络，查找 downloads 中已有的同名音频文件。
+    URL 能确定扩展名时只检查该扩展名，否则依次尝试 AUDIO_EXTENSIONS。
+    Returns: 文件名（含扩展名）或 None。
+    """
+    url_extension = _url_audio_extension(audio_url)
+    for extension in ((url_extension,) if url_extension else AUDIO_EXTENSIONS):
+        filename = f"{base_filename_safe}{extension}"
+        if os.path.isfile(os.path.join(download_target_dir, filename)):
+            return filename
+    return None
+
+def recover_partial_downloads(app_static_folder, max_age_seconds=PARTIAL_MAX_AGE_SECONDS):
+    """
+    进程启动时整理 temp 目录中遗留的断点文件：
+    保留有描述文件且未过期的 .part（之后下载同一首歌时续传），删除其余孤立文件。
+    Returns: (kept, removed)
+    """
+    temp_dir = os.path.join(app_static_folder, TEMP_DIR_NAME)
+    if not os.path.isdir(temp_dir):
+        return 0, 0
+    kept = removed = 0
+    now = time.time()
+    for filename in os.listdir(temp_dir):
+        if not filename.startswith(PARTIAL_PREFIX):
+            continue
+        path = os.path.join(temp_dir, filename)
+        try:
+            if filename.endswith(PARTIAL_SUFFIX):
+                sidecar = _read_partial_sidecar(path + PARTIAL_SIDECAR_SUFFIX)
+                if sidecar and now - os.path.getmtime(path) < max_age_seconds:
+                    sidecar['bytes_written'] = os.path.getsize(path)
+                    _write_partial_sidecar(path + PARTIAL_SIDECAR_SUFFIX, sidecar)
+                    kept += 1
+                    continue
+                _remove_partial(path, path + PARTIAL_SIDECAR_SUFFIX)
+                removed += 1
+            elif filename.endswith(PARTIAL_SIDECAR_SUFFIX) or filename.endswith('.tmp'):
+                part_path = path[:-len(PARTIAL_SIDECAR_SUFFIX)] if filename.endswith(PARTIAL_SIDECAR_SUFFIX) else None
+                if part_path is None or not os.path.exists(part_path):
+                    os.remove(path)
+                    removed += 1
+        except OSError as e:
+            logging.warning(f"整理断点文件失败 ({path}): {e}")
+    logging.info(f"断点文件整理完成: 保留 {kept} 个, 清理 {removed} 个。")
+    return kept, removed
+
+def download_song_assets_for_web(song_details, app_static_folder, progress_callback=None, return_content_info=False):
     """
     下载歌曲音频文件、封面，并将元数据嵌入音频文件。
     专为 Flask Web 应用设计，文件保存在 app_static_folder 下。
     Args:
         song_details (dict): 包含歌曲信息的字典。
         app_static_folder (str): Flask App 的 static 文件夹绝对路径。
+        progress_callback (callable, optional): progress_callback(stage, bytes_done, bytes_total)，
+               stage 为 'downloading' 或 'tagging'；bytes_total 未知时为 None。
+        return_content_info (bool): 为 True 时额外返回写入时计算的 (sha256, size, tagged)，
+               文件已存在时为 None。
     Returns:
         tuple: (relative_audio_path, success, error_message)
                relative_audio_path 是相对于 static 文件夹的路径，例如 'downloads/song.mp3'
@@ -292,9 +935,14 @@ def download_song_assets_for_web(song_details, app_static_folder):
     singer = song_details.get('singer', '未知歌手')
     cover_url = song_details.get('cover')
 
+    def result(relative_path, success, message, content_info=None):
+        if return_content_info:
+            return relative_path, success, message, content_info
+        return relative_path, success, message
+
     if not audio_url:
         logging.error("歌曲播放链接不存在，无法下载音频。")
-        return None, False, "歌曲播放链接不存在"
+        return result(None, False, "歌曲播放链接不存在")
 
     # 构建在 static 文件夹下的下载和临时目录的绝对路径
     # 例如: /path/to/your/app/static/downloads
@@ -308,48 +956,69 @@ def download_song_assets_for_web(song_details, app_static_folder):
     base_filename_unsafe = f"{title} - {singer}"
     base_filename_safe = _sanitize_filename(base_filename_unsafe)
 
-    # 临时音频文件使用随机名称，存放在 app_static_folder/temp/
-    temp_audio_filename_random = f"temp_audio_{os.urandom(8).hex()}" # 无扩展名
-    # 完整临时音频文件路径，先不带扩展名
-    temp_audio_file_path_no_ext = os.path.join(temp_processing_dir, temp_audio_filename_random)
-    
-    # 最终和临时音频文件的完整路径（带扩展名），稍后确定
-    temp_audio_file_path_with_ext = None
+    # 已下载过的歌曲在访问上游和提交封面/标签任务之前直接返回；
+    # 只有本地找不到时才需要根据响应的 Content-Type 确定扩展名
+    existing_filename = _find_existing_download(audio_url, download_target_dir, base_filename_safe)
+    if existing_filename:
+        logging.info(f"最终音频文件 '{existing_filename}' 已存在于 {download_target_dir}，跳过下载。")
+        relative_existing_path = os.path.join(DOWNLOAD_DIR_NAME, existing_filename).replace('\\', '/')
+        return result(relative_existing_path, True, f"文件已存在: {existing_filename}")
+
+    # 未完成的音频保存为 temp/partial_<key>.part，并在旁边写一个 .json 描述文件，
+    # key 由 "标题 - 歌手" 决定，因此同一首歌下次下载（包括进程重启后）可以从断点续传。
+    partial_key = _partial_download_key(base_filename_safe)
+    part_path, sidecar_path = _partial_paths(temp_processing_dir, partial_key)
+    partial_lock = _acquire_partial_lock(partial_key)
+    if partial_lock is None:
+        # 同一首歌正由播放代理或另一个下载任务写入：等它结束后接着使用同一个断点文件
+        # （已完整时不再访问上游，中断时从断点续传）
+        logging.info(f"断点文件正被写入，等待其完成: {part_path}")
+        partial_lock = _acquire_partial_lock(partial_key, timeout=PARTIAL_LOCK_WAIT_SECONDS)
+        if partial_lock is None:
+            return result(None, False, "同一首歌正在下载中，请稍后再试")
+
+    # MP3 的 ID3 标签在写入第一个音频字节之前生成并写在断点文件开头，音频数据紧随其后，
+    # 传输完成后断点文件直接重命名为最终文件，整个过程只写一遍音频数据。
     final_audio_filename_with_ext = None
     final_audio_full_path = None
     relative_final_audio_path = None # 相对于 static 的路径，用于网页引用
 
     logging.info(f"准备下载: {title} - {singer}")
 
+    response = None
+    cover_future = None
+    frames_future = None
+    tagged_copy_path = None
+
+    def wait_for_tag():
+        cover_data, cover_mime = (None, None)
+        if cover_future is not None:
+            try:
+                cover_data, cover_mime = cover_future.result(timeout=COVER_TIMEOUT)
+            except Exception as e:
+                logging.warning(f"等待封面下载失败: {e}")
+        try:
+            frames = frames_future.result()
+        except Exception as e:
+            logging.warning(f"预先构建 ID3 帧失败，将重新构建: {e}")
+            frames = None
+        return render_id3_tag(song_details, cover_data, cover_mime, frames)
+
     try:
+        # 封面下载和 ID3 帧准备（歌词解析等）与音频请求并行进行，封面只保存在内存中
+        if cover_url:
+            logging.info(f"正在下载封面: {title} - {singer}...")
+            cover_future = _asset_executor.submit(load_cover_bytes, cover_url)
+        frames_future = _asset_executor.submit(build_id3_frames, song_details)
+
         logging.info(f"正在下载音频文件从: {audio_url} ...")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(audio_url, stream=True, timeout=60, headers=headers)
-        response.raise_for_status()
+        response, resume_from, sidecar = _open_audio_stream(audio_url, part_path, sidecar_path)
 
-        audio_file_extension = '.mp3' # Default
-        content_type = response.headers.get('Content-Type', '').lower()
-        parsed_url_path = urlparse(audio_url).path
-        
-        path_basename = os.path.basename(parsed_url_path)
-        if '.' in path_basename:
-            ext_from_url = os.path.splitext(path_basename)[1].lower()
-            if ext_from_url in ['.mp3', '.m4a', '.aac', '.flac', '.wav', '.ogg']:
-                audio_file_extension = ext_from_url
-        elif 'audio/mpeg' in content_type or 'mp3' in content_type:
-            audio_file_extension = '.mp3'
-        elif 'audio/aac' in content_type:
-            audio_file_extension = '.aac'
-        elif 'audio/mp4' in content_type or 'm4a' in content_type: 
-            audio_file_extension = '.m4a'
-        elif 'audio/flac' in content_type or 'x-flac' in content_type:
-            audio_file_extension = '.flac'
-        elif 'audio/wav' in content_type or 'x-wav' in content_type:
-            audio_file_extension = '.wav'
+        audio_file_extension = sidecar.get('extension') if resume_from else None
+        if not audio_file_extension:
+            content_type = response.headers.get('Content-Type', '') if response is not None else ''
+            audio_file_extension = _guess_audio_extension(audio_url, content_type)
         
-        temp_audio_file_path_with_ext = temp_audio_file_path_no_ext + audio_file_extension
         final_audio_filename_with_ext = f"{base_filename_safe}{audio_file_extension}"
         final_audio_full_path = os.path.join(download_target_dir, final_audio_filename_with_ext)
         
@@ -357,84 +1026,145 @@ def download_song_assets_for_web(song_details, app_static_folder):
         relative_final_audio_path = os.path.join(DOWNLOAD_DIR_NAME, final_audio_filename_with_ext).replace('\\', '/')
 
         if os.path.exists(final_audio_full_path):
+            # 等待断点文件期间另一个任务已完成同一首歌
             logging.info(f"最终音频文件 '{final_audio_filename_with_ext}' 已存在于 {download_target_dir}，跳过下载。")
+            if cover_future is not None:
+                cover_future.cancel()
+            _remove_partial(part_path, sidecar_path)
             # 如果文件已存在，我们依然需要返回其相对路径供播放器使用
-            return relative_final_audio_path, True, f"文件已存在: {final_audio_filename_with_ext}"
+            return result(relative_final_audio_path, True, f"文件已存在: {final_audio_filename_with_ext}")
+
+        is_mp3 = audio_file_extension == '.mp3'
+        header_length = (sidecar.get('header_length') or 0) if resume_from else 0
+        skipped_length = (sidecar.get('skipped_length') or 0) if resume_from else 0
+        # 从头下载 MP3：封面和歌词帧就绪之前先读取音频并缓存在内存中，就绪后写入标签，
+        # 上游音频自带的 ID3v2 标签被丢弃，由我们生成的标签代替
+        tag_pending = response is not None and not resume_from and is_mp3
+        tag_attempted = tag_pending
+        pending_audio = bytearray()
 
-        with open(temp_audio_file_path_with_ext, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        logging.info(f"音频文件下载完成到临时路径: {temp_audio_file_path_with_ext}")
+        def tag_ready():
+            return frames_future.done() and (cover_future is None or cover_future.done())
+
+        digest = hashlib.sha256()
+        if resume_from:
+            _hash_file_into(digest, part_path) # 续传时已有部分只读取一遍用于计算哈希
+
+        if response is None:
+            bytes_total = bytes_done = resume_from
+        else:
+            bytes_total = _response_total_length(response, resume_from)
+            bytes_done = resume_from
+            if not tag_pending:
+                sidecar.update(_new_partial_sidecar(audio_url, response, bytes_total, audio_file_extension,
+                                                    header_length - skipped_length + bytes_done,
+                                                    header_length, skipped_length))
+                _write_partial_sidecar(sidecar_path, sidecar)
+        if progress_callback:
+            progress_callback('downloading', bytes_done, bytes_total)
+        last_sidecar_bytes = bytes_done
+        with open(part_path, 'ab' if resume_from else 'wb', buffering=AUDIO_WRITE_BUFFER_SIZE) as f:
+
+            def write_pending_tag():
+                nonlocal tag_pending, header_length, skipped_length
+                tag_pending = False
+                tag_bytes = wait_for_tag()
+                header_length = len(tag_bytes)
+                skipped_length = _id3v2_length(pending_audio) if tag_bytes else 0
+                f.write(tag_bytes)
+                digest.update(tag_bytes)
+                audio = memoryview(pending_audio)[skipped_length:]
+                f.write(audio)
+                digest.update(audio)
+                audio.release()
+                pending_audio.clear()
+                sidecar.update(_new_partial_sidecar(audio_url, response, bytes_total, audio_file_extension,
+                                                    header_length + max(bytes_done - skipped_length, 0),
+                                                    header_length, skipped_length))
+                _write_partial_sidecar(sidecar_path, sidecar)
+
+            try:
+                for chunk in (response.iter_content(chunk_size=AUDIO_WRITE_BUFFER_SIZE) if response is not None else ()):
+                    chunk_start = bytes_done
+                    bytes_done += len(chunk)
+                    if progress_callback:
+                        progress_callback('downloading', bytes_done, bytes_total)
+                    if tag_pending:
+                        pending_audio += chunk
+                        if len(pending_audio) >= 10 and (tag_ready() or len(pending_audio) >= AUDIO_TAG_WAIT_BUFFER_BYTES):
+                            write_pending_tag()
+                        continue
+                    if chunk_start < skipped_length:
+                        # 上游标签比第一次写入时缓存的数据长，剩余部分继续丢弃
+                        chunk = chunk[skipped_length - chunk_start:]
+                    f.write(chunk)
+                    digest.update(chunk)
+                    if bytes_done - last_sidecar_bytes >= PARTIAL_SIDECAR_UPDATE_BYTES:
+                        f.flush()
+                        sidecar['bytes_written'] = header_length + max(bytes_done - skipped_length, 0)
+                        _write_partial_sidecar(sidecar_path, sidecar)
+                        last_sidecar_bytes = bytes_done
+            finally:
+                if tag_pending:
+                    # 标签就绪前传输已结束（包括连接中断）：写出缓存的音频，中断时可从断点续传
+                    write_pending_tag()
+        if bytes_total is not None and bytes_done < bytes_total:
+            raise requests.exceptions.ChunkedEncodingError(f"连接提前关闭: 已接收 {bytes_done}/{bytes_total} 字节")
+        logging.info(f"音频传输完成: {part_path}")
+
+        if is_mp3 and not header_length and not tag_attempted:
+            # 播放代理写入的断点文件只有音频数据：写标签并复制一次
+            if progress_callback:
+                progress_callback('tagging', bytes_done, bytes_total)
+            tag_bytes = wait_for_tag()
+            if tag_bytes:
+                digest = hashlib.sha256()
+                tagged_copy_path = part_path + '.tagged'
+                file_size = _write_tagged_copy(part_path, tagged_copy_path, tag_bytes, digest)
+                os.replace(tagged_copy_path, part_path)
+                tagged_copy_path = None
+                header_length = len(tag_bytes)
+                skipped_length = header_length + bytes_done - file_size
+        elif not is_mp3:
+            logging.info(f"下载的文件类型为 {audio_file_extension}，当前仅支持为 .mp3 文件嵌入元数据。")
+        if is_mp3 and not header_length:
+            logging.warning(f"未能写入 ID3 标签，保存为无标签文件: {part_path}")
+        content_info = (digest.hexdigest(), header_length + bytes_done - skipped_length, bool(header_length))
+
+        # temp 与 downloads 都在 static 下，shutil.move 在同一文件系统内只是重命名
+        os.makedirs(os.path.dirname(final_audio_full_path), exist_ok=True)
+        shutil.move(part_path, final_audio_full_path)
+        _remove_partial(None, sidecar_path)
+        logging.info(f"音频文件已保存为: {final_audio_full_path}")
+        return result(relative_final_audio_path, True, f"下载并处理完成: {final_audio_filename_with_ext}", content_info)
 
     except requests.exceptions.HTTPError as e:
         msg = f"下载音频文件HTTP错误: {e.response.status_code} - {e}"
         logging.error(msg)
-        return None, False, msg
+        return result(None, False, msg)
     except requests.exceptions.RequestException as e:
+        # 保留已下载的部分和描述文件，下次从断点继续
         msg = f"下载音频文件时发生请求错误: {e}"
         logging.error(msg)
-        return None, False, msg
+        _keep_partial_for_resume(part_path, sidecar_path)
+        return result(None, False, msg)
     except IOError as e:
-        msg = f"保存临时音频文件时发生IO错误: {e}"
+        msg = f"保存音频文件时发生IO错误: {e}"
         logging.error(msg)
-        return None, False, msg
+        return result(None, False, msg)
     except Exception as e:
         msg = f"下载音频文件时发生未知错误: {e}"
         logging.error(msg)
-        if temp_audio_file_path_with_ext and os.path.exists(temp_audio_file_path_with_ext):
-            try: os.remove(temp_audio_file_path_with_ext) 
+        _remove_partial(part_path, sidecar_path)
+        return result(None, False, msg)
+    finally:
+        # 释放连接回连接池（文件已存在提前返回时响应体未被读取）
+        if response is not None:
+            response.close()
+        if tagged_copy_path and os.path.exists(tagged_copy_path):
+            try: os.remove(tagged_copy_path)
             except OSError: pass
-        return None, False, msg
-
-    # --- Cover Download (to temp_processing_dir) ---
-    temp_cover_full_path = None
-    if cover_url:
-        cover_ext = os.path.splitext(urlparse(cover_url).path)[1].lower()
-        if not cover_ext or cover_ext not in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-            cover_ext = '.jpg'
-        temp_cover_filename = f"temp_cover_{os.urandom(8).hex()}{cover_ext}"
-        temp_cover_full_path = os.path.join(temp_processing_dir, temp_cover_filename)
-        logging.info(f"正在下载封面: {title} - {singer} 到 {temp_cover_full_path}...")
-        if not download_file_to_path(cover_url, temp_cover_full_path, is_cover=True):
-            logging.warning(f"封面文件下载失败: {cover_url}")
-            temp_cover_full_path = None # Ensure it's None if download fails
-    
-    # --- Metadata Embedding (if MP3 and audio downloaded) ---
-    if os.path.exists(temp_audio_file_path_with_ext) and audio_file_extension == '.mp3':
-        logging.info(f"开始为 {temp_audio_file_path_with_ext} 嵌入元数据...")
-        embed_metadata_success = embed_metadata(temp_audio_file_path_with_ext, song_details, temp_cover_full_path)
-        if not embed_metadata_success:
-            logging.warning(f"元数据嵌入可能未完全成功: {temp_audio_file_path_with_ext}")
-            # 继续移动文件，即使元数据嵌入失败
-    elif audio_file_extension != '.mp3':
-        logging.info(f"下载的文件类型为 {audio_file_extension}，当前仅支持为 .mp3 文件嵌入元数据。")
-    
-    # --- Move/Rename temp audio file to final destination in static/downloads ---
-    if os.path.exists(temp_audio_file_path_with_ext) and final_audio_full_path:
-        try:
-            os.makedirs(os.path.dirname(final_audio_full_path), exist_ok=True)
-            shutil.move(temp_audio_file_path_with_ext, final_audio_full_path) # shutil.move 更可靠
-            logging.info(f"音频文件已保存为: {final_audio_full_path}")
-            return relative_final_audio_path, True, f"下载并处理完成: {final_audio_filename_with_ext}"
-        except OSError as e:
-            msg = f"重命名/移动音频文件失败: {e}. 临时文件: {temp_audio_file_path_with_ext}, 目标: {final_audio_full_path}"
-            logging.error(msg)
-            # 如果移动失败，尝试清理临时文件
-            if os.path.exists(temp_audio_file_path_with_ext): 
-                try: os.remove(temp_audio_file_path_with_ext) 
-                except OSError: pass
-            return None, False, msg 
-    elif os.path.exists(temp_audio_file_path_with_ext):
-        msg = f"音频下载完成但无法确定最终文件名或路径。临时文件: {temp_audio_file_path_with_ext}"
-        logging.error(msg)
-        # 清理未移动的临时文件
-        try: os.remove(temp_audio_file_path_with_ext) 
-        except OSError: pass
-        return None, False, msg
-    else:
-        # This case implies audio download failed earlier and was handled, 
-        # but as a safeguard if logic reaches here without a temp file.
-        logging.info("下载流程结束，但未找到临时音频文件进行最终移动。")
-        return None, False, "音频下载失败或临时文件丢失"
+        if partial_lock is not None:
+            partial_lock.release()
 
 # 移除之前的占位符注释 
\ No newline at end of file
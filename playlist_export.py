@@ -0,0 +1,113 @@
+import logging
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# 歌单打包导出：边准备歌曲文件边生成 ZIP 流。
+# ZIP 写入一个只追加的内存缓冲区，每写入一块就把缓冲区内容交给客户端并清空，
+# 因此不会在磁盘或内存中生成完整的压缩包，内存占用与歌单长度无关。
+
+EXPORT_MAX_WORKERS = 3           # 每次导出同时准备（解析/下载）的歌曲数
+EXPORT_POOL_WORKERS = 6          # 所有导出共用的线程数上限
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_FAILURES_FILENAME = '未能导出的歌曲.txt'
+
+logger = logging.getLogger(__name__)
+
+# 所有导出共用一个有界线程池，同时进行的导出再多也不会额外创建线程
+_export_executor = ThreadPoolExecutor(max_workers=EXPORT_POOL_WORKERS, thread_name_prefix='playlist-export')
+
+class _ZipStreamBuffer:
+    """
+    只支持 write() 的输出对象。zipfile 检测到不可 seek 时会改用数据描述符（data descriptor）写入，
+    适合流式输出。
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _unique_arcname(arcname, used_names):
+    name, ext = os.path.splitext(arcname)
+    candidate = arcname
+    n = 2
+    while candidate in used_names:
+        candidate = f"{name} ({n}){ext}"
+        n += 1
+    used_names.add(candidate)
+    return candidate
+
+def iter_zip_stream(items, resolve_file, max_workers=EXPORT_MAX_WORKERS):
+    """
+    以有界并发准备 items 中的每一项，按完成顺序把文件写入 ZIP 并逐块产出字节。
+    Args:
+        items: 待导出的条目列表。
+        resolve_file: resolve_file(item) -> (absolute_path, error_message)，成功时 error_message 为 None。
+        max_workers: 本次导出同时提交到共用线程池的条目数。
+    Yields: ZIP 数据块（bytes）。
+    """
+    buffer = _ZipStreamBuffer()
+    pending = {}
+    used_names = set()
+    failures = []
+    item_iter = iter(enumerate(items, 1))
+
+    def submit_next():
+        for position, item in item_iter:
+            pending[_export_executor.submit(resolve_file, item)] = (position, item)
+            return
+
+    try:
+        with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as zf:
+            for _ in range(max_workers):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position, item = pending.pop(future)
+                    submit_next()
+                    try:
+                        file_path, error = future.result()
+                    except Exception as e:
+                        file_path, error = None, f"未知错误: {e}"
+                    if not file_path or not os.path.isfile(file_path):
+                        failures.append((position, item, error or '文件不存在'))
+                        continue
+                    arcname = _unique_arcname(f"{position:03d} - {os.path.basename(file_path)}", used_names)
+                    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                    zinfo.compress_type = zipfile.ZIP_STORED # 音频本身已压缩
+                    with open(file_path, 'rb') as src, zf.open(zinfo, 'w') as dest:
+                        while True:
+                            chunk = src.read(EXPORT_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            data = buffer.drain()
+                            if data:
+                                yield data
+                    yield buffer.drain()
+            if failures:
+                lines = [f"{position:03d}\t{_describe(item)}\t{error}" for position, item, error in sorted(failures, key=lambda f: f[0])]
+                zf.writestr(EXPORT_FAILURES_FILENAME, '\n'.join(lines) + '\n')
+        yield buffer.drain()
+        logger.info(f"歌单导出完成: 共 {len(used_names)} 首，失败 {len(failures)} 首。")
+    finally:
+        # 客户端中途断开时取消尚未开始的条目，不等待进行中的下载（其结果仍会进入曲库）
+        for future in pending:
+            future.cancel()
+
+def _describe(item):
+    if isinstance(item, dict):
+        return f"{item.get('title') or '未知歌名'} - {item.get('singer') or '未知歌手'}"
+    return str(item)
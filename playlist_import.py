@@ -0,0 +1,275 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import re
+
+import async_music_api
+import music_api_handler as api
+
+# 歌单批量导入：解析 M3U / CSV / JSON 列表，在一个事件循环中以有界并发
+# （async_music_api.gather_limited）解析出具体歌曲，再由 database.add_songs_to_playlist 在一个事务中批量写入。
+# 导入在 download_jobs 的后台任务中执行，前端轮询任务进度。
+
+IMPORT_MAX_WORKERS = 4       # 同时向上游解析的条目数
+# 单次导入的最大条目数。每条最多需要一次搜索和一次详情请求（约 1 秒），
+# 200 条在 4 个并发下约一分钟内完成，后台任务不会长时间占用工作线程
+IMPORT_MAX_ROWS = 200
+IMPORT_FORMATS = ('m3u', 'csv', 'json')
+
+# 每一行的导入结果
+ROW_ADDED = 'added'
+ROW_DUPLICATE = 'duplicate'
+ROW_NOT_FOUND = 'not_found'
+ROW_INVALID = 'invalid'
+ROW_ERROR = 'error'
+
+# CSV 表头的别名 -> 字段名
+CSV_HEADER_ALIASES = {
+    'query': 'query', 'song_query': 'query', 'keyword': 'query', '关键词': 'query',
+    'index': 'index', 'song_api_index': 'index', 'n': 'index', '序号': 'index',
+    'title': 'title', 'name': 'title', '歌名': 'title', '歌曲': 'title',
+    'singer': 'singer', 'artist': 'singer', '歌手': 'singer',
+    'cover': 'cover', '封面': 'cover',
+}
+# M3U 的 #EXTINF:时长,歌手 - 歌名
+EXTINF_REGEX = re.compile(r'^#EXTINF:[^,]*,(.*)$')
+
+logger = logging.getLogger(__name__)
+
+class ImportFormatError(ValueError):
+    """导入内容无法按指定格式解析。"""
+
+def detect_format(filename=None, content=''):
+    """
+    根据文件扩展名或内容猜测格式。Returns: 'm3u' / 'csv' / 'json'。
+    """
+    ext = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if ext in ('m3u', 'm3u8'):
+        return 'm3u'
+    if ext in IMPORT_FORMATS:
+        return ext
+    stripped = content.lstrip()
+    if stripped.startswith(('[', '{')):
+        return 'json'
+    if stripped.startswith('#EXTM3U') or stripped.startswith('#EXTINF'):
+        return 'm3u'
+    return 'csv'
+
+def _entry(row, query=None, index=None, title=None, singer=None, cover=None):
+    def clean(value):
+        value = str(value).strip() if value is not None else ''
+        return value or None
+    return {'row': row, 'query': clean(query), 'index': clean(index), 'title': clean(title),
+            'singer': clean(singer), 'cover': clean(cover)}
+
+def _split_artist_title(text):
+    """'歌手 - 歌名' -> (歌名, 歌手)；没有分隔符时整段作为歌名。"""
+    if ' - ' in text:
+        singer, title = text.split(' - ', 1)
+        return title.strip(), singer.strip()
+    return text.strip(), None
+
+def _parse_m3u(content):
+    entries = []
+    pending_title = pending_singer = None
+    for line_no, raw_line in enumerate(content.splitlines(), 1):
+        line = raw_line.strip().lstrip('\ufeff')
+        if not line:
+            continue
+        match = EXTINF_REGEX.match(line)
+        if match:
+            pending_title, pending_singer = _split_artist_title(match.group(1))
+            continue
+        if line.startswith('#'):
+            continue
+        # 路径/URL 行：优先使用前一个 #EXTINF 的信息，否则从文件名推断
+        title, singer = pending_title, pending_singer
+        if not title:
+            basename = os.path.splitext(os.path.basename(line.replace('\\', '/')))[0]
+            title, singer = _split_artist_title(basename)
+        entries.append(_entry(line_no, title=title, singer=singer))
+        pending_title = pending_singer = None
+    return entries
+
+def _parse_csv(content):
+    rows = list(csv.reader(io.StringIO(content.lstrip('\ufeff'))))
+    if not rows:
+        return []
+    header = [CSV_HEADER_ALIASES.get(cell.strip().lower()) for cell in rows[0]]
+    entries = []
+    if any(header):
+        for line_no, row in enumerate(rows[1:], 2):
+            if not any(cell.strip() for cell in row):
+                continue
+            fields = {name: value for name, value in zip(header, row) if name}
+            entries.append(_entry(line_no, **fields))
+        return entries
+    # 无表头：关键词, 序号或歌名, 歌手
+    for line_no, row in enumerate(rows, 1):
+        cells = [cell.strip() for cell in row] + [''] * 3
+        if not any(cells):
+            continue
+        query, second, singer = cells[:3]
+        if second.isdigit():
+            entries.append(_entry(line_no, query=query, index=second, singer=singer))
+        else:
+            entries.append(_entry(line_no, query=query, title=second, singer=singer))
+    return entries
+
+def _parse_json(content):
+    try:
+        data = json.loads(content)
+    except ValueError as e:
+        raise ImportFormatError(f"JSON 格式错误: {e}")
+    if isinstance(data, dict):
+        data = data.get('songs')
+    if not isinstance(data, list):
+        raise ImportFormatError("JSON 应为歌曲列表，或包含 songs 列表的对象。")
+    entries = []
+    for row, item in enumerate(data, 1):
+        if isinstance(item, str):
+            entries.append(_entry(row, query=item))
+        elif isinstance(item, dict):
+            entries.append(_entry(
+                row,
+                query=item.get('query', item.get('song_query')),
+                index=item.get('index', item.get('song_api_index', item.get('n'))),
+                title=item.get('title'),
+                singer=item.get('singer', item.get('artist')),
+                cover=item.get('cover'),
+            ))
+        else:
+            entries.append(_entry(row))
+    return entries
+
+_PARSERS = {'m3u': _parse_m3u, 'csv': _parse_csv, 'json': _parse_json}
+
+def parse_import(content, fmt):
+    """
+    解析导入内容。Returns: [{'row', 'query', 'index', 'title', 'singer', 'cover'}, ...]
+    Raises: ImportFormatError。
+    """
+    if fmt not in _PARSERS:
+        raise ImportFormatError(f"不支持的格式: {fmt}")
+    try:
+        entries = _PARSERS[fmt](content)
+    except csv.Error as e:
+        raise ImportFormatError(f"CSV 格式错误: {e}")
+    if len(entries) > IMPORT_MAX_ROWS:
+        raise ImportFormatError(f"条目过多 ({len(entries)})，单次最多导入 {IMPORT_MAX_ROWS} 首。")
+    return entries
+
+def _pick_search_result(songs, title, singer):
+    """在搜索结果中优先选择歌名（及歌手）一致的一首，否则取第一首。"""
+    want_title = api._normalize_query(title) if title else None
+    want_singer = api._normalize_query(singer) if singer else None
+    fallback = None
+    for song in songs:
+        if want_title and api._normalize_query(song.get('title')) != want_title:
+            continue
+        if want_singer and want_singer not in api._normalize_query(song.get('singer') or ''):
+            fallback = fallback or song
+            continue
+        return song
+    return fallback or songs[0]
+
+async def resolve_entry(entry):
+    """
+    把一个导入条目解析为可写入歌单的歌曲。
+    关键词、序号、歌名、歌手齐全的条目直接使用，不访问上游；有序号时获取详情；
+    否则按关键词（或“歌名 歌手”）搜索并选择最匹配的一首。
+    Returns: (song dict or None, status, message)
+    """
+    query, index = entry['query'], entry['index']
+    if query and index and entry['title'] and entry['singer']:
+        return _song(query, index, entry['title'], entry['singer'], entry['cover']), ROW_ADDED, None
+    if not query:
+        query = ' '.join(part for part in (entry['title'], entry['singer']) if part)
+    if not query:
+        return None, ROW_INVALID, '缺少关键词或歌名'
+
+    if not index:
+        songs = await async_music_api.search_music(query)
+        if not songs:
+            return None, ROW_NOT_FOUND, '未搜索到歌曲'
+        index = str(_pick_search_result(songs, entry['title'], entry['singer'])['index'])
+
+    details = await async_music_api.get_song_details(query, index)
+    if not details:
+        return None, ROW_NOT_FOUND, '无法获取歌曲详情'
+    return _song(query, index, details.get('title') or entry['title'], details.get('singer') or entry['singer'],
+                 details.get('cover') or entry['cover']), ROW_ADDED, None
+
+def _song(query, index, title, singer, cover):
+    return {'song_query': query, 'song_api_index': str(index), 'title': title or '未知标题',
+            'singer': singer or '未知歌手', 'cover': cover}
+
+def resolve_entries(entries, max_workers=IMPORT_MAX_WORKERS, progress_callback=None):
+    """
+    以有界并发解析所有条目，max_workers 为同时进行的条目数。
+    progress_callback(rows_done, rows_total) 在每条解析完成后调用。
+    内部使用 asyncio.run()，应在没有运行中事件循环的线程（如导入任务线程）中调用。
+    Returns: 与 entries 顺序一致的 (song, status, message) 列表。
+    """
+    if not entries:
+        return []
+    return asyncio.run(_resolve_entries_async(entries, max_workers, progress_callback))
+
+async def _resolve_entries_async(entries, limit, progress_callback):
+    done = 0
+
+    async def safe_resolve(entry):
+        nonlocal done
+        try:
+            return await resolve_entry(entry)
+        except Exception as e:
+            logger.error(f"解析导入条目失败 (第 {entry['row']} 行): {e}")
+            return None, ROW_ERROR, '解析时发生错误'
+        finally:
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(entries))
+
+    try:
+        return await async_music_api.gather_limited((safe_resolve(entry) for entry in entries), limit=limit)
+    finally:
+        await async_music_api.close_http_session()
+
+def import_into_playlist(playlist_id, entries, insert_songs, max_workers=IMPORT_MAX_WORKERS, progress_callback=None):
+    """
+    解析条目并批量写入歌单。
+    Args:
+        insert_songs: insert_songs(playlist_id, songs) -> [True(新增)/False(重复), ...] or None if error，
+                      即 database.add_songs_to_playlist。
+        progress_callback: 见 resolve_entries。
+    Returns: (summary dict, 每行结果列表)。
+    """
+    resolved = resolve_entries(entries, max_workers=max_workers, progress_callback=progress_callback)
+    results = []
+    to_insert = []
+    for entry, (song, status, message) in zip(entries, resolved):
+        result = {'row': entry['row'], 'status': status, 'message': message,
+                  'title': song['title'] if song else entry['title'],
+                  'singer': song['singer'] if song else entry['singer']}
+        if song:
+            result.update(song_query=song['song_query'], song_api_index=song['song_api_index'])
+            to_insert.append((result, song))
+        results.append(result)
+
+    if to_insert:
+        inserted = insert_songs(playlist_id, [song for _, song in to_insert])
+        for i, (result, _) in enumerate(to_insert):
+            if inserted is None:
+                result.update(status=ROW_ERROR, message='写入数据库失败')
+            elif not inserted[i]:
+                result.update(status=ROW_DUPLICATE, message='已存在于歌单中')
+
+    summary = {status: 0 for status in (ROW_ADDED, ROW_DUPLICATE, ROW_NOT_FOUND, ROW_INVALID, ROW_ERROR)}
+    for result in results:
+        summary[result['status']] += 1
+    summary['total'] = len(results)
+    logger.info(f"歌单 {playlist_id} 批量导入完成: {summary}")
+    return summary, results
@@ -0,0 +1,170 @@
+import logging
+import threading
+from collections import deque
+
+# 下一首预取：播放页响应发送后，在后台预热下一首歌的详情（含已解析的歌词），
+# 可选地把音频开头写入断点文件，用户切到下一首时不必再等待上游。
+# 队列有界、相同歌曲只预取一次；每个用户只保留最新的一个预取，打开其它页面时取消。
+
+PREFETCH_MAX_WORKERS = 2
+PREFETCH_MAX_QUEUE = 32              # 排队中的预取上限，超出时丢弃最早的
+PREFETCH_AUDIO_BYTES = 256 * 1024    # 预取的音频开头字节数
+
+logger = logging.getLogger(__name__)
+
+class _PrefetchTask:
+    __slots__ = ('key', 'query', 'song_api_index', 'owners', 'cancelled')
+
+    def __init__(self, key, query, song_api_index):
+        self.key = key
+        self.query = query
+        self.song_api_index = song_api_index
+        self.owners = set() # 需要这次预取的用户；全部取消后任务才取消
+        self.cancelled = threading.Event()
+
+class Prefetcher:
+    """
+    有界的后台预取队列。
+    Args:
+        warm_details: warm_details(query, song_api_index) -> song details or None，即 music_api_handler.get_song_details。
+        warm_audio: 可选，warm_audio(song_details, cancelled)；cancelled 为无参函数，返回 True 时应尽快停止。
+    """
+
+    def __init__(self, warm_details, warm_audio=None, max_workers=PREFETCH_MAX_WORKERS,
+                 max_queue=PREFETCH_MAX_QUEUE, name='prefetch'):
+        self._warm_details = warm_details
+        self._warm_audio = warm_audio
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = deque()
+        self._tasks = {}    # (query, song_api_index) -> 排队或执行中的任务
+        self._by_owner = {} # owner -> 该用户最新的任务
+        self._cond = threading.Condition()
+        self._closed = False
+        self.scheduled = 0
+        self.deduped = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self._workers = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def schedule(self, owner, query, song_api_index):
+        """
+        预取一首歌；同一 owner 之前的预取被取消，已在队列中或执行中的相同歌曲不会重复预取。
+        Returns: 是否已排队（或合并到已有任务）。
+        """
+        key = (query, str(song_api_index))
+        with self._cond:
+            if self._closed:
+                return False
+            current = self._by_owner.get(owner)
+            if current is not None and current.key == key and not current.cancelled.is_set():
+                return True
+            self._cancel_locked(owner)
+            task = self._tasks.get(key)
+            if task is not None and not task.cancelled.is_set():
+                task.owners.add(owner)
+                self._by_owner[owner] = task
+                self.deduped += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                stale = self._queue.popleft()
+                self._drop_locked(stale)
+                self.dropped += 1
+            task = _PrefetchTask(key, query, str(song_api_index))
+            task.owners.add(owner)
+            self._queue.append(task)
+            self._tasks[key] = task
+            self._by_owner[owner] = task
+            self.scheduled += 1
+            self._cond.notify()
+        return True
+
+    def cancel(self, owner, keep=None):
+        """
+        取消 owner 的预取（用户打开了其它页面）。排队中的任务直接移除，执行中的任务在下一个检查点停止。
+        Args:
+            keep: (query, song_api_index)；owner 的预取正是这首歌时不取消（用户打开了预取的那首歌）。
+        """
+        with self._cond:
+            current = self._by_owner.get(owner)
+            if keep is not None and current is not None and current.key == (keep[0], str(keep[1])):
+                return
+            self._cancel_locked(owner)
+
+    def _cancel_locked(self, owner):
+        task = self._by_owner.pop(owner, None)
+        if task is None:
+            return
+        task.owners.discard(owner)
+        if task.owners:
+            return
+        if task in self._queue:
+            self._queue.remove(task)
+        self._drop_locked(task)
+        self.cancelled += 1
+
+    def _drop_locked(self, task):
+        task.cancelled.set()
+        if self._tasks.get(task.key) is task:
+            del self._tasks[task.key]
+        for owner in task.owners:
+            if self._by_owner.get(owner) is task:
+                del self._by_owner[owner]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                task = self._queue.popleft()
+            try:
+                self._prefetch(task)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"{self.name}: 预取 {task.query} #{task.song_api_index} 失败: {e}")
+            finally:
+                with self._cond:
+                    if not task.cancelled.is_set():
+                        self._drop_locked(task)
+
+    def _prefetch(self, task):
+        details = self._warm_details(task.query, task.song_api_index)
+        if not details:
+            self.failed += 1
+            return
+        if self._warm_audio is not None and not task.cancelled.is_set():
+            self._warm_audio(details, task.cancelled.is_set)
+        if not task.cancelled.is_set():
+            self.completed += 1
+            logger.info(f"{self.name}: 已预取 {task.query} #{task.song_api_index}")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for task in list(self._tasks.values()):
+                self._drop_locked(task)
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+            active = len(self._tasks) - queued
+        return {
+            'name': self.name,
+            'queued': queued,
+            'active': active,
+            'max_queue': self.max_queue,
+            'scheduled': self.scheduled,
+            'deduped': self.deduped,
+            'cancelled': self.cancelled,
+            'dropped': self.dropped,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,415 @@
+import abc
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+
+from cache_utils import MISSING
+
+# 服务端会话：Cookie 中只保存随机的会话 ID，会话数据按键分别保存在服务端存储中。
+# 每个键在首次访问时才读取和反序列化，只读 user_id 的页面不会加载播放历史等较大的数据；
+# 请求结束时只写回修改过的键。
+
+SESSION_STORE_FILENAME = 'sessions.db'
+SESSION_STORE_DIR_NAME = 'sessions'
+SESSION_ID_BYTES = 32
+SESSION_ID_REGEX = re.compile(r'^[A-Za-z0-9_-]{20,128}$')
+# 会话在最后一次写入或续期后保留的秒数；剩余时间不足一半时在请求结束时续期
+SESSION_TTL_SECONDS = 31 * 24 * 3600
+# 清理过期会话的最小间隔（秒），在保存会话时顺带执行
+SESSION_CLEANUP_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(abc.ABC):
+    """
+    会话存储接口。值为已序列化的字符串；过期时间为 time.time() 时间戳，对整个会话生效。
+    """
+
+    @abc.abstractmethod
+    def get(self, sid, key):
+        """Returns: (value, expires_at)；不存在或已过期时返回 (MISSING, None)。"""
+
+    @abc.abstractmethod
+    def items(self, sid):
+        """Returns: ({key: value}, expires_at)；会话不存在时返回 ({}, None)。"""
+
+    @abc.abstractmethod
+    def exists(self, sid):
+        pass
+
+    @abc.abstractmethod
+    def save(self, sid, updates, deletes, expires_at):
+        """写入 updates 中的键、删除 deletes 中的键，并把整个会话的过期时间设为 expires_at。"""
+
+    @abc.abstractmethod
+    def touch(self, sid, expires_at):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, sid):
+        pass
+
+    @abc.abstractmethod
+    def cleanup(self):
+        """删除所有过期会话。Returns: 删除的会话（或键）数量。"""
+
+class SQLiteSessionStore(SessionStore):
+    """
+    基于 SQLite (WAL) 的会话存储（线程安全），每个 (会话, 键) 一行。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS session_values (
+                sid TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (sid, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_session_values_expires ON session_values (expires_at);
+            """)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, sid, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM session_values WHERE sid = ? AND key = ? AND expires_at > ?",
+                (sid, key, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else (MISSING, None)
+
+    def items(self, sid):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, expires_at FROM session_values WHERE sid = ? AND expires_at > ?",
+                (sid, time.time())
+            ).fetchall()
+        return {key: value for key, value, _ in rows}, min((row[2] for row in rows), default=None)
+
+    def exists(self, sid):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM session_values WHERE sid = ? AND expires_at > ? LIMIT 1", (sid, time.time())
+            ).fetchone()
+        return row is not None
+
+    def save(self, sid, updates, deletes, expires_at):
+        with self._lock, self._conn:
+            # 已过期的键不随续期复活
+            self._conn.execute("DELETE FROM session_values WHERE sid = ? AND expires_at <= ?", (sid, time.time()))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session_values (sid, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(sid, key, value, expires_at) for key, value in updates.items()]
+            )
+            self._conn.executemany("DELETE FROM session_values WHERE sid = ? AND key = ?", [(sid, key) for key in deletes])
+            self._conn.execute("UPDATE session_values SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+
+    def touch(self, sid, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE session_values SET expires_at = ? WHERE sid = ? AND expires_at > ?",
+                               (expires_at, sid, time.time()))
+
+    def delete(self, sid):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM session_values WHERE sid = ?", (sid,))
+
+    def cleanup(self):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM session_values WHERE expires_at <= ?", (time.time(),)).rowcount
+
+class FileSessionStore(SessionStore):
+    """
+    基于文件的会话存储：每个会话一个目录（<root>/<sid>/），每个键一个 JSON 文件，过期时间保存在 expires 文件中。
+    """
+
+    EXPIRES_FILENAME = 'expires'
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _session_dir(self, sid):
+        return os.path.join(self.root_dir, sid)
+
+    def _key_path(self, sid, key):
+        return os.path.join(self._session_dir(sid), f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]}.json")
+
+    def _write(self, path, text):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _expires_at(self, sid):
+        try:
+            with open(os.path.join(self._session_dir(sid), self.EXPIRES_FILENAME), 'r', encoding='utf-8') as f:
+                expires_at = float(f.read())
+        except (OSError, ValueError):
+            return None
+        return expires_at if expires_at > time.time() else None
+
+    def get(self, sid, key):
+        expires_at = self._expires_at(sid)
+        if expires_at is None:
+            return MISSING, None
+        try:
+            with open(self._key_path(sid, key), 'r', encoding='utf-8') as f:
+                return json.load(f)['value'], expires_at
+        except (OSError, ValueError, KeyError):
+            return MISSING, None
+
+    def items(self, sid):
+        expires_at = self._expires_at(sid)
+        if expires_at is None:
+            return {}, None
+        values = {}
+        session_dir = self._session_dir(sid)
+        for filename in os.listdir(session_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(session_dir, filename), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                values[entry['key']] = entry['value']
+            except (OSError, ValueError, KeyError):
+                continue
+        return values, expires_at
+
+    def exists(self, sid):
+        return self._expires_at(sid) is not None
+
+    def save(self, sid, updates, deletes, expires_at):
+        if self._expires_at(sid) is None:
+            self.delete(sid) # 已过期的键不随续期复活
+        os.makedirs(self._session_dir(sid), exist_ok=True)
+        for key, value in updates.items():
+            self._write(self._key_path(sid, key), json.dumps({'key': key, 'value': value}, ensure_ascii=False))
+        for key in deletes:
+            try:
+                os.remove(self._key_path(sid, key))
+            except FileNotFoundError:
+                pass
+        self.touch(sid, expires_at)
+
+    def touch(self, sid, expires_at):
+        if os.path.isdir(self._session_dir(sid)):
+            self._write(os.path.join(self._session_dir(sid), self.EXPIRES_FILENAME), repr(expires_at))
+
+    def delete(self, sid):
+        shutil.rmtree(self._session_dir(sid), ignore_errors=True)
+
+    def cleanup(self):
+        removed = 0
+        for sid in os.listdir(self.root_dir):
+            if os.path.isdir(self._session_dir(sid)) and self._expires_at(sid) is None:
+                self.delete(sid)
+                removed += 1
+        return removed
+
+def create_store(name, path):
+    """
+    Args:
+        name: 'sqlite'（path 为数据库文件）或 'file'（path 为目录）。
+    """
+    if name == 'sqlite':
+        return SQLiteSessionStore(path)
+    if name == 'file':
+        return FileSessionStore(path)
+    raise ValueError(f"Unknown session store: {name}")
+
+class ServerSideSession(SessionMixin):
+    """
+    按键延迟加载的会话。_values 中保存已读取的键（MISSING 表示确认不存在）。
+    原地修改可变值（例如列表）后需要设置 session.modified = True，届时所有已读取的键都会写回。
+    """
+
+    def __init__(self, store, serializer, sid=None):
+        self.store = store
+        self.serializer = serializer
+        self.sid = sid
+        self.new = sid is None
+        self.accessed = False
+        self.expires_at = None # 已读取的键中最早的过期时间，用于判断是否需要续期
+        self.previous_sid = None # regenerate() 之前的会话 ID，保存时删除
+        self._values = {}
+        self._dirty = set()
+        self._force_save = False
+        self._fully_loaded = sid is None
+
+    @property
+    def modified(self):
+        return self._force_save or bool(self._dirty)
+
+    @modified.setter
+    def modified(self, value):
+        self._force_save = value
+
+    def _note_expiry(self, expires_at):
+        if expires_at is not None and (self.expires_at is None or expires_at < self.expires_at):
+            self.expires_at = expires_at
+
+    def _load(self, key):
+        self.accessed = True
+        if key not in self._values and not self._fully_loaded:
+            raw, expires_at = self.store.get(self.sid, key)
+            self._note_expiry(expires_at)
+            self._values[key] = raw if raw is MISSING else self.serializer.loads(raw)
+        return self._values.get(key, MISSING)
+
+    def _load_all(self):
+        self.accessed = True
+        if self._fully_loaded:
+            return
+        raw_values, expires_at = self.store.items(self.sid)
+        self._note_expiry(expires_at)
+        for key, raw in raw_values.items():
+            if key not in self._values:
+                self._values[key] = self.serializer.loads(raw)
+        self._fully_loaded = True
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.accessed = True
+        self._values[key] = value
+        self._dirty.add(key)
+
+    def __delitem__(self, key):
+        if self._load(key) is MISSING:
+            raise KeyError(key)
+        self._values[key] = MISSING
+        self._dirty.add(key)
+
+    def __contains__(self, key):
+        return self._load(key) is not MISSING
+
+    def __iter__(self):
+        self._load_all()
+        return iter([key for key, value in self._values.items() if value is not MISSING])
+
+    def __len__(self):
+        self._load_all()
+        return sum(1 for value in self._values.values() if value is not MISSING)
+
+    def regenerate(self):
+        """
+        更换会话 ID 并保留数据（登录时调用，防止会话固定攻击）。
+        """
+        self._load_all()
+        if self.sid is not None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self._dirty.update(self._values)
+
+    def pending_changes(self):
+        """Returns: (updates {key: 序列化后的值}, deletes [key, ...])"""
+        keys = set(self._values) if self._force_save else self._dirty
+        updates = {}
+        deletes = []
+        for key in keys:
+            value = self._values.get(key, MISSING)
+            if value is MISSING:
+                deletes.append(key)
+            else:
+                updates[key] = self.serializer.dumps(value)
+        return updates, deletes
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask 会话接口：app.session_interface = ServerSideSessionInterface(store)。
+    Cookie 中只保存会话 ID（随机生成，不包含数据），过期时间由服务端存储控制。
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl_seconds=SESSION_TTL_SECONDS, cleanup_interval=SESSION_CLEANUP_INTERVAL):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = time.monotonic()
+        self._cleanup_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and not SESSION_ID_REGEX.match(sid):
+            sid = None
+        return ServerSideSession(self.store, self.serializer, sid or None)
+
+    def _maybe_cleanup(self):
+        if time.monotonic() - self._last_cleanup < self.cleanup_interval or not self._cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_cleanup = time.monotonic()
+            removed = self.store.cleanup()
+            if removed:
+                logger.info(f"已清理 {removed} 个过期会话条目")
+        except Exception as e:
+            logger.warning(f"清理过期会话失败: {e}")
+        finally:
+            self._cleanup_lock.release()
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        now = time.time()
+        updates, deletes = session.pending_changes()
+        if not updates and not deletes:
+            # 未修改：剩余有效期不足一半时续期
+            if session.sid is not None and session.expires_at is not None \
+                    and session.expires_at - now < self.ttl_seconds / 2:
+                self.store.touch(session.sid, now + self.ttl_seconds)
+            return
+
+        set_cookie = False
+        if session.sid is None or (session.expires_at is None and not self.store.exists(session.sid)):
+            if not updates:
+                return # 新会话中只有删除操作，无需保存
+            # 不沿用客户端提供的、服务端不存在的会话 ID
+            session.sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+            set_cookie = True
+        try:
+            self.store.save(session.sid, updates, deletes, now + self.ttl_seconds)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"保存会话失败: {e}")
+            return
+        self._maybe_cleanup()
+
+        if set_cookie or session.permanent:
+            response.set_cookie(
+                self.get_cookie_name(app),
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=self.get_cookie_domain(app),
+                path=self.get_cookie_path(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
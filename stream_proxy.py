@@ -0,0 +1,324 @@
+import logging
+import mimetypes
+import os
+import threading
+
+import requests
+
+import music_api_handler as api
+
+# 播放代理：播放器不再直接请求上游链接，而是由服务器拉取一次上游音频，
+# 写入与下载流程相同的断点文件（temp/partial_<key>.part），同时让任意多个播放连接
+# 从这个正在增长的文件中读取。传输完成后断点文件由下载流程直接收尾（写标签、入库），
+# 传输中断时它也会被下一次下载续传。
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_WAIT_TIMEOUT = api.AUDIO_TIMEOUT          # 等待新数据写入的最长时间（秒）
+STREAM_DIRECT_RANGE_THRESHOLD = 2 * 1024 * 1024  # Range 起点超出已缓冲位置这么多字节时，直接向上游请求该区间
+DEFAULT_MAX_TEES = 8                             # 同时进行的代理传输数量上限
+PREFETCH_HANDOFF_TIMEOUT = 5                     # 等待音频开头预取让出断点文件的最长时间（秒）
+
+logger = logging.getLogger(__name__)
+
+# 进行中的音频开头预取: partial_key -> 停止事件。播放代理需要同一个断点文件时让预取提前结束并接手已写入的部分
+_head_prefetches = {}
+_head_prefetches_guard = threading.Lock()
+
+def _stop_head_prefetch(partial_key):
+    """通知正在写 partial_key 的开头预取停止；没有这样的预取时返回 False。"""
+    with _head_prefetches_guard:
+        stop = _head_prefetches.get(partial_key)
+    if stop is None:
+        return False
+    stop.set()
+    return True
+
+def _audio_content_type(response_content_type, extension):
+    if response_content_type and response_content_type.split(';')[0].strip().lower().startswith('audio/'):
+        return response_content_type
+    return mimetypes.guess_type(f"audio{extension}")[0] or 'audio/mpeg'
+
+class TeeDownload:
+    """
+    单首歌的后台上游传输：数据写入断点文件，播放连接通过 iter_range() 从文件中读取。
+    """
+
+    def __init__(self, song_details, part_path, sidecar_path, partial_lock, on_finished, on_complete=None):
+        self.song_details = song_details
+        self.audio_url = song_details.get('url')
+        self.part_path = part_path
+        self.sidecar_path = sidecar_path
+        self.bytes_written = 0
+        self.total_length = None
+        self.content_type = None
+        self.finished = False
+        self.error = None
+        self.ready = threading.Event() # 已拿到响应头并打开断点文件，可以开始读取
+        self._cond = threading.Condition()
+        self._partial_lock = partial_lock
+        self._on_finished = on_finished
+        self._on_complete = on_complete
+
+    @property
+    def complete(self):
+        return self.finished and self.error is None
+
+    def start(self):
+        threading.Thread(target=self._run, name='stream-tee', daemon=True).start()
+
+    def _advance(self, bytes_written):
+        with self._cond:
+            self.bytes_written = bytes_written
+            self._cond.notify_all()
+
+    def _run(self):
+        response = None
+        try:
+            response, resume_from, sidecar = api._open_audio_stream(self.audio_url, self.part_path, self.sidecar_path)
+            extension = sidecar.get('extension') if resume_from else None
+            if not extension:
+                content_type = response.headers.get('Content-Type', '') if response is not None else ''
+                extension = api._guess_audio_extension(self.audio_url, content_type)
+            self.content_type = _audio_content_type(
+                response.headers.get('Content-Type') if response is not None else None, extension)
+
+            # 下载流程写入的断点文件开头可能带有 ID3 标签，对播放器来说它是文件的一部分
+            # 下载流程可能已把上游自带的标签换成自己生成的标签，文件位置与上游位置相差 file_offset
+            header_length = (sidecar.get('header_length') or 0) if resume_from else 0
+            skipped_length = (sidecar.get('skipped_length') or 0) if resume_from else 0
+            if response is None:
+                # 断点文件已完整，直接从文件提供
+                self.total_length = header_length - skipped_length + resume_from
+                self._advance(self.total_length)
+            else:
+                self._transfer(response, resume_from, extension, header_length, skipped_length)
+        except requests.exceptions.RequestException as e:
+            self.error = e
+            logger.error(f"播放代理请求上游失败: {e}")
+            api._keep_partial_for_resume(self.part_path, self.sidecar_path)
+        except Exception as e:
+            self.error = e
+            logger.error(f"播放代理传输时发生未知错误: {e}")
+            api._keep_partial_for_resume(self.part_path, self.sidecar_path)
+        finally:
+            if response is not None:
+                response.close()
+            self._partial_lock.release()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            self.ready.set()
+            self._on_finished(self)
+
+        if self.error is None and self._on_complete is not None:
+            try:
+                self._on_complete()
+            except Exception as e:
+                logger.warning(f"播放代理完成回调失败: {e}")
+
+    def _transfer(self, response, resume_from, extension, header_length, skipped_length=0):
+        file_offset = header_length - skipped_length
+        audio_total = api._response_total_length(response, resume_from)
+        self.total_length = file_offset + audio_total if audio_total is not None else None
+        bytes_written = file_offset + resume_from
+        sidecar = api._new_partial_sidecar(self.audio_url, response, audio_total, extension, bytes_written,
+                                           header_length, skipped_length)
+        api._write_partial_sidecar(self.sidecar_path, sidecar)
+        last_sidecar_bytes = bytes_written
+        with open(self.part_path, 'ab' if resume_from else 'wb') as f:
+            self._advance(bytes_written)
+            self.ready.set()
+            logger.info(f"播放代理开始传输 (从 {resume_from} 字节): {self.audio_url}")
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                f.write(chunk)
+                f.flush()
+                bytes_written += len(chunk)
+                self._advance(bytes_written)
+                if bytes_written - last_sidecar_bytes >= api.PARTIAL_SIDECAR_UPDATE_BYTES:
+                    sidecar['bytes_written'] = bytes_written
+                    api._write_partial_sidecar(self.sidecar_path, sidecar)
+                    last_sidecar_bytes = bytes_written
+        if self.total_length is not None and bytes_written < self.total_length:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"连接提前关闭: 已接收 {bytes_written}/{self.total_length} 字节")
+        # 长度未知的响应以实际写入的字节数为准，下载流程据此判断断点文件已完整
+        self.total_length = bytes_written
+        sidecar.update({'total_length': bytes_written - file_offset, 'bytes_written': bytes_written})
+        api._write_partial_sidecar(self.sidecar_path, sidecar)
+        logger.info(f"播放代理传输完成 ({bytes_written} 字节): {self.part_path}")
+
+    def iter_range(self, start=0, stop=None):
+        """
+        从断点文件读取 [start, stop) 区间，数据尚未写入时等待传输线程。
+        传输失败或等待超时时提前结束。
+        """
+        pos = start
+        with open(self.part_path, 'rb') as f:
+            f.seek(start)
+            while stop is None or pos < stop:
+                with self._cond:
+                    while self.bytes_written <= pos and not self.finished:
+                        if not self._cond.wait(STREAM_WAIT_TIMEOUT):
+                            logger.warning(f"播放代理等待数据超时: {self.part_path}")
+                            return
+                    available = self.bytes_written
+                if available <= pos:
+                    return
+                limit = available if stop is None else min(available, stop)
+                data = f.read(min(STREAM_CHUNK_SIZE, limit - pos))
+                if not data:
+                    return
+                pos += len(data)
+                yield data
+
+class StreamProxy:
+    """
+    管理进行中的 TeeDownload：同一首歌只有一个上游传输，多个播放连接共享。
+    """
+
+    def __init__(self, app_static_folder, max_tees=DEFAULT_MAX_TEES):
+        self.app_static_folder = app_static_folder
+        self.max_tees = max_tees
+        self._tees = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.reused = 0
+        self.rejected = 0
+
+    def get_tee(self, song_details, on_complete=None):
+        """
+        返回该歌曲进行中的传输，或启动一个新的传输。
+        达到并发上限、或断点文件正被下载任务写入时返回 None（调用方应直接代理上游）。
+        Args:
+            on_complete: 新启动的传输完整结束后调用的无参回调。
+        """
+        partial_key, part_path, sidecar_path = api.partial_download_paths(song_details, self.app_static_folder)
+        with self._lock:
+            tee = self._tees.get(partial_key)
+            if tee is not None:
+                self.reused += 1
+                return tee
+            if len(self._tees) >= self.max_tees:
+                self.rejected += 1
+                return None
+            partial_lock = api._acquire_partial_lock(partial_key)
+            if partial_lock is None and not _stop_head_prefetch(partial_key):
+                self.rejected += 1
+                return None
+        if partial_lock is None:
+            # 下一首预取正在写这个断点文件：它在当前数据块后停止，之后从它写到的位置继续
+            partial_lock = api._acquire_partial_lock(partial_key, timeout=PREFETCH_HANDOFF_TIMEOUT)
+        with self._lock:
+            tee = self._tees.get(partial_key)
+            if tee is not None or partial_lock is None:
+                # 等待期间另一个请求已接手
+                if partial_lock is not None:
+                    partial_lock.release()
+                if tee is not None:
+                    self.reused += 1
+                else:
+                    self.rejected += 1
+                return tee
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            tee = TeeDownload(song_details, part_path, sidecar_path, partial_lock,
+                              on_finished=lambda t, k=partial_key: self._forget(k, t),
+                              on_complete=on_complete)
+            self._tees[partial_key] = tee
+            self.started += 1
+        tee.start()
+        return tee
+
+    def _forget(self, partial_key, tee):
+        with self._lock:
+            if self._tees.get(partial_key) is tee:
+                del self._tees[partial_key]
+
+    def stats(self):
+        with self._lock:
+            return {'active': len(self._tees), 'max_tees': self.max_tees,
+                    'started': self.started, 'reused': self.reused, 'rejected': self.rejected}
+
+def prefetch_head(song_details, app_static_folder, max_bytes, cancelled=None):
+    """
+    把歌曲音频的前 max_bytes 字节写入断点文件（与下载流程、播放代理共用），
+    之后播放时 TeeDownload 先从本地提供这部分数据，其余部分断点续传。
+    已有断点文件、断点文件正被写入或上游不支持 Range 时跳过；播放代理需要这个断点文件时提前停止，由它接手。
+    Args:
+        cancelled: 无参函数，返回 True 时停止写入（已写入的部分保留）。
+    Returns: 写入的字节数。
+    """
+    audio_url = song_details.get('url')
+    partial_key, part_path, sidecar_path = api.partial_download_paths(song_details, app_static_folder)
+    if not audio_url or max_bytes <= 0 or os.path.exists(part_path):
+        return 0
+    stop = threading.Event()
+    # 取锁与登记停止事件在同一临界区内完成：get_tee 取锁失败时总能找到这个预取并通知它停止
+    with _head_prefetches_guard:
+        partial_lock = api._acquire_partial_lock(partial_key)
+        if partial_lock is None:
+            return 0
+        _head_prefetches[partial_key] = stop
+    response = None
+    try:
+        response = api.get_http_session().get(audio_url, stream=True, timeout=api.AUDIO_TIMEOUT,
+                                              headers={'Range': f"bytes=0-{max_bytes - 1}"})
+        start, total = api._parse_content_range(response.headers.get('Content-Range'))
+        if response.status_code != 206 or start != 0 or total is None:
+            return 0 # 不支持 Range 时不预取，避免下载整首歌
+        extension = api._guess_audio_extension(audio_url, response.headers.get('Content-Type', ''))
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        sidecar = api._new_partial_sidecar(audio_url, response, total, extension, 0)
+        api._write_partial_sidecar(sidecar_path, sidecar)
+        bytes_written = 0
+        with open(part_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                if stop.is_set() or (cancelled is not None and cancelled()):
+                    break
+                f.write(chunk)
+                bytes_written += len(chunk)
+        if not bytes_written:
+            api._remove_partial(part_path, sidecar_path)
+            return 0
+        sidecar['bytes_written'] = bytes_written
+        api._write_partial_sidecar(sidecar_path, sidecar)
+        logger.info(f"已预取音频开头 {bytes_written} 字节: {part_path}")
+        return bytes_written
+    except (requests.exceptions.RequestException, OSError) as e:
+        logger.warning(f"预取音频失败: {e}")
+        api._keep_partial_for_resume(part_path, sidecar_path)
+        return 0
+    finally:
+        if response is not None:
+            response.close()
+        with _head_prefetches_guard:
+            _head_prefetches.pop(partial_key, None)
+            partial_lock.release()
+
+def open_upstream(audio_url, range_header=None):
+    """
+    直接向上游发起（可带 Range 的）流式请求，不写入本地。
+    Returns: requests.Response（调用方负责关闭）or None if error.
+    """
+    headers = {'Range': range_header} if range_header else {}
+    try:
+        response = api.get_http_session().get(audio_url, stream=True, timeout=api.AUDIO_TIMEOUT, headers=headers)
+        if response.status_code >= 400:
+            logger.error(f"上游音频请求失败: HTTP {response.status_code} ({audio_url})")
+            response.close()
+            return None
+        return response
+    except requests.exceptions.RequestException as e:
+        logger.error(f"上游音频请求失败: {e}")
+        return None
+
+def iter_upstream(response):
+    """
+    逐块读取上游响应，结束（或客户端断开）时释放连接。
+    """
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            yield chunk
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"代理上游音频时连接中断: {e}")
+    finally:
+        response.close()
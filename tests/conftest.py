@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+# MySQL 后端测试使用的库名（测试前后会删除其中所有的表）；未设置时只在 SQLite 上运行
+TEST_MYSQL_DATABASE = os.environ.get('MUSIC_TEST_MYSQL_DATABASE')
+
+def _drop_mysql_tables(config):
+    import mysql.connector
+    conn = mysql.connector.connect(**config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        cursor.execute("SHOW TABLES")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"DROP TABLE `{table}`")
+    finally:
+        conn.close()
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """使用临时 SQLite 文件作为存储后端并建表。"""
+    database.configure_backend('sqlite', sqlite_path=str(tmp_path / 'music.db'))
+    database.init_db()
+    yield database
+    database.close_pool()
+
+@pytest.fixture
+def mysql_db():
+    """使用 MUSIC_TEST_MYSQL_DATABASE 指定的 MySQL 测试库作为存储后端并建表。"""
+    if not TEST_MYSQL_DATABASE:
+        pytest.skip('未设置 MUSIC_TEST_MYSQL_DATABASE')
+    pytest.importorskip('mysql.connector')
+    config = dict(database.MYSQL_CONFIG, database=TEST_MYSQL_DATABASE)
+    _drop_mysql_tables(config)
+    database.configure_backend('mysql', mysql_config=config)
+    database.init_db()
+    yield database
+    database.close_pool()
+    _drop_mysql_tables(config)
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def db(request):
+    """在两种存储后端上各运行一次。"""
+    return request.getfixturevalue(f"{request.param}_db")
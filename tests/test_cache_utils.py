@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+import cache_utils
+from cache_utils import MISSING, SingleFlight, SingleFlightTimeout, TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_utils.time, 'monotonic', clock)
+    return clock
+
+def test_get_returns_missing_for_unknown_key():
+    cache = TTLCache(max_entries=2)
+    assert cache.get('a') is MISSING
+    assert cache.get('a', None) is None
+    cache.set('none', None)
+    assert cache.get('none') is None
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1 # a 变为最近使用
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(max_entries=4, ttl_seconds=10)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl_seconds=30)
+    clock.now += 9.9
+    assert cache.get('a') == 1
+    clock.now += 0.1
+    assert cache.get('a') is MISSING
+    assert len(cache) == 1 # 过期条目在读取时删除
+    assert cache.get('b') == 2
+
+def test_shrinking_capacity_evicts_oldest():
+    cache = TTLCache(max_entries=3)
+    for key in 'abc':
+        cache.set(key, key)
+    cache.configure(max_entries=1)
+    assert len(cache) == 1 and cache.get('c') == 'c'
+
+def test_invalidate_and_stats():
+    cache = TTLCache(max_entries=4)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.invalidate('a') == 1
+    assert cache.invalidate('a') == 0
+    cache.get('b')
+    cache.get('a')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+    assert cache.invalidate() == 1 and len(cache) == 0
+
+def run_concurrently(flight, key, fn, waiters):
+    """leader 执行 fn 期间再发起 waiters 个同 key 调用，返回全部结果（异常以对象形式返回）。"""
+    results = []
+    results_lock = threading.Lock()
+
+    def call():
+        try:
+            value = flight.do(key, fn)
+        except Exception as e:
+            value = e
+        with results_lock:
+            results.append(value)
+
+    threads = [threading.Thread(target=call) for _ in range(waiters + 1)]
+    threads[0].start()
+    while flight.stats()['in_flight'] == 0:
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    while flight.stats()['coalesced'] < waiters:
+        time.sleep(0.001)
+    return threads, results
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight(wait_timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'songs': [1, 2]}
+
+    threads, results = run_concurrently(flight, 'q', fetch, waiters=4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 5 and all(result == {'songs': [1, 2]} for result in results)
+    assert flight.stats() == {'name': 'single_flight', 'executed': 1, 'coalesced': 4,
+                              'in_flight': 0, 'wait_timeout': 5}
+
+def test_leader_error_is_raised_in_every_waiter():
+    flight = SingleFlight(wait_timeout=5)
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise ConnectionError('upstream down')
+
+    threads, results = run_concurrently(flight, 'q', fetch, waiters=3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4
+    assert all(isinstance(result, ConnectionError) and str(result) == 'upstream down' for result in results)
+    # 失败的调用不会被缓存，下一次调用重新执行
+    assert flight.do('q', lambda: 'ok') == 'ok'
+
+def test_waiter_times_out_without_blocking_the_leader():
+    flight = SingleFlight(wait_timeout=0.05)
+    release = threading.Event()
+    threads, results = run_concurrently(flight, 'q', lambda: release.wait(5) and 'late', waiters=1)
+    threads[1].join()
+    assert isinstance(results[0], SingleFlightTimeout)
+    release.set()
+    threads[0].join()
+    assert results[1] == 'late'
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight(wait_timeout=5)
+    release = threading.Event()
+    thread = threading.Thread(target=flight.do, args=('a', release.wait, 5))
+    thread.start()
+    while flight.stats()['in_flight'] == 0:
+        time.sleep(0.001)
+    assert flight.do('b', lambda: 'b') == 'b'
+    release.set()
+    thread.join()
+    assert flight.stats()['coalesced'] == 0
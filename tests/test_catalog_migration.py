@@ -0,0 +1,109 @@
+import sqlite3
+
+import database
+
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL COLLATE NOCASE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE playlists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE playlist_songs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist_id INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+    song_api_index TEXT NOT NULL COLLATE NOCASE,
+    song_query TEXT NOT NULL COLLATE NOCASE,
+    title TEXT NOT NULL,
+    singer TEXT,
+    cover TEXT,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT unique_song_in_playlist UNIQUE (playlist_id, song_api_index, song_query)
+);
+INSERT INTO users (id, username) VALUES (1, 'alice');
+INSERT INTO playlists (id, user_id, name) VALUES (1, 1, 'a'), (2, 1, 'b');
+INSERT INTO playlist_songs (id, playlist_id, song_api_index, song_query, title, singer, cover, added_at) VALUES
+    (10, 1, '1', 'q', 'Old Title', 'Singer', 'http://c/1.jpg', '2024-01-01 10:00:00'),
+    (11, 1, '2', 'q', 'Second', 'Singer', '', '2024-01-01 10:00:01'),
+    (12, 2, '1', 'q', 'New Title', 'Singer', 'http://c/1b.jpg', '2024-01-02 09:00:00');
+"""
+
+def legacy_database(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+    database.configure_backend('sqlite', sqlite_path=path)
+    return path
+
+def test_migration_builds_catalog_and_keeps_rows(tmp_path):
+    path = legacy_database(tmp_path)
+    database.init_db()
+    try:
+        first = database.get_songs_in_playlist(1)
+        second = database.get_songs_in_playlist(2)
+        assert [(song['id'], song['title']) for song in first] == [(11, 'Second'), (10, 'New Title')]
+        assert [(song['id'], song['title'], song['cover']) for song in second] == [(12, 'New Title', 'http://c/1b.jpg')]
+        assert first[1]['added_at'].strftime('%Y-%m-%d %H:%M:%S') == '2024-01-01 10:00:00'
+    finally:
+        database.close_pool()
+
+    conn = sqlite3.connect(path)
+    try:
+        # 同一首歌在目录中只有一行，采用最近一次添加时的元数据
+        assert conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0] == 2
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(playlist_songs)")]
+        assert 'song_query' not in columns and 'song_id' in columns
+        legacy = database.LEGACY_PLAYLIST_SONGS_TABLE
+        assert conn.execute(f"SELECT COUNT(*) FROM {legacy}").fetchone()[0] == 3
+    finally:
+        conn.close()
+
+def test_migration_runs_once(tmp_path):
+    legacy_database(tmp_path)
+    database.init_db()
+    database.init_db()
+    try:
+        assert len(database.get_songs_in_playlist(1)) == 2
+        # 迁移后的表可以继续写入，已有的歌曲不会重复添加
+        song = {'song_api_index': '1', 'song_query': 'q', 'title': 'New Title', 'singer': 'Singer', 'cover': ''}
+        assert database.add_songs_to_playlist(2, [song]) == [False]
+    finally:
+        database.close_pool()
+
+def test_song_key_is_stable_and_distinct():
+    assert database.song_key('q', 1) == database.song_key('q', '1')
+    assert database.song_key('q', 1) != database.song_key('q', 2)
+    assert len(database.song_key('q', 1)) == 16
+
+def test_rows_collapsing_onto_one_song_are_reported(tmp_path, caplog):
+    path = legacy_database(tmp_path)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        INSERT INTO playlist_songs (id, playlist_id, song_api_index, song_query, title, singer, cover, added_at) VALUES
+            (13, 1, '1', ' Q ', 'Spaced', 'Singer', '', '2024-01-03 09:00:00'),
+            (14, 2, '2', 'q  ', 'Other', 'Singer', '', '2024-01-03 09:00:01');
+    """)
+    conn.close()
+    with caplog.at_level('WARNING', logger=database.logger.name):
+        database.init_db()
+    try:
+        # 歌单 1 中 id 10 和 13 是同一首歌，只保留最近添加的 13
+        assert sorted(song['id'] for song in database.get_songs_in_playlist(1)) == [11, 13]
+        assert sorted(song['id'] for song in database.get_songs_in_playlist(2)) == [12, 14]
+    finally:
+        database.close_pool()
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == 'WARNING']
+    assert len(warnings) == 1 and warnings[0].startswith('1 legacy playlist songs') and 'Legacy ids: [10]' in warnings[0]
+
+    conn = sqlite3.connect(path)
+    try:
+        legacy = database.LEGACY_PLAYLIST_SONGS_TABLE
+        assert conn.execute(f"SELECT COUNT(*) FROM {legacy} WHERE id = 10").fetchone()[0] == 1
+    finally:
+        conn.close()
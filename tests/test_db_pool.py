@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    return ConnectionPool(connect, **kwargs), created
+
+def test_reuses_idle_connection():
+    pool, created = make_pool(size=2, max_overflow=0)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(created) == 1
+    assert pool.stats()['idle'] == 1
+
+def test_overflow_connections_are_closed_on_checkin():
+    pool, created = make_pool(size=1, max_overflow=1)
+    a = pool.checkout()
+    b = pool.checkout()
+    pool.checkin(a)
+    pool.checkin(b)
+    assert len(created) == 2
+    assert pool.stats()['total'] == 1
+    assert sum(conn.closed for conn in created) == 1
+
+def test_checkout_times_out_when_exhausted():
+    pool, _ = make_pool(size=1, max_overflow=0, timeout=0.05)
+    held = pool.checkout()
+    with pytest.raises(PoolTimeout):
+        pool.checkout()
+    assert pool.stats()['timeouts'] == 1
+    pool.checkin(held)
+
+def test_waiter_gets_connection_released_by_other_thread():
+    pool, created = make_pool(size=1, max_overflow=0, timeout=5)
+    held = pool.checkout()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pool.checkout()))
+    waiter.start()
+    pool.checkin(held)
+    waiter.join(5)
+    assert result and result[0].conn is created[0]
+    assert pool.stats()['waits'] >= 1
+
+def test_failed_ping_discards_connection():
+    def ping(conn):
+        raise OSError('gone')
+
+    pool, created = make_pool(size=1, max_overflow=0, pre_ping_seconds=0, ping=ping)
+    pool.checkin(pool.checkout())
+    pool.checkin(pool.checkout())
+    assert len(created) == 2
+    assert created[0].closed
+    assert pool.stats()['ping_failures'] == 1
+
+def test_reset_failure_discards_connection():
+    def reset(conn):
+        raise RuntimeError('rollback failed')
+
+    pool, created = make_pool(size=1, max_overflow=0, reset=reset)
+    pool.checkin(pool.checkout())
+    assert created[0].closed
+    assert pool.stats()['total'] == 0
+
+def test_discard_flag_closes_connection():
+    pool, created = make_pool(size=2, max_overflow=0)
+    pool.checkin(pool.checkout(), discard=True)
+    assert created[0].closed
+    assert pool.stats()['total'] == 0
+
+def test_request_scope_shares_one_connection(sqlite_db):
+    sqlite_db.begin_request_scope()
+    try:
+        sqlite_db.create_user('alice')
+        sqlite_db.get_user_by_username('alice')
+        assert sqlite_db.get_pool_stats()['checked_out'] == 1
+        with sqlite_db.released_request_connection():
+            assert sqlite_db.get_pool_stats()['checked_out'] == 0
+            assert sqlite_db.get_user_by_username('alice')['username'] == 'alice'
+        sqlite_db.get_user_by_username('alice')
+        assert sqlite_db.get_pool_stats()['checked_out'] == 1
+    finally:
+        stats = sqlite_db.end_request_scope()
+    assert stats['checkouts'] == 2
+    assert sqlite_db.get_pool_stats()['checked_out'] == 0
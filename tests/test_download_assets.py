@@ -0,0 +1,103 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from mutagen.id3 import ID3
+
+import music_api_handler as api
+
+FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+AUDIO = FRAME * 200
+COVER = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+WAIT_SECONDS = 5
+
+class AssetServer:
+    """
+    提供音频和封面的本地 HTTP 服务。封面请求会等到音频请求到达后才响应，
+    如果封面是在音频开始下载之前串行获取的，cover_waited_for_audio 为 False。
+    """
+
+    def __init__(self):
+        self.audio_requested = threading.Event()
+        self.cover_waited_for_audio = None
+        self.cover_status = 200
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith('/cover'):
+                    server.cover_waited_for_audio = server.audio_requested.wait(WAIT_SECONDS)
+                    body, content_type = COVER, 'image/png'
+                    self.send_response(server.cover_status)
+                else:
+                    server.audio_requested.set()
+                    body, content_type = AUDIO, 'audio/mpeg'
+                    self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server():
+    api.configure_http_client(retry_total=0)
+    server = AssetServer()
+    yield server
+    server.close()
+
+def song_details(server):
+    return {'title': 'Title', 'singer': 'Singer', 'url': server.url('/song.mp3'), 'cover': server.url('/cover.png'),
+            'lyric': '[00:01.00]第一行\n[00:02.00]第二行'}
+
+def test_cover_and_frames_are_prepared_during_the_audio_transfer(server, tmp_path):
+    path, ok, _ = api.download_song_assets_for_web(song_details(server), str(tmp_path))[:3]
+    assert ok and path == 'downloads/Title - Singer.mp3'
+    assert server.cover_waited_for_audio is True
+
+    tags = ID3(os.path.join(str(tmp_path), path))
+    assert tags['TIT2'].text == ['Title']
+    assert tags.getall('SYLT')[0].text == [('第一行', 1000), ('第二行', 2000)]
+    apic = tags.getall('APIC')[0]
+    assert (apic.mime, apic.data) == ('image/png', COVER)
+    assert os.listdir(os.path.join(str(tmp_path), 'temp')) == []
+
+def test_failed_cover_still_tags_the_audio(server, tmp_path):
+    server.cover_status = 404
+    path, ok, _ = api.download_song_assets_for_web(song_details(server), str(tmp_path))[:3]
+    assert ok
+    tags = ID3(os.path.join(str(tmp_path), path))
+    assert tags['TPE1'].text == ['Singer']
+    assert tags.getall('APIC') == []
+
+def test_existing_file_is_found_before_any_request(server, tmp_path):
+    downloads = tmp_path / 'downloads'
+    downloads.mkdir()
+    (downloads / 'Title - Singer.mp3').write_bytes(AUDIO)
+    path, ok, message = api.download_song_assets_for_web(song_details(server), str(tmp_path))[:3]
+    assert ok and path == 'downloads/Title - Singer.mp3'
+    assert '已存在' in message
+    assert not server.audio_requested.is_set() and server.cover_waited_for_audio is None
+
+def test_url_without_extension_probes_known_extensions(server, tmp_path):
+    downloads = tmp_path / 'downloads'
+    downloads.mkdir()
+    (downloads / 'Title - Singer.m4a').write_bytes(b'm4a')
+    details = dict(song_details(server), url=server.url('/stream?id=1'))
+    path, ok, _ = api.download_song_assets_for_web(details, str(tmp_path))[:3]
+    assert ok and path == 'downloads/Title - Singer.m4a'
+    assert not server.audio_requested.is_set()
@@ -0,0 +1,124 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from history_buffer import HistoryWriter
+
+def song(index, query='q'):
+    return {'song_api_index': index, 'song_query': query, 'title': f"Song {index}", 'singer': 'Singer', 'cover': ''}
+
+class FakeSink:
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def __call__(self, entries):
+        if self.fail:
+            return None
+        self.batches.append(list(entries))
+        return len(entries)
+
+@pytest.fixture
+def sink():
+    return FakeSink()
+
+@pytest.fixture
+def writer(sink):
+    # flush_interval 足够长，写入只在测试中显式触发
+    writer = HistoryWriter(sink, flush_size=1000, flush_interval=3600)
+    yield writer
+    writer.close(timeout=1)
+
+def test_records_are_written_in_one_batch(writer, sink):
+    for i in range(3):
+        assert writer.record(1, song(i))
+    assert sink.batches == []
+    assert writer.flush() == 3
+    assert [entry[1]['song_api_index'] for entry in sink.batches[0]] == [0, 1, 2]
+    assert writer.pending(1) == []
+
+def test_repeated_play_is_deduplicated(writer):
+    assert writer.record(1, song(1))
+    assert not writer.record(1, song(1))
+    assert writer.record(2, song(1)) # 其它用户不受影响
+    assert writer.record(1, song(2))
+    assert writer.stats()['deduped'] == 1
+
+def test_pending_is_newest_first_and_per_user(writer):
+    writer.record(1, song(1))
+    writer.record(2, song(5))
+    writer.record(1, song(2))
+    assert [entry[0]['song_api_index'] for entry in writer.pending(1)] == [2, 1]
+
+def test_failed_write_is_retried(writer, sink):
+    writer.record(1, song(1))
+    sink.fail = True
+    assert writer.flush() == 0
+    assert len(writer.pending(1)) == 1
+    sink.fail = False
+    assert writer.flush() == 1
+    assert writer.stats()['failures'] == 1
+
+def test_inflight_batch_stays_visible_until_written(sink):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_sink(entries):
+        started.set()
+        release.wait(5)
+        return sink(entries)
+
+    writer = HistoryWriter(slow_sink, flush_size=1000, flush_interval=3600)
+    try:
+        writer.record(1, song(1))
+        flusher = threading.Thread(target=writer.flush)
+        flusher.start()
+        assert started.wait(5)
+        assert len(writer.pending(1)) == 1
+        release.set()
+        flusher.join(5)
+        assert writer.pending(1) == []
+    finally:
+        release.set()
+        writer.close(timeout=1)
+
+def test_discard_drops_unwritten_records(writer, sink):
+    writer.record(1, song(1))
+    writer.record(2, song(2))
+    assert writer.discard(1) == 1
+    writer.flush()
+    assert [entry[0] for entry in sink.batches[0]] == [2]
+
+def test_close_flushes_remaining_records(sink):
+    writer = HistoryWriter(sink, flush_size=1000, flush_interval=3600)
+    writer.record(1, song(1))
+    writer.close(timeout=1)
+    assert len(sink.batches) == 1
+    assert not writer.record(1, song(2))
+
+def test_buffer_limit_drops_oldest(sink):
+    writer = HistoryWriter(sink, flush_size=1000, flush_interval=3600, max_buffer=2)
+    try:
+        for i in range(3):
+            writer.record(1, song(i))
+        assert [entry[0]['song_api_index'] for entry in writer.pending(1)] == [2, 1]
+        assert writer.stats()['dropped'] == 1
+    finally:
+        writer.close(timeout=1)
+
+def test_writes_to_database_page_by_page(sqlite_db):
+    user = sqlite_db.create_user('alice')
+    writer = HistoryWriter(sqlite_db.add_play_history_entries, flush_size=1000, flush_interval=3600)
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    try:
+        for i in range(5):
+            writer.record(user['id'], song(i), played_at=base + timedelta(minutes=i))
+        assert writer.flush() == 5
+    finally:
+        writer.close(timeout=1)
+    entries, next_cursor = sqlite_db.get_play_history_page(user['id'], limit=3)
+    assert [entry['title'] for entry in entries] == ['Song 4', 'Song 3', 'Song 2']
+    entries, next_cursor = sqlite_db.get_play_history_page(user['id'], limit=3,
+                                                           after=sqlite_db.decode_song_cursor(next_cursor))
+    assert [entry['title'] for entry in entries] == ['Song 1', 'Song 0']
+    assert next_cursor is None
@@ -0,0 +1,46 @@
+from mutagen.id3 import ID3
+from mutagen.mp3 import MP3
+
+import music_api_handler as api
+
+FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+AUDIO = FRAME * 100
+COVER = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+DETAILS = {'title': 'Title [酷我]', 'singer': 'Singer', 'lyric': '[00:01.00]第一行\n[00:02.50]第二行'}
+
+def write_tagged(tmp_path, tag):
+    path = tmp_path / 'song.mp3'
+    path.write_bytes(tag + AUDIO)
+    return str(path)
+
+def test_rendered_tag_is_read_back_by_mutagen(tmp_path):
+    tag = api.render_id3_tag(DETAILS, COVER, 'image/png')
+    # 标签头声明的长度（syncsafe 整数）加 10 字节头部等于整个标签，音频紧随其后
+    size = 10 + sum((byte & 0x7f) << (7 * (3 - i)) for i, byte in enumerate(tag[6:10]))
+    assert tag[:5] == b'ID3\x03\x00' and size == len(tag)
+
+    path = write_tagged(tmp_path, tag)
+    tags = ID3(path)
+    assert tags.version == (2, 3, 0)
+    assert tags['TIT2'].text == ['Title']
+    assert tags['TPE1'].text == ['Singer']
+    assert tags.getall('SYLT')[0].text == [('第一行', 1000), ('第二行', 2500)]
+    apic = tags.getall('APIC')[0]
+    assert (apic.mime, apic.type, apic.data) == ('image/png', 3, COVER)
+    assert MP3(path).info.sample_rate == 44100
+    with open(path, 'rb') as f:
+        assert f.read()[len(tag):] == AUDIO
+
+def test_untimed_lyrics_fall_back_to_uslt(tmp_path):
+    tag = api.render_id3_tag({'title': 'T', 'singer': 'S', 'lyric': '纯文本歌词'})
+    tags = ID3(write_tagged(tmp_path, tag))
+    assert tags.getall('SYLT') == []
+    assert tags.getall('USLT')[0].text == '纯文本歌词'
+    assert tags.getall('APIC') == []
+
+def test_prepared_frames_get_the_cover_added(tmp_path):
+    frames = api.build_id3_frames(DETAILS)
+    tag = api.render_id3_tag(DETAILS, COVER, 'image/png', frames=frames)
+    tags = ID3(write_tagged(tmp_path, tag))
+    assert len(tags.getall('APIC')) == 1
+    assert tags['TIT2'].text == ['Title']
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import async_music_api
+import download_jobs
+import playlist_import
+
+def make_entries(count):
+    songs = [{'query': 'q', 'index': i, 'title': f"Song {i}", 'singer': 'Singer'} for i in range(1, count + 1)]
+    return playlist_import.parse_import(json.dumps(songs + [{'cover': 'x.jpg'}]), 'json')
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = download_jobs.DownloadJobManager(str(tmp_path), max_pending_imports=1)
+    yield manager
+    manager.shutdown()
+
+def test_import_runs_in_the_background_and_reports_the_result(manager):
+    inserted = []
+
+    def insert_songs(playlist_id, songs):
+        inserted.append((playlist_id, [song['title'] for song in songs]))
+        return [True, False]
+
+    job = manager.submit_import(7, 1, make_entries(2), insert_songs, fmt='json')
+    assert manager.get_import(job.id) is job
+    assert job.wait(5)
+    assert job.state == download_jobs.JOB_DONE
+    assert inserted == [(7, ['Song 1', 'Song 2'])]
+    result = job.to_dict()
+    assert (result['rows_done'], result['rows_total'], result['progress']) == (3, 3, 1.0)
+    assert result['summary'] == {'added': 1, 'duplicate': 1, 'not_found': 0, 'invalid': 1, 'error': 0, 'total': 3}
+    assert [row['status'] for row in result['rows']] == ['added', 'duplicate', 'invalid']
+
+def test_pending_imports_are_bounded(manager):
+    release = threading.Event()
+
+    def insert_songs(playlist_id, songs):
+        release.wait(5)
+        return [True] * len(songs)
+
+    first = manager.submit_import(1, 1, make_entries(1), insert_songs)
+    with pytest.raises(download_jobs.JobQueueFull):
+        manager.submit_import(1, 1, make_entries(1), insert_songs)
+    release.set()
+    assert first.wait(5) and first.state == download_jobs.JOB_DONE
+    assert manager.submit_import(1, 1, make_entries(1), insert_songs).wait(5)
+
+def test_failed_import_is_reported(manager):
+    def insert_songs(playlist_id, songs):
+        raise RuntimeError('boom')
+
+    job = manager.submit_import(1, 1, make_entries(1), insert_songs)
+    assert job.wait(5)
+    assert job.state == download_jobs.JOB_FAILED and 'boom' in job.message
+
+def test_row_limit():
+    rows = [{'query': 'q'}] * (playlist_import.IMPORT_MAX_ROWS + 1)
+    with pytest.raises(playlist_import.ImportFormatError):
+        playlist_import.parse_import(json.dumps(rows), 'json')
+
+def test_entries_are_resolved_concurrently_through_the_async_api(monkeypatch):
+    running = peak = 0
+
+    async def search_music(query):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return [{'index': 1, 'title': 'Other', 'singer': 'X'}, {'index': 2, 'title': query, 'singer': 'Singer'}]
+
+    async def get_song_details(query, index):
+        return None if query == 'missing' else {'title': query, 'singer': 'Singer', 'cover': None}
+
+    monkeypatch.setattr(async_music_api, 'search_music', search_music)
+    monkeypatch.setattr(async_music_api, 'get_song_details', get_song_details)
+    entries = playlist_import.parse_import(json.dumps([{'title': f"Song {i}"} for i in range(6)] + ['missing']), 'json')
+    progress = []
+    resolved = playlist_import.resolve_entries(entries, max_workers=3, progress_callback=lambda done, total: progress.append((done, total)))
+
+    assert peak == 3
+    assert progress[-1] == (7, 7) and len(progress) == 7
+    assert [song['song_api_index'] for song, _, _ in resolved[:6]] == ['2'] * 6
+    assert [song['song_query'] for song, _, _ in resolved[:6]] == [f"Song {i}" for i in range(6)]
+    assert resolved[6] == (None, playlist_import.ROW_NOT_FOUND, '无法获取歌曲详情')
@@ -0,0 +1,51 @@
+from lyrics import LyricIndex
+
+LRC = """[ti:标题]
+[ar:歌手]
+[00:01.00]第一行
+[00:02.50]第二行
+[00:04]第三行
+"""
+
+def test_parse_reads_times_and_skips_meta_lines():
+    index = LyricIndex.parse(LRC)
+    assert list(index.times) == [1000, 2500, 4000]
+    assert index.texts == ('第一行', '第二行', '第三行')
+    assert index.to_sylt() == [('第一行', 1000), ('第二行', 2500), ('第三行', 4000)]
+
+def test_line_at_boundaries():
+    index = LyricIndex.parse(LRC)
+    assert index.line_at(0) == -1
+    assert index.line_at(999) == -1
+    assert index.text_at(999) is None
+    assert index.line_at(1000) == 0 # 恰好到达时间戳时切换到该行
+    assert index.line_at(2499) == 0
+    assert index.line_at(2500) == 1
+    assert index.line_at(10 ** 9) == 2
+
+def test_duplicate_timestamps():
+    index = LyricIndex.parse("[00:03.00]副歌\n[00:01.00][00:05.00]重复行\n[00:05.00]同时出现\n")
+    assert index.lines() == [
+        {'time_ms': 1000, 'text': '重复行'},
+        {'time_ms': 3000, 'text': '副歌'},
+        {'time_ms': 5000, 'text': '重复行'},
+        {'time_ms': 5000, 'text': '同时出现'},
+    ]
+    # 同一时间戳有多行时高亮原文中最后出现的一行
+    assert index.line_at(4999) == 1
+    assert index.line_at(5000) == 3
+    assert index.text_at(5000) == '同时出现'
+
+def test_fraction_digits_and_offset():
+    index = LyricIndex.parse("[offset:500]\n[00:01.5]a\n[00:01.05]b\n[00:01.005]c\n[00:00.20]d\n")
+    assert index.offset_ms == 500
+    # 1/2/3 位小数分别是 1/10、1/100、1/1000 秒；正 offset 让歌词提前，且不小于 0
+    assert list(index.times) == [0, 505, 550, 1000]
+    assert index.texts == ('d', 'c', 'b', 'a')
+
+def test_text_without_time_tags():
+    index = LyricIndex.parse("纯文本歌词\n第二行")
+    assert len(index) == 0
+    assert index.line_at(5000) == -1
+    assert index.to_dict() == {'times': [], 'texts': [], 'offset_ms': 0, 'plain': '纯文本歌词\n第二行'}
+    assert len(LyricIndex.parse(None)) == 0
@@ -0,0 +1,148 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import music_api_handler as api
+
+FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+AUDIO = FRAME * 1500
+ETAG = '"v1"'
+
+class AudioServer:
+    """提供 AUDIO 的本地 HTTP 服务，支持 Range/If-Range；fail_after 不为空时只发送这么多字节后断开。"""
+
+    def __init__(self):
+        self.requests = []
+        self.fail_after = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                range_header = self.headers.get('Range')
+                server.requests.append((self.path, range_header, self.headers.get('If-Range')))
+                start = 0
+                if range_header and self.headers.get('If-Range') in (None, ETAG):
+                    start = int(range_header.split('=')[1].split('-')[0])
+                body = AUDIO[start:]
+                self.send_response(206 if start else 200)
+                self.send_header('Content-Type', 'audio/mpeg')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', ETAG)
+                if start:
+                    self.send_header('Content-Range', f"bytes {start}-{len(AUDIO) - 1}/{len(AUDIO)}")
+                self.end_headers()
+                if server.fail_after is not None:
+                    self.wfile.write(body[:server.fail_after])
+                    server.fail_after = None
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path='/song.mp3'):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server():
+    api.configure_http_client(retry_total=0)
+    server = AudioServer()
+    yield server
+    server.close()
+
+def song_details(server, path='/song.mp3'):
+    return {'title': 'Title', 'singer': 'Singer', 'url': server.url(path)}
+
+def downloaded_audio(static_dir):
+    """去掉开头的 ID3v2 标签后的音频数据。"""
+    with open(os.path.join(static_dir, 'downloads', 'Title - Singer.mp3'), 'rb') as f:
+        data = f.read()
+    if data[:3] != b'ID3':
+        return data
+    return data[10 + sum((byte & 0x7f) << (7 * (3 - i)) for i, byte in enumerate(data[6:10])):]
+
+def test_interrupted_download_resumes_with_range(server, tmp_path):
+    static_dir = str(tmp_path)
+    details = song_details(server)
+    server.fail_after = 300000
+    path, ok, _ = api.download_song_assets_for_web(details, static_dir)
+    assert not ok and path is None
+    _, part_path, sidecar_path = api.partial_download_paths(details, static_dir)
+    assert os.path.exists(part_path) and os.path.exists(sidecar_path)
+
+    path, ok, _ = api.download_song_assets_for_web(details, static_dir)
+    assert ok and path == 'downloads/Title - Singer.mp3'
+    resumed = server.requests[-1]
+    assert resumed[1].startswith('bytes=') and resumed[1] != 'bytes=0-'
+    assert resumed[2] == ETAG
+    assert downloaded_audio(static_dir) == AUDIO
+    assert not os.path.exists(part_path) and not os.path.exists(sidecar_path)
+
+def test_partial_from_another_url_is_not_resumed(server, tmp_path):
+    static_dir = str(tmp_path)
+    server.fail_after = 300000
+    api.download_song_assets_for_web(song_details(server, '/old.mp3'), static_dir)
+
+    path, ok, _ = api.download_song_assets_for_web(song_details(server, '/new.mp3'), static_dir)
+    assert ok
+    assert server.requests[-1] == ('/new.mp3', None, None)
+    assert downloaded_audio(static_dir) == AUDIO
+
+def test_complete_partial_skips_upstream(server, tmp_path):
+    static_dir = str(tmp_path)
+    details = song_details(server)
+    _, part_path, sidecar_path = api.partial_download_paths(details, static_dir)
+    os.makedirs(os.path.dirname(part_path))
+    with open(part_path, 'wb') as f:
+        f.write(AUDIO)
+    api._write_partial_sidecar(sidecar_path, {'url': details['url'], 'etag': ETAG, 'total_length': len(AUDIO),
+                                              'extension': '.mp3', 'header_length': 0, 'bytes_written': len(AUDIO)})
+
+    path, ok, _, content_info = api.download_song_assets_for_web(details, static_dir, return_content_info=True)
+    assert ok
+    assert server.requests == []
+    assert downloaded_audio(static_dir) == AUDIO
+    assert content_info[1] == os.path.getsize(os.path.join(static_dir, path))
+
+def test_locked_partial_is_shared_not_duplicated(server, tmp_path):
+    static_dir = str(tmp_path)
+    details = song_details(server)
+    partial_key, part_path, sidecar_path = api.partial_download_paths(details, static_dir)
+    os.makedirs(os.path.dirname(part_path))
+    lock = api._acquire_partial_lock(partial_key)
+
+    def finish_other_writer():
+        with open(part_path, 'wb') as f:
+            f.write(AUDIO[:100000])
+        api._write_partial_sidecar(sidecar_path, {'url': details['url'], 'etag': ETAG, 'total_length': len(AUDIO),
+                                                  'extension': '.mp3', 'header_length': 0, 'bytes_written': 100000})
+        lock.release()
+
+    timer = threading.Timer(0.2, finish_other_writer)
+    timer.start()
+    path, ok, _ = api.download_song_assets_for_web(details, static_dir)
+    timer.join()
+    assert ok
+    assert server.requests == [('/song.mp3', 'bytes=100000-', ETAG)]
+    assert os.listdir(os.path.join(static_dir, 'temp')) == []
+
+def test_recover_keeps_resumable_partials(tmp_path):
+    temp_dir = tmp_path / 'temp'
+    temp_dir.mkdir()
+    (temp_dir / 'partial_a.part').write_bytes(b'x' * 10)
+    (temp_dir / 'partial_a.part.json').write_text('{"url": "http://x/a.mp3"}')
+    (temp_dir / 'partial_b.part').write_bytes(b'x' * 10) # 没有描述文件，无法续传
+    (temp_dir / 'partial_c.part.json').write_text('{}')  # 只有描述文件
+    assert api.recover_partial_downloads(str(tmp_path)) == (1, 2)
+    assert sorted(os.listdir(temp_dir)) == ['partial_a.part', 'partial_a.part.json']
@@ -0,0 +1,84 @@
+import io
+import threading
+import zipfile
+
+import playlist_export
+
+def write_files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"song{i}.mp3"
+        path.write_bytes(bytes([i]) * (100000 + i))
+        paths.append(str(path))
+    return paths
+
+def test_zip_contains_every_file_and_a_failure_list(tmp_path):
+    paths = write_files(tmp_path, 4)
+    items = [{'title': f"Song {i}", 'singer': 'Singer', 'path': path} for i, path in enumerate(paths)]
+    items.insert(2, {'title': 'Missing', 'singer': 'Nobody', 'path': None})
+
+    def resolve(item):
+        return (item['path'], None) if item['path'] else (None, '无法获取播放链接')
+
+    data = b''.join(playlist_export.iter_zip_stream(items, resolve))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        names = set(zf.namelist())
+        assert names == {'001 - song0.mp3', '002 - song1.mp3', '004 - song2.mp3', '005 - song3.mp3',
+                         playlist_export.EXPORT_FAILURES_FILENAME}
+        assert zf.read('005 - song3.mp3') == bytes([3]) * 100003
+        failures = zf.read(playlist_export.EXPORT_FAILURES_FILENAME).decode('utf-8')
+        assert failures == '003\tMissing - Nobody\t无法获取播放链接\n'
+
+def test_output_is_streamed_in_chunks(tmp_path):
+    paths = write_files(tmp_path, 3)
+    chunks = list(playlist_export.iter_zip_stream(paths, lambda path: (path, None)))
+    assert max(len(chunk) for chunk in chunks) <= 2 * playlist_export.EXPORT_CHUNK_SIZE
+    assert len(chunks) > 3
+
+def test_duplicate_names_are_made_unique(tmp_path):
+    path = write_files(tmp_path, 1)[0]
+    used = set()
+    assert playlist_export._unique_arcname('a.mp3', used) == 'a.mp3'
+    assert playlist_export._unique_arcname('a.mp3', used) == 'a (2).mp3'
+    data = b''.join(playlist_export.iter_zip_stream([path, path], lambda p: (p, None)))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert sorted(zf.namelist()) == ['001 - song0.mp3', '002 - song0.mp3']
+
+def test_resolver_errors_do_not_abort_the_export(tmp_path):
+    paths = write_files(tmp_path, 2)
+
+    def resolve(path):
+        if path == paths[0]:
+            raise RuntimeError('boom')
+        return path, None
+
+    data = b''.join(playlist_export.iter_zip_stream(paths, resolve))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert '002 - song1.mp3' in zf.namelist()
+        assert 'boom' in zf.read(playlist_export.EXPORT_FAILURES_FILENAME).decode('utf-8')
+
+def test_exports_share_the_bounded_executor(tmp_path):
+    paths = write_files(tmp_path, 6)
+    release = threading.Event()
+    running = []
+    lock = threading.Lock()
+    peak = [0]
+
+    def resolve(path):
+        with lock:
+            running.append(path)
+            peak[0] = max(peak[0], len(running))
+        release.wait(5)
+        with lock:
+            running.remove(path)
+        return path, None
+
+    streams = [playlist_export.iter_zip_stream(paths, resolve) for _ in range(4)]
+    threads = [threading.Thread(target=lambda s=s: b''.join(s)) for s in streams]
+    for thread in threads:
+        thread.start()
+    threading.Timer(0.3, release.set).start()
+    for thread in threads:
+        thread.join(10)
+    assert peak[0] <= playlist_export.EXPORT_POOL_WORKERS
@@ -0,0 +1,52 @@
+def make_songs(count, prefix='Song'):
+    return [{'song_api_index': i, 'song_query': 'q', 'title': f"{prefix} {i}", 'singer': 'Singer', 'cover': ''}
+            for i in range(1, count + 1)]
+
+def collect_pages(db, playlist_id, limit, search=None):
+    pages, after = [], None
+    while True:
+        songs, next_cursor = db.get_playlist_songs_page(playlist_id, limit=limit, after=after, search=search)
+        pages.append([song['title'] for song in songs])
+        if next_cursor is None:
+            return pages
+        after = db.decode_song_cursor(next_cursor)
+        assert after is not None
+
+def test_pages_cover_every_song_once(db):
+    user = db.create_user('alice')
+    playlist_id = db.create_playlist(user['id'], 'mix')
+    # 一个事务内写入，added_at 全部相同，顺序只能由 id 决定
+    assert all(db.add_songs_to_playlist(playlist_id, make_songs(7)))
+
+    pages = collect_pages(db, playlist_id, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    titles = [title for page in pages for title in page]
+    assert titles == [f"Song {i}" for i in range(7, 0, -1)]
+
+def test_exact_multiple_has_no_empty_last_page(db):
+    user = db.create_user('alice')
+    playlist_id = db.create_playlist(user['id'], 'mix')
+    db.add_songs_to_playlist(playlist_id, make_songs(4))
+    assert [len(page) for page in collect_pages(db, playlist_id, limit=2)] == [2, 2]
+
+def test_search_filters_and_escapes_wildcards(db):
+    user = db.create_user('alice')
+    playlist_id = db.create_playlist(user['id'], 'mix')
+    songs = make_songs(3) + [{'song_api_index': 9, 'song_query': 'q', 'title': '100% Pure', 'singer': 'X', 'cover': ''}]
+    db.add_songs_to_playlist(playlist_id, songs)
+
+    assert collect_pages(db, playlist_id, limit=2, search='song') == [['Song 3', 'Song 2'], ['Song 1']]
+    assert collect_pages(db, playlist_id, limit=10, search='%') == [['100% Pure']]
+
+def test_other_playlists_are_not_included(db):
+    user = db.create_user('alice')
+    first = db.create_playlist(user['id'], 'a')
+    second = db.create_playlist(user['id'], 'b')
+    db.add_songs_to_playlist(first, make_songs(2))
+    db.add_songs_to_playlist(second, make_songs(3, prefix='Other'))
+    assert collect_pages(db, first, limit=10) == [['Song 2', 'Song 1']]
+
+def test_malformed_cursor_is_rejected(db):
+    assert db.decode_song_cursor('garbage') is None
+    assert db.decode_song_cursor('20240101000000-x') is None
+    assert db.decode_song_cursor(None) is None
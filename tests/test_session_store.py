@@ -0,0 +1,113 @@
+import time
+
+import pytest
+from flask import Flask, session
+
+import session_store
+from cache_utils import MISSING
+
+@pytest.fixture(params=['sqlite', 'file'])
+def store(request, tmp_path):
+    path = tmp_path / ('sessions.db' if request.param == 'sqlite' else 'sessions')
+    return session_store.create_store(request.param, str(path))
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        session_store.SessionStore()
+
+def test_save_get_and_delete_keys(store):
+    expires_at = time.time() + 60
+    store.save('sid1', {'a': '1', 'b': '2'}, [], expires_at)
+    assert store.get('sid1', 'a')[0] == '1'
+    assert store.items('sid1')[0] == {'a': '1', 'b': '2'}
+    store.save('sid1', {}, ['a'], expires_at)
+    assert store.get('sid1', 'a') == (MISSING, None)
+    assert store.exists('sid1')
+    store.delete('sid1')
+    assert not store.exists('sid1')
+    assert store.items('sid1') == ({}, None)
+
+def test_expired_session_is_invisible_and_cleaned_up(store):
+    store.save('old', {'a': '1'}, [], time.time() - 1)
+    store.save('new', {'a': '1'}, [], time.time() + 60)
+    assert store.get('old', 'a') == (MISSING, None)
+    assert not store.exists('old')
+    assert store.cleanup() >= 1
+    assert store.exists('new')
+
+def test_expired_keys_do_not_come_back_on_save(store):
+    store.save('sid1', {'a': '1'}, [], time.time() - 1)
+    store.save('sid1', {'b': '2'}, [], time.time() + 60)
+    assert store.items('sid1')[0] == {'b': '2'}
+
+class CountingStore(session_store.SQLiteSessionStore):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.gets = []
+
+    def get(self, sid, key):
+        self.gets.append(key)
+        return super().get(sid, key)
+
+@pytest.fixture
+def app_and_store(tmp_path):
+    store = CountingStore(str(tmp_path / 'sessions.db'))
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = session_store.ServerSideSessionInterface(store)
+
+    @app.route('/set')
+    def set_values():
+        session['user_id'] = 7
+        session['history'] = list(range(100))
+        return 'ok'
+
+    @app.route('/user')
+    def user():
+        return str(session.get('user_id'))
+
+    @app.route('/login')
+    def login():
+        session.regenerate()
+        session['logged_in'] = True
+        return 'ok'
+
+    return app, store
+
+def session_cookie(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie else None
+
+def test_cookie_holds_only_the_session_id(app_and_store):
+    app, store = app_and_store
+    client = app.test_client()
+    client.get('/set')
+    sid = session_cookie(client)
+    assert session_store.SESSION_ID_REGEX.match(sid)
+    assert store.items(sid)[0].keys() == {'user_id', 'history'}
+
+def test_keys_are_loaded_lazily(app_and_store):
+    app, store = app_and_store
+    client = app.test_client()
+    client.get('/set')
+    store.gets.clear()
+    assert client.get('/user').get_data(as_text=True) == '7'
+    assert store.gets == ['user_id']
+
+def test_regenerate_changes_id_and_keeps_data(app_and_store):
+    app, store = app_and_store
+    client = app.test_client()
+    client.get('/set')
+    old_sid = session_cookie(client)
+    client.get('/login')
+    new_sid = session_cookie(client)
+    assert new_sid != old_sid
+    assert not store.exists(old_sid)
+    assert store.items(new_sid)[0].keys() == {'user_id', 'history', 'logged_in'}
+
+def test_unknown_session_id_is_not_adopted(app_and_store):
+    app, store = app_and_store
+    client = app.test_client()
+    client.set_cookie('session', 'x' * 40)
+    client.get('/set')
+    assert session_cookie(client) != 'x' * 40
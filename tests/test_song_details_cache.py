@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import music_api_handler as api
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(time, 'time', clock.time)
+    monkeypatch.setattr(time, 'monotonic', clock.monotonic)
+    return clock
+
+@pytest.fixture
+def upstream(monkeypatch, clock):
+    """上游每次返回新的播放链接和新的标题，记录请求次数。"""
+    calls = []
+
+    def get_details(query, song_number):
+        calls.append((query, song_number))
+        n = len(calls)
+        return {'title': f"Title v{n}", 'singer': 'Singer', 'url': f"http://x/{n}.mp3", 'lyric': '[00:01.00]a'}
+
+    monkeypatch.setattr(api, '_get_song_details_uncached', get_details)
+    old_ttl, old_url_ttl = api._details_cache.ttl_seconds, api.PLAY_URL_TTL_SECONDS
+    api.configure_song_details_cache(ttl_seconds=1000, url_ttl_seconds=100)
+    api.invalidate_song_details_cache()
+    yield calls
+    api.configure_song_details_cache(ttl_seconds=old_ttl, url_ttl_seconds=old_url_ttl)
+    api.invalidate_song_details_cache()
+
+def test_url_refresh_keeps_the_stable_fields(upstream, clock):
+    first = api.get_song_details('q', 1)
+    assert first['url'] == 'http://x/1.mp3' and first['title'] == 'Title v1'
+    assert api.get_song_details('q', 1)['url'] == 'http://x/1.mp3'
+    assert len(upstream) == 1
+
+    clock.now += 100 - api.PLAY_URL_EXPIRY_MARGIN_SECONDS
+    refreshed = api.get_song_details('q', 1)
+    assert len(upstream) == 2
+    assert refreshed['url'] == 'http://x/2.mp3'
+    assert refreshed['title'] == 'Title v1'
+    assert refreshed['lyric_index'] is first['lyric_index']
+
+def test_url_refreshes_do_not_extend_the_stable_fields(upstream, clock):
+    api.get_song_details('q', 1)
+    start = clock.now
+    while clock.now + 80 < start + 1000:
+        clock.now += 80 # 播放链接每次都已过期，只刷新 url
+        assert api.get_song_details('q', 1)['title'] == 'Title v1'
+    refreshes = len(upstream)
+    assert refreshes > 2
+
+    clock.now = start + 1000
+    details = api.get_song_details('q', 1)
+    assert len(upstream) == refreshes + 1
+    assert details['title'] == f"Title v{refreshes + 1}"
+
+def test_expired_entry_refetches_everything(upstream, clock):
+    api.get_song_details('q', 1)
+    clock.now += 1000
+    details = api.get_song_details('q', 1)
+    assert details['title'] == 'Title v2' and details['url'] == 'http://x/2.mp3'
+    # 新条目重新获得完整的有效期
+    clock.now += 999 - api.PLAY_URL_EXPIRY_MARGIN_SECONDS
+    assert api.get_song_details('q', 1)['title'] == 'Title v2'
@@ -0,0 +1,37 @@
+import threading
+import time
+
+import requests
+
+import music_api_handler as api
+import stream_proxy
+
+class FailingSession:
+    def __init__(self, before_request):
+        self.before_request = before_request
+
+    def get(self, *args, **kwargs):
+        self.before_request()
+        raise requests.exceptions.ConnectionError('offline')
+
+def test_player_can_always_stop_a_prefetch_holding_the_partial_lock(monkeypatch, tmp_path):
+    """预取取得断点文件锁后，get_tee 取锁失败时必须能找到并通知这个预取。"""
+    details = {'title': 'Title', 'singer': 'Singer', 'url': 'http://x/song.mp3'}
+    results = []
+    checks = []
+    acquire = api._acquire_partial_lock
+
+    def acquire_then_race(partial_key, timeout=None):
+        lock = acquire(partial_key, timeout=timeout)
+        # 模拟播放请求紧接着发现锁被占用、尝试让预取停止
+        check = threading.Thread(target=lambda: results.append(stream_proxy._stop_head_prefetch(partial_key)))
+        check.start()
+        checks.append(check)
+        time.sleep(0.05)
+        return lock
+
+    monkeypatch.setattr(api, '_acquire_partial_lock', acquire_then_race)
+    monkeypatch.setattr(api, 'get_http_session', lambda: FailingSession(lambda: checks[0].join(5)))
+    assert stream_proxy.prefetch_head(details, str(tmp_path), 1024) == 0
+    assert results == [True]
+    assert stream_proxy._head_prefetches == {}